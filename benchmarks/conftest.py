@@ -0,0 +1,114 @@
+"""
+Fixtures of the benchmark suite.
+
+Sizes are set with BENCH_SIZES (comma separated number of settlements, default 1000).
+Upserts go to a fake connection unless BENCH_DB_URL points to a throwaway Postgres.
+"""
+
+import os
+
+import polars as pl
+import psycopg2
+import pytest
+
+from cow_amm_trade_envy.configs import EnvyCalculatorConfig
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.indexes import PriceIndex
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+from benchmarks.fakes import BENCH_TABLE, FakeConnection, FakeHelper
+from benchmarks.synthetic import make_prices, make_settlements
+
+NETWORK = "ethereum"
+SIZES = [int(n) for n in os.getenv("BENCH_SIZES", "1000").split(",")]
+ENVY_COLUMNS = [
+    "call_tx_hash",
+    "block_number",
+    "block_time",
+    "trade_index",
+    "pool",
+    "pool_name",
+    "solver",
+    "trade_envy",
+    "pool_used_already",
+    "surplus_token1",
+    "conversion_rate",
+    "gas_price",
+    "gas_cost_estimate",
+]
+
+
+@pytest.fixture(autouse=True)
+def reset_instrumentation():
+    # the timed functions would otherwise collect durations over all rounds
+    yield
+    instrumentation.reset()
+
+
+@pytest.fixture(scope="session", params=SIZES, ids=lambda n: f"n={n}")
+def settlements(request):
+    return make_settlements(request.param, NETWORK)
+
+
+@pytest.fixture(scope="session")
+def calculator(settlements):
+    prices = make_prices(
+        NETWORK,
+        int(settlements["call_block_number"].min()),
+        int(settlements["call_block_number"].max()),
+    )
+    return TradeEnvyCalculator(
+        EnvyCalculatorConfig(network=NETWORK),
+        helper=FakeHelper(NETWORK),
+        data_fetcher=PriceIndex(NETWORK, prices),
+    )
+
+
+@pytest.fixture(scope="session")
+def envy_per_settlement(calculator, settlements):
+    return [
+        calculator.calc_envy_per_settlement(row) for _, row in settlements.iterrows()
+    ]
+
+
+@pytest.fixture(scope="session")
+def envy_data(calculator, settlements, envy_per_settlement):
+    return calculator.build_envy_data(pl.from_pandas(settlements), envy_per_settlement)
+
+
+@pytest.fixture
+def db_conn():
+    db_url = os.getenv("BENCH_DB_URL")
+    if db_url is None:
+        yield FakeConnection(ENVY_COLUMNS, ["call_tx_hash", "trade_index"])
+        return
+
+    conn = psycopg2.connect(db_url)
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS trade_envy;")
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS trade_envy.{BENCH_TABLE} (
+                call_tx_hash TEXT,
+                block_number INTEGER,
+                block_time TIMESTAMP,
+                trade_index INTEGER,
+                pool TEXT,
+                pool_name TEXT,
+                solver TEXT,
+                trade_envy NUMERIC,
+                pool_used_already BOOLEAN,
+                surplus_token1 NUMERIC,
+                conversion_rate NUMERIC,
+                gas_price NUMERIC,
+                gas_cost_estimate INTEGER,
+                PRIMARY KEY (call_tx_hash, trade_index)
+            );
+            """
+        )
+    conn.commit()
+    yield conn
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE trade_envy.{BENCH_TABLE};")
+    conn.commit()
+    conn.close()
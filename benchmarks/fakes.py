@@ -0,0 +1,127 @@
+"""
+In-process stand-ins for the node and Postgres, so that the benchmarks measure our
+code and not the network.
+"""
+
+from typing import List, Optional
+
+from psycopg2.extensions import adapt
+from web3.providers.base import BaseProvider
+
+from cow_amm_trade_envy import helper_math
+from cow_amm_trade_envy.models import BCowPool, CoWAmmOrderData
+
+from benchmarks.synthetic import pool_reserves
+
+BENCH_TABLE = "bench_envy"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+class FakeHelper:
+    """Answers helper queries with the local order math on synthetic reserves."""
+
+    contract_partial_cow_deployment = 20963124
+
+    def __init__(self, network: str, pool_usage_ratio: float = 0.2):
+        self.network = network
+        self.pool_usage_ratio = pool_usage_ratio
+
+    def order(self, pool: BCowPool, prices: list, block_num: int) -> CoWAmmOrderData:
+        order = helper_math.pool_order(pool, pool_reserves(pool, block_num), prices)
+        return CoWAmmOrderData.from_order_response(order, self.network)
+
+    def order_from_buy_amount(
+        self, pool: BCowPool, buy_token: str, buy_amount: int, block_num: int
+    ) -> Optional[CoWAmmOrderData]:
+        if block_num <= self.contract_partial_cow_deployment:
+            return None
+        order = helper_math.pool_order_from_buy_amount(
+            pool, pool_reserves(pool, block_num), buy_token, buy_amount
+        )
+        return CoWAmmOrderData.from_order_response(order, self.network)
+
+    def get_logs_batch(self, tx_hashes: List[str]) -> List[List[dict]]:
+        """Receipts with a few transfer logs, some of them touching a pool."""
+        logs = []
+        for tx_hash in tx_hashes:
+            seed = int(tx_hash[2:10], 16)
+            topics = [TRANSFER_TOPIC, "0x" + "0" * 24 + tx_hash[2:42]]
+            if seed % 100 < self.pool_usage_ratio * 100:
+                topics.append(
+                    "0x" + "0" * 24 + "f08d4dea369c456d26a3168ff0024b904f2d8b91"
+                )
+            logs.append([{"topics": topics, "data": "0x" + tx_hash[2:66]}] * 8)
+        return logs
+
+    def report_dedup(self):
+        pass
+
+
+class StaticNode(BaseProvider):
+    """Answers every eth_call with the same return data, without network."""
+
+    def __init__(self, return_data: bytes):
+        super().__init__()
+        self.result = "0x" + return_data.hex()
+        self.n_requests = 0
+
+    def make_request(self, method, params):
+        self.n_requests += 1
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 0, "result": "0x1"}
+        return {"jsonrpc": "2.0", "id": 0, "result": self.result}
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+class FakeCursor:
+    """Enough of a psycopg2 cursor for `upsert_data` (incl. execute_values)."""
+
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def mogrify(self, query: bytes, args) -> bytes:
+        return query % tuple(adapt(arg).getquoted() for arg in args)
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            self.connection.bytes_sent += len(query)
+            self.result = []
+        elif "information_schema.columns" in query:
+            self.result = [(column,) for column in self.connection.columns]
+        elif "PRIMARY KEY" in query:
+            self.result = [(column,) for column in self.connection.primary_keys]
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    encoding = "UTF8"
+
+    def __init__(self, columns: List[str], primary_keys: List[str]):
+        self.columns = columns
+        self.primary_keys = primary_keys
+        self.bytes_sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
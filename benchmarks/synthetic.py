@@ -0,0 +1,162 @@
+"""
+Synthetic `{network}_settle` rows and the data the envy calculation needs for them.
+
+Settlements are generated with a fixed seed so that runs are comparable. About half
+of the trades are on a pair of a CoW AMM pool, the rest on unsupported tokens, and
+the clearing prices deviate from the pool price by up to a few percent so that the
+helper has an order to offer.
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from cow_amm_trade_envy.models import BCowPool, Token, pools_factory, tokens_factory
+
+# rough USD prices, only the ratios matter
+USD_PRICES = {
+    "USDC": 1,
+    "WETH": 3_000,
+    "BAL": 2,
+    "UNI": 10,
+    "COW": 0.5,
+    "wstETH": 3_500,
+    "DOG": 0.005,
+    "GNO": 200,
+    "sDAI": 1.1,
+    "SAFE": 0.6,
+    "OLAS": 1,
+    "WxDai": 1,
+}
+POOL_TVL_USD = 2_000_000
+FIRST_BLOCK = 21_000_000
+
+
+def ucp_price(token: Token, usd_price: float) -> int:
+    # the clearing price of a token is proportional to its price per atom
+    return int(usd_price * 10**12) * 10 ** (36 - 12 - token.decimals)
+
+
+def pool_reserves(pool: BCowPool, block_num: int) -> Tuple[int, int]:
+    """Balances of a pool that drift slowly with the block number."""
+    drift = 1 + 0.05 * np.sin(block_num / 1000 + int(pool.ADDRESS, 16) % 7)
+    value = POOL_TVL_USD / 2
+    reserve0 = int(value * drift / USD_PRICES[pool.TOKEN0.name] * 10**6)
+    reserve1 = int(value / drift / USD_PRICES[pool.TOKEN1.name] * 10**6)
+    return (
+        reserve0 * 10 ** (pool.TOKEN0.decimals - 6),
+        reserve1 * 10 ** (pool.TOKEN1.decimals - 6),
+    )
+
+
+def random_address(rng: np.random.Generator) -> str:
+    return "0x" + rng.bytes(20).hex()
+
+
+def make_settlement(
+    rng: np.random.Generator, pools: List[BCowPool], block_num: int
+) -> Dict:
+    n_trades = int(rng.integers(1, 4))
+    tokens, prices, trades_data = [], [], []
+    trades = []
+    for _ in range(n_trades):
+        if rng.random() < 0.5:
+            pool = pools[int(rng.integers(len(pools)))]
+            sell, buy = (
+                (pool.TOKEN0, pool.TOKEN1)
+                if rng.random() < 0.5
+                else (pool.TOKEN1, pool.TOKEN0)
+            )
+            # clearing prices away from the pool price, so that the pool has an order
+            deviation = 1 + rng.choice([-1, 1]) * rng.uniform(0.005, 0.03)
+            pool_reserve0, pool_reserve1 = pool_reserves(pool, block_num)
+            price0 = ucp_price(pool.TOKEN0, USD_PRICES[pool.TOKEN0.name])
+            price1 = price0 * pool_reserve0 // pool_reserve1
+            price0 = int(price0 * deviation)
+            token_prices = {pool.TOKEN0.address: price0, pool.TOKEN1.address: price1}
+            sell_address, buy_address = sell.address, buy.address
+            sell_usd = USD_PRICES[sell.name]
+            sell_decimals = sell.decimals
+        else:
+            sell_address, buy_address = random_address(rng), random_address(rng)
+            token_prices = {
+                sell_address: int(rng.integers(10**8, 10**10)) * 10**9,
+                buy_address: int(rng.integers(10**8, 10**10)) * 10**9,
+            }
+            sell_usd, sell_decimals = 1, 18
+
+        for address in (sell_address, buy_address):
+            if address not in tokens:
+                tokens.append(address)
+                prices.append(token_prices[address])
+
+        sell_amount = int(rng.uniform(100, 100_000) / sell_usd * 10**sell_decimals)
+        buy_amount = (
+            sell_amount * token_prices[sell_address] // token_prices[buy_address]
+        )
+        trades.append((sell_address, buy_address, sell_amount, buy_amount))
+
+    # the trade data follows the clearing prices: (sell token, buy token) per trade
+    for sell_address, buy_address, sell_amount, buy_amount in trades:
+        tokens += [sell_address, buy_address]
+        prices += [buy_amount, sell_amount]
+        trades_data.append(
+            {
+                "sellTokenIndex": len(tokens) - 2,
+                "buyTokenIndex": len(tokens) - 1,
+                "receiver": random_address(rng),
+                "sellAmount": sell_amount,
+                "buyAmount": buy_amount,
+                "validTo": 1_800_000_000,
+                "appData": "0x" + "0" * 64,
+                "feeAmount": 0,
+                "flags": 0,
+                "executedAmount": sell_amount,
+                "signature": "0x",
+            }
+        )
+
+    return {
+        "call_tx_hash": "0x" + rng.bytes(32).hex(),
+        "contract_address": "0x9008d19f58aabd9ed0d60971565aa8510560ab41",
+        "call_success": True,
+        "call_trace_address": "[]",
+        "call_block_time": pd.Timestamp("2024-11-01")
+        + pd.Timedelta(seconds=12 * (block_num - FIRST_BLOCK)),
+        "call_block_number": block_num,
+        # formatted like the Dune results: space separated lists
+        "tokens": "[" + " ".join(tokens) + "]",
+        "clearing_prices": "[" + " ".join(str(price) for price in prices) + "]",
+        "trades": "["
+        + " ".join(json.dumps(trade, separators=(",", ":")) for trade in trades_data)
+        + "]",
+        "interactions": "[]",
+        "gas_price": int(rng.integers(10**9, 50 * 10**9)),
+        "solver": random_address(rng),
+    }
+
+
+def make_settlements(n: int, network: str = "ethereum", seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    pools = pools_factory(network).get_pools()
+    first_block = max(FIRST_BLOCK, *(pool.first_block_active for pool in pools))
+    blocks = first_block + np.sort(rng.integers(0, 10 * n, n))
+    return pd.DataFrame(
+        [make_settlement(rng, pools, int(block_num)) for block_num in blocks]
+    )
+
+
+def make_prices(network: str, first_block: int, last_block: int) -> pl.DataFrame:
+    """One price per token every 100 blocks, like the Dune price feed."""
+    tokens = tokens_factory(network)
+    blocks = list(range(first_block - first_block % 100, last_block + 1, 100))
+    rows = []
+    for token in tokens.tokens + [tokens.native]:
+        for block_num in blocks:
+            rows.append((token.address, block_num, float(USD_PRICES[token.name])))
+    return pl.DataFrame(
+        rows, schema=["token", "block_number", "price"], orient="row"
+    ).unique()
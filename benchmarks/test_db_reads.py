@@ -0,0 +1,140 @@
+"""
+Bulk reads of settlement rows: psycopg2 tuples into pandas versus COPY into polars
+(`db_utils.read_frame`).
+
+The decoding benchmarks compare the client side on BENCH_READ_ROWS rows (default 100k, `make bench-reads` uses 1M)
+without a database: the tuples as returned by `fetchall` and the CSV bytes as written
+by COPY. With BENCH_DB_URL the full reads from a throwaway Postgres are compared too.
+"""
+
+import io
+import os
+
+import pandas as pd
+import polars as pl
+import psycopg2
+import pytest
+
+from cow_amm_trade_envy.db_utils import PG_TYPES, frame_from_csv, read_frame
+
+from benchmarks.synthetic import make_settlements
+from benchmarks.test_envy_pipeline import run
+
+READ_ROWS = int(os.getenv("BENCH_READ_ROWS", "100000"))
+READ_TABLE = "bench_settle"
+SETTLE_SCHEMA = {
+    "call_tx_hash": pl.Utf8,
+    "contract_address": pl.Utf8,
+    "call_success": pl.Boolean,
+    "call_trace_address": pl.Utf8,
+    "call_block_time": pl.Datetime("us"),
+    "call_block_number": pl.Int64,
+    "tokens": pl.Utf8,
+    "clearing_prices": pl.Utf8,
+    "trades": pl.Utf8,
+    "interactions": pl.Utf8,
+    "gas_price": pl.Int64,
+    "solver": pl.Utf8,
+}
+
+
+@pytest.fixture(scope="module")
+def settle_rows() -> pl.DataFrame:
+    """READ_ROWS settlement rows, repeating 1000 synthetic settlements."""
+    df = pl.from_pandas(make_settlements(1000)).select(list(SETTLE_SCHEMA))
+    df = pl.concat([df] * (READ_ROWS // len(df) + 1)).head(READ_ROWS)
+    return df.with_columns(
+        pl.format("0x{}", pl.int_range(pl.len()).cast(pl.Utf8).str.zfill(64)).alias(
+            "call_tx_hash"
+        ),
+        pl.col("call_block_time").cast(pl.Datetime("us")),
+    )
+
+
+@pytest.fixture(scope="module")
+def copy_output(settle_rows) -> bytes:
+    """The rows as COPY ... TO STDOUT WITH (FORMAT csv, HEADER) writes them."""
+    df = settle_rows.with_columns(
+        pl.when(pl.col("call_success"))
+        .then(pl.lit("t"))
+        .otherwise(pl.lit("f"))
+        .alias("call_success")
+    )
+    return df.write_csv(datetime_format="%Y-%m-%d %H:%M:%S%.f").encode()
+
+
+def test_decode_tuples(benchmark, settle_rows):
+    rows = settle_rows.rows()
+    columns = settle_rows.columns
+    df = run(benchmark, lambda: pd.DataFrame(rows, columns=columns), len(rows))
+    benchmark.extra_info["bytes"] = int(df.memory_usage(deep=True).sum())
+
+
+def test_decode_copy_csv(benchmark, settle_rows, copy_output):
+    df = run(
+        benchmark,
+        lambda: frame_from_csv(io.BytesIO(copy_output), SETTLE_SCHEMA),
+        len(settle_rows),
+    )
+    assert df.equals(settle_rows)
+    benchmark.extra_info["bytes"] = df.estimated_size()
+
+
+@pytest.fixture(scope="module")
+def read_conn(copy_output):
+    db_url = os.getenv("BENCH_DB_URL")
+    if db_url is None:
+        pytest.skip("BENCH_DB_URL not set")
+
+    conn = psycopg2.connect(db_url)
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS trade_envy;")
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS trade_envy.{READ_TABLE} (
+                call_tx_hash TEXT PRIMARY KEY,
+                contract_address TEXT,
+                call_success BOOLEAN,
+                call_trace_address TEXT,
+                call_block_time TIMESTAMP,
+                call_block_number INTEGER,
+                tokens TEXT,
+                clearing_prices TEXT,
+                trades TEXT,
+                interactions TEXT,
+                gas_price BIGINT,
+                solver TEXT
+            );
+            """
+        )
+        cursor.copy_expert(
+            f"COPY trade_envy.{READ_TABLE} FROM STDIN WITH (FORMAT csv, HEADER)",
+            io.BytesIO(copy_output),
+        )
+    conn.commit()
+    yield conn
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE trade_envy.{READ_TABLE};")
+    conn.commit()
+    conn.close()
+
+
+def test_read_fetchall(benchmark, read_conn):
+    def read():
+        with read_conn.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM trade_envy.{READ_TABLE}")
+            return pd.DataFrame(
+                cursor.fetchall(), columns=[desc[0] for desc in cursor.description]
+            )
+
+    assert len(run(benchmark, read, READ_ROWS)) == READ_ROWS
+
+
+def test_read_frame(benchmark, read_conn):
+    df = run(
+        benchmark,
+        lambda: read_frame(read_conn, f"SELECT * FROM trade_envy.{READ_TABLE}"),
+        READ_ROWS,
+    )
+    assert len(df) == READ_ROWS
+    assert set(df.schema.values()) <= set(PG_TYPES.values()) | {pl.Utf8}
@@ -0,0 +1,101 @@
+"""
+Throughput of the per-settlement hot path and of the DB write.
+
+Every benchmark processes all synthetic settlements (or envy rows) once per round,
+the number of settlements per second is stored in the extra info of the results.
+"""
+
+import os
+
+import polars as pl
+import pytest
+
+from cow_amm_trade_envy.db_utils import upsert_data
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.models import UCP, trades_from_lists
+
+from benchmarks.fakes import BENCH_TABLE
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+
+
+def run(benchmark, fun, n: int, setup=None):
+    benchmark.extra_info["n"] = n
+    result = benchmark.pedantic(fun, setup=setup, rounds=ROUNDS, iterations=1)
+    if benchmark.stats is not None:
+        benchmark.extra_info["per_second"] = n / benchmark.stats.stats.mean
+    return result
+
+
+@pytest.fixture(scope="module")
+def rows(settlements):
+    return [row for _, row in settlements.iterrows()]
+
+
+@pytest.fixture(scope="module")
+def preprocessed_rows(rows):
+    return [TradeEnvyCalculator.preprocess_row(row) for row in rows]
+
+
+def test_preprocess_row(benchmark, rows):
+    def preprocess_all():
+        return [TradeEnvyCalculator.preprocess_row(row) for row in rows]
+
+    run(benchmark, preprocess_all, len(rows))
+
+
+def test_trades_from_lists(benchmark, preprocessed_rows, calculator):
+    network = calculator.config.network
+
+    def trades_all():
+        return [
+            trades_from_lists(
+                row["tokens"],
+                row["clearing_prices"],
+                row["trades"],
+                row["call_block_number"],
+                network,
+            )
+            for row in preprocessed_rows
+        ]
+
+    trades = run(benchmark, trades_all, len(preprocessed_rows))
+    assert any(trade is not None for settlement in trades for trade in settlement)
+
+
+def test_ucp_from_lists(benchmark, preprocessed_rows, calculator):
+    native_address = calculator.tokens.native.address
+
+    def ucp_all():
+        return [
+            UCP.from_lists(
+                row["tokens"],
+                row["clearing_prices"],
+                n_trades=len(row["trades"]),
+                native_address=native_address,
+            )
+            for row in preprocessed_rows
+        ]
+
+    run(benchmark, ucp_all, len(preprocessed_rows))
+
+
+def test_calc_envy_per_settlement(benchmark, calculator, rows):
+    def envy_all():
+        return [calculator.calc_envy_per_settlement(row) for row in rows]
+
+    envy = run(benchmark, envy_all, len(rows))
+    assert any(len(settlement_envy) > 0 for settlement_envy in envy)
+
+
+def test_check_pool_already_used(benchmark, calculator, envy_data):
+    envy = pl.from_pandas(envy_data[["call_tx_hash", "pool"]]).lazy()
+    run(
+        benchmark,
+        lambda: calculator.check_pool_already_used(envy).collect(),
+        envy_data["call_tx_hash"].nunique(),
+    )
+
+
+def test_upsert_data(benchmark, envy_data, db_conn):
+    run(benchmark, lambda: upsert_data(BENCH_TABLE, envy_data, db_conn), len(envy_data))
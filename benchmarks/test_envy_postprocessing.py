@@ -0,0 +1,39 @@
+"""
+Post-processing of the envy per settlement into envy rows (`build_envy_data`) on
+BENCH_ENVY_ROWS rows (default 100k, `make bench-envy` uses 1M), repeating the envy of
+the synthetic settlements under new transaction hashes.
+"""
+
+import os
+
+import polars as pl
+import pytest
+
+from benchmarks.test_envy_pipeline import run
+
+ENVY_ROWS = int(os.getenv("BENCH_ENVY_ROWS", "100000"))
+
+
+@pytest.fixture(scope="module")
+def envy_input(settlements, envy_per_settlement):
+    n_rows = sum(max(len(envy), 1) for envy in envy_per_settlement)
+    repeats = ENVY_ROWS // n_rows + 1
+    columns = ["call_tx_hash", "solver", "call_block_number", "call_block_time"]
+    ucp_data = pl.concat([pl.from_pandas(settlements[columns])] * repeats)
+    ucp_data = ucp_data.with_columns(
+        pl.format("0x{}", pl.int_range(pl.len()).cast(pl.Utf8).str.zfill(64)).alias(
+            "call_tx_hash"
+        )
+    )
+    return ucp_data, envy_per_settlement * repeats
+
+
+def test_build_envy_data(benchmark, calculator, envy_input):
+    ucp_data, envy_per_settlement = envy_input
+    envy_data = run(
+        benchmark,
+        lambda: calculator.build_envy_data(ucp_data, envy_per_settlement),
+        len(ucp_data),
+    )
+    benchmark.extra_info["envy_rows"] = len(envy_data)
+    assert len(envy_data) >= ENVY_ROWS
@@ -0,0 +1,96 @@
+"""
+Helper queries per second with the node mocked out (`StaticNode`): the web3 contract
+function call with the recursive `json_serializer` as it was used before, versus the
+raw calldata of `BCoWHelper.query_contract` and its cache codec.
+
+Every round makes BENCH_HELPER_CALLS (default 1000) uncached queries of `order` at
+distinct blocks.
+"""
+
+import json
+import os
+
+import pytest
+from eth_abi import encode
+from web3 import Web3
+
+from cow_amm_trade_envy import helper_math
+from cow_amm_trade_envy.configs import (
+    BCOW_FULL_COW_HELPER_ABI,
+    DataFetcherConfig,
+    PGConfig,
+    network_config_factory,
+)
+from cow_amm_trade_envy.datasources import BCoWHelper
+from cow_amm_trade_envy.models import pools_factory
+from cow_amm_trade_envy.rpc import RPCTimingMiddleware, Web3Helper
+
+from benchmarks.fakes import StaticNode
+from benchmarks.test_envy_pipeline import run
+
+HELPER_CALLS = int(os.getenv("BENCH_HELPER_CALLS", "1000"))
+NETWORK = "ethereum"
+ORDER_OUTPUTS = [
+    "(address,address,address,uint256,uint256,uint32,bytes32,uint256,bytes32,bool,bytes32,bytes32)",
+    "(address,uint256,bytes)[]",
+    "(address,uint256,bytes)[]",
+    "bytes",
+]
+PRICES = [10**25, 33347683 * 10**9]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    return pools_factory(NETWORK).get_pools()[0]
+
+
+@pytest.fixture(scope="module")
+def return_data(pool) -> bytes:
+    order = helper_math.order_response(
+        pool.TOKEN0.address, pool.TOKEN1.address, 10**9, 3 * 10**17
+    )
+    order = [
+        bytes.fromhex(field) if i in (6, 8, 10, 11) else field
+        for i, field in enumerate(order)
+    ]
+    # commit pre-interaction and EIP-1271 signature as returned by the helper
+    return encode(
+        ORDER_OUTPUTS, [order, [(pool.ADDRESS, 0, b"\x01" * 100)], [], b"\x02" * 400]
+    )
+
+
+def test_helper_call_web3(benchmark, pool, return_data):
+    w3 = Web3(StaticNode(return_data))
+    w3.middleware_onion.add(RPCTimingMiddleware, "rpc_timing")
+    contract_function = w3.eth.contract(
+        address=network_config_factory(NETWORK).contractaddr_full_cow,
+        abi=BCOW_FULL_COW_HELPER_ABI,
+    ).functions.order
+
+    def query_all():
+        for block_num in range(HELPER_CALLS):
+            fun = contract_function(pool.checksum_address, PRICES)
+            response = fun.call(block_identifier=block_num)
+            json.dumps(BCoWHelper.json_serializer(response))
+
+    run(benchmark, query_all, HELPER_CALLS)
+    benchmark.extra_info["requests"] = w3.provider.n_requests
+
+
+def test_helper_call_raw(benchmark, pool, return_data):
+    helper = BCoWHelper(
+        DataFetcherConfig(NETWORK, 0, PGConfig("postgresql://u:p@localhost:1/db"))
+    )
+    helper.w3_helper = Web3Helper("http://localhost:1")
+    helper.w3_helper.w3.provider = StaticNode(return_data)
+    contract_address = network_config_factory(NETWORK).contractaddr_full_cow
+
+    def query_all():
+        for block_num in range(HELPER_CALLS):
+            order = helper.query_contract(
+                contract_address, "order", pool, {"prices": PRICES}, block_num
+            )
+            helper.serialize_order(order)
+
+    run(benchmark, query_all, HELPER_CALLS)
+    benchmark.extra_info["requests"] = helper.w3_helper.w3.provider.n_requests
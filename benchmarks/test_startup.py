@@ -0,0 +1,46 @@
+"""
+Startup time of the library and the CLI, measured in a fresh interpreter.
+
+The slowest imports (`python -X importtime`) are stored in the extra info of the
+results, so that a regression can be traced to the module that caused it.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+ROUNDS = 5
+
+
+def import_times(module: str) -> list:
+    """(cumulative µs, module) of all imports, slowest first."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative), name.strip()))
+    return sorted(times, reverse=True)
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "cow_amm_trade_envy.envy_calculation",
+        "cow_amm_trade_envy.main",
+        "cow_amm_trade_envy.replay",
+    ],
+)
+def test_import_time(benchmark, module):
+    times = benchmark.pedantic(import_times, args=(module,), rounds=ROUNDS)
+    benchmark.extra_info["import_time_ms"] = times[0][0] / 1000
+    benchmark.extra_info["slowest_imports"] = [
+        f"{name}: {cumulative / 1000:.0f} ms" for cumulative, name in times[:10]
+    ]
@@ -1,18 +1,19 @@
 from cow_amm_trade_envy.configs import (
     DataFetcherConfig,
-    BCOW_FULL_COW_HELPER_ABI,
-    BCOW_PARTIAL_COW_HELPER_ABI,
     PGConfig,
     network_config_factory,
 )
-from typing import Optional, List, Tuple, Any
-from web3 import Web3
-from web3.types import HexBytes
-from web3.datastructures import AttributeDict
+from typing import Optional, List, Tuple, Any, Dict, Callable, TYPE_CHECKING
+from concurrent.futures import Future
+import threading
+from collections.abc import Mapping
+import datetime
+from functools import cached_property
 import json
 import pandas as pd
 import polars as pl
 import psycopg2
+from psycopg2.extras import execute_values
 import logging
 
 import spice
@@ -25,32 +26,42 @@ from cow_amm_trade_envy.models import (
     BCowPool,
     Tokens,
     Token,
+    to_checksum_address,
     tokens_factory,
 )
-from cow_amm_trade_envy.db_utils import upsert_data
-
-
-class Web3Helper:
-    def __init__(self, node_url: str):
-        self.w3 = Web3(Web3.HTTPProvider(node_url, request_kwargs={"timeout": 60}))
-        self.block_number = (
-            self.w3.eth.get_block_number()
-        )  # to keep it constant for the lifetime of the object
-
-    def get_block_number(self) -> int:
-        return self.block_number
+from cow_amm_trade_envy.db_utils import TimedCursor, upsert_data
+from cow_amm_trade_envy.indexes import PriceIndex
+from cow_amm_trade_envy.dune_archive import DuneArchive
+from cow_amm_trade_envy.helper_calldata import decode_order, encode_call
+from cow_amm_trade_envy.instrumentation import instrumentation
+from cow_amm_trade_envy.interval_sizing import AdaptiveSplitter
+from cow_amm_trade_envy.settlement_source import (
+    DuneSettlementSource,
+    NodeSettlementSource,
+    SettlementSource,
+)
 
-    def to_checksum_address(self, address: str) -> str:
-        return self.w3.to_checksum_address(address)
+if TYPE_CHECKING:
+    from cow_amm_trade_envy.rpc import Web3Helper
 
 
 class DatabaseManager:
     def __init__(self, seed_min_block_number: int, pg_config: PGConfig):
         self.seed_min_block_number = seed_min_block_number
         self.pg_config = pg_config
-        self.initialize_tables()
+        # the tables are created on the first connection, not at construction
+        self.tables_initialized = False
+        self.init_lock = threading.Lock()
 
     def connect(self):
+        with self.init_lock:
+            if not self.tables_initialized:
+                self.initialize_tables()
+                # only after success, a failed attempt is retried on the next call
+                self.tables_initialized = True
+        return self.open_connection()
+
+    def open_connection(self):
         # Get connection params from environment variables
         db_params = {
             "dbname": self.pg_config.database,
@@ -59,10 +70,11 @@ class DatabaseManager:
             "host": self.pg_config.host,
             "port": self.pg_config.port,
         }
-        return psycopg2.connect(**db_params)
+        instrumentation.count("db_connections")
+        return psycopg2.connect(**db_params, cursor_factory=TimedCursor)
 
     def initialize_tables(self):
-        with self.connect() as conn, conn.cursor() as cursor:
+        with self.open_connection() as conn, conn.cursor() as cursor:
             cursor.execute(
                 """
                 CREATE SCHEMA IF NOT EXISTS trade_envy;
@@ -102,6 +114,73 @@ class DatabaseManager:
             cursor.execute(query, (cache_key, response))
             conn.commit()
 
+    def get_pool_reserves(self, network: str, start_block: int = 0) -> pl.DataFrame:
+        table_name = f"{network}_pool_reserves"
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (f"trade_envy.{table_name}",))
+            rows = []
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(
+                    f"""
+                    SELECT pool, block_number, reserve0, reserve1
+                    FROM trade_envy.{table_name} WHERE block_number >= %s
+                    """,
+                    (start_block,),
+                )
+                rows = cursor.fetchall()
+
+        return pl.DataFrame(
+            [(pool, block, int(r0), int(r1)) for pool, block, r0, r1 in rows],
+            schema={
+                "pool": pl.Utf8,
+                "block_number": pl.Int64,
+                "reserve0": pl.Object,
+                "reserve1": pl.Object,
+            },
+            orient="row",
+        )
+
+    def get_prices(
+        self,
+        network: str,
+        tokens: List[Token],
+        start_block: int,
+        end_block: int = 2**31 - 1,
+    ) -> pl.DataFrame:
+        """Prices in the block range, incl. the last price before it (valid at its start)."""
+        price_rows = []
+        with self.connect() as conn, conn.cursor() as cursor:
+            for token in tokens:
+                table_name = f"{network}_{token.address}_price"
+                cursor.execute("SELECT to_regclass(%s)", (f"trade_envy.{table_name}",))
+                if cursor.fetchone()[0] is None:
+                    continue
+
+                cursor.execute(
+                    f"""
+                    SELECT block_number, price FROM trade_envy.{table_name}
+                    WHERE block_number <= %s AND block_number >= (
+                        SELECT COALESCE(MAX(block_number), %s)
+                        FROM trade_envy.{table_name} WHERE block_number <= %s
+                    )
+                    """,
+                    (end_block, start_block, start_block),
+                )
+                price_rows += [
+                    (token.address, int(block), float(price))
+                    for block, price in cursor.fetchall()
+                ]
+
+        return pl.DataFrame(
+            price_rows,
+            schema={
+                "token": pl.Utf8,
+                "block_number": pl.Int64,
+                "price": pl.Float64,
+            },
+            orient="row",
+        )
+
     def get_first_block_to_ingest(self, table_name: str, block_col_name: str) -> int:
         query = f"SELECT MAX({block_col_name}) FROM trade_envy.{table_name}"
 
@@ -121,29 +200,32 @@ class DatabaseManager:
 
 
 class BCoWHelper:
+    contract_partial_cow_deployment = 20963124
+
     def __init__(self, config: DataFetcherConfig):
         self.config = config
         self.db_manager = DatabaseManager(config.min_block, config.pg_config)
         self.network_config = network_config_factory(config.network)
 
-        self.w3_helper = Web3Helper(self.network_config.node_url)
+        # results of all queries of this run, identical queries share one result
+        self.results: Dict[str, Future] = {}
+        self.results_lock = threading.Lock()
+        # helper queries requested and actually made
+        self.n_requests = 0
+        self.n_unique = 0
 
-        self.contract_full_cow = self.w3_helper.w3.eth.contract(
-            address=self.network_config.contractaddr_full_cow,
-            abi=BCOW_FULL_COW_HELPER_ABI,
-        )
+    # node access is set up on first use, see rpc.py
+    @cached_property
+    def w3_helper(self) -> "Web3Helper":
+        from cow_amm_trade_envy.rpc import Web3Helper
 
-        self.contract_partial_cow = self.w3_helper.w3.eth.contract(
-            address=self.network_config.contractaddr_partial_cow,
-            abi=BCOW_PARTIAL_COW_HELPER_ABI,
-        )
-        self.contract_partial_cow_deployment = 20963124
+        return Web3Helper(self.network_config.node_url, self.config.rpc_hedge_after)
 
     @staticmethod
     def json_serializer(obj: Any) -> Any:
-        if isinstance(obj, (HexBytes, bytes)):
+        if isinstance(obj, bytes):  # incl. HexBytes
             return obj.hex()
-        if isinstance(obj, AttributeDict):
+        if isinstance(obj, Mapping) and not isinstance(obj, dict):  # AttributeDict
             return dict(obj)
         if isinstance(obj, dict):
             return {k: BCoWHelper.json_serializer(v) for k, v in obj.items()}
@@ -153,40 +235,130 @@ class BCoWHelper:
             return obj
         raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
+    @staticmethod
+    def cache_key(
+        network: str,
+        contract_address: str,
+        function_name: str,
+        pool: BCowPool,
+        params: dict,
+        block_num: int,
+    ) -> str:
+        return f"{network}_{contract_address}_{function_name}_{pool}_{json.dumps(params)}_{block_num}"
+
+    def single_flight(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Runs fn once per key; concurrent and later callers wait for its result."""
+        with self.results_lock:
+            future = self.results.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.results[key] = future
+            self.n_requests += 1
+            self.n_unique += is_owner
+
+        if is_owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                # don't keep failures, a later call can retry
+                with self.results_lock:
+                    del self.results[key]
+                future.set_exception(e)
+
+        return future.result()
+
+    @property
+    def dedup_ratio(self) -> float:
+        if self.n_requests == 0:
+            return 0.0
+        return 1 - self.n_unique / self.n_requests
+
+    def report_dedup(self):
+        print(
+            f"Helper queries: {self.n_requests} requests, {self.n_unique} unique "
+            f"({self.dedup_ratio:.1%} deduplicated)"
+        )
+
+    def clear_results(self):
+        # the results stay in the DB cache, this only bounds the memory of long runs
+        with self.results_lock:
+            self.results = {}
+            self.n_requests = 0
+            self.n_unique = 0
+
+    @staticmethod
+    def serialize_order(order: list) -> str:
+        """Cache entry of a helper response of which only the order is decoded, in the
+        layout of the full responses (order, preInteractions, postInteractions, sig)."""
+        return json.dumps([order, None, None, None], separators=(",", ":"))
+
+    @staticmethod
+    def deserialize_order(response: str) -> list:
+        # full responses cached before the raw calls have the same layout
+        return json.loads(response)[0]
+
     def query_contract(
-        self, contract_function: Any, pool: BCowPool, params: dict, block_num: int
+        self,
+        contract_address: str,
+        function_name: str,
+        pool: BCowPool,
+        params: dict,
+        block_num: int,
     ) -> list:
-        fun = contract_function(pool.checksum_address, **params)
-        response = fun.call(block_identifier=block_num)
-        return self.json_serializer(response)
+        calldata = encode_call(function_name, pool.checksum_address, params)
+        with instrumentation.timer("rpc_helper_call", pool=pool.NAME):
+            data = self.w3_helper.call(contract_address, calldata, block_num)
+        return decode_order(data)
 
+    @instrumentation.timed("fetch_from_cache_or_query")
     def fetch_from_cache_or_query(
         self,
-        contract_function: Any,
+        contract_address: str,
+        function_name: str,
         pool: BCowPool,
         params: dict,
         block_num: int,
         cache=True,
-    ) -> Any:
-        if cache:
-            cache_key = f"{self.config.network}_{contract_function.address}_{contract_function.abi_element_identifier}_{pool}_{json.dumps(params)}_{block_num}"
-            cached_response = self.db_manager.get_cached_order(cache_key)
-            if cached_response:
-                return json.loads(cached_response)
+    ) -> list:
+        """Order of the helper response, from the cache or an eth_call."""
+        cache_key = self.cache_key(
+            self.config.network,
+            contract_address,
+            function_name,
+            pool,
+            params,
+            block_num,
+        )
+
+        def fetch():
+            if cache:
+                with instrumentation.timer("db_order_cache_lookup", pool=pool.NAME):
+                    cached_response = self.db_manager.get_cached_order(cache_key)
+                if cached_response:
+                    instrumentation.count("order_cache.hit", pool=pool.NAME)
+                    return self.deserialize_order(cached_response)
+                instrumentation.count("order_cache.miss", pool=pool.NAME)
+
+            order = self.query_contract(
+                contract_address, function_name, pool, params, block_num
+            )
 
-        response = self.query_contract(contract_function, pool, params, block_num)
+            if cache:
+                self.db_manager.cache_order(cache_key, self.serialize_order(order))
 
-        if cache:
-            self.db_manager.cache_order(cache_key, json.dumps(response))
+            return order
 
-        return response
+        return self.single_flight(cache_key, fetch)
 
     def order(self, pool: BCowPool, prices: list, block_num: int) -> CoWAmmOrderData:
-        contract_function = self.contract_full_cow.functions.order
-        response = self.fetch_from_cache_or_query(
-            contract_function, pool, {"prices": prices}, block_num
+        order = self.fetch_from_cache_or_query(
+            to_checksum_address(self.network_config.contractaddr_full_cow),
+            "order",
+            pool,
+            {"prices": prices},
+            block_num,
         )
-        order, _, _, _ = response
         return CoWAmmOrderData.from_order_response(order, self.config.network)
 
     def order_from_buy_amount(
@@ -195,17 +367,20 @@ class BCoWHelper:
         if block_num <= self.contract_partial_cow_deployment:
             return None
 
-        contract_function = self.contract_partial_cow.functions.orderFromBuyAmount
         params = {
             "buyAmount": buy_amount,
-            "buyToken": self.w3_helper.to_checksum_address(buy_token),
+            "buyToken": to_checksum_address(buy_token),
         }
-        response = self.fetch_from_cache_or_query(
-            contract_function, pool, params, block_num
+        order = self.fetch_from_cache_or_query(
+            self.network_config.contractaddr_partial_cow,
+            "orderFromBuyAmount",
+            pool,
+            params,
+            block_num,
         )
-        order, _, _, _ = response
         return CoWAmmOrderData.from_order_response(order, self.config.network)
 
+    @instrumentation.timed("get_logs_batch")
     def get_logs_batch(self, tx_hashes: List[str]):
         """Fetch logs for a batch of transaction hashes from cache or blockchain."""
         cache_keys = [f"{self.config.network}_{tx_hash}" for tx_hash in tx_hashes]
@@ -221,6 +396,8 @@ class BCoWHelper:
 
         # Convert cached results to a dictionary for quick lookup
         cache_dict = {row[0]: json.loads(row[1]) for row in cached_results}
+        instrumentation.count("receipt_cache.hit", len(cache_dict))
+        instrumentation.count("receipt_cache.miss", len(cache_keys) - len(cache_dict))
 
         # Identify tx_hashes not found in the cache
         uncached_keys = [
@@ -238,7 +415,8 @@ class BCoWHelper:
             for tx_hash in tqdm(
                 uncached_tx_hashes, desc="Fetching logs from blockchain"
             ):
-                receipt = self.w3_helper.w3.eth.get_transaction_receipt(tx_hash)
+                with instrumentation.timer("rpc_receipt"):
+                    receipt = self.w3_helper.w3.eth.get_transaction_receipt(tx_hash)
                 logs = json.dumps(receipt["logs"], default=self.json_serializer)
                 uncached_logs.append((f"{self.config.network}_{tx_hash}", logs))
 
@@ -264,10 +442,31 @@ class DataFetcher:
         self.db_manager = DatabaseManager(config.min_block, config.pg_config)
 
         self.network_config = network_config_factory(config.network)
-        self.w3_helper = Web3Helper(self.network_config.node_url)
+        # tables created by this instance, the DDL is not repeated on every ingest
+        self.created_tables = set()
+        # if set, conversion rates are answered from memory instead of the price tables
+        self.price_index: Optional[PriceIndex] = None
+        self.splitters: Dict[str, AdaptiveSplitter] = {}
+
+    @cached_property
+    def w3_helper(self) -> "Web3Helper":
+        from cow_amm_trade_envy.rpc import Web3Helper
+
+        return Web3Helper(self.network_config.node_url, self.config.rpc_hedge_after)
+
+    @cached_property
+    def settlement_source(self) -> SettlementSource:
+        if self.config.settlement_source == "node":
+            return NodeSettlementSource(
+                self.w3_helper, self.config.interval_length_settle_node
+            )
+        return DuneSettlementSource(self)
 
     def create_settlement_table(self):
         table_name = f"{self.config.network}_settle"
+        if table_name in self.created_tables:
+            return
+        self.created_tables.add(table_name)
         create_table_query = f"""
         CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
             call_tx_hash TEXT PRIMARY KEY,
@@ -288,32 +487,30 @@ class DataFetcher:
             cursor.execute(create_table_query)
             conn.commit()
 
+        # trigram index to find settlements containing the tokens of a pool
+        try:
+            with self.db_manager.connect() as conn, conn.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+                cursor.execute(
+                    f"""
+                    CREATE INDEX IF NOT EXISTS {table_name}_tokens_trgm
+                    ON trade_envy.{table_name} USING gin (LOWER(tokens) gin_trgm_ops);
+                    """
+                )
+                conn.commit()
+        except psycopg2.Error as e:
+            warning(f"Could not create trigram index on {table_name}.tokens: {e}")
+
     def populate_settlement_table_by_blockrange(self, start_block: int, end_block: int):
         if start_block > end_block:
             return
 
         self.create_settlement_table()
         table_name = f"{self.config.network}_settle"
-        splits = self.split_intervals(
-            start_block, end_block, self.config.interval_length_settle
-        )
+        df = self.settlement_source.fetch(start_block, end_block)
 
-        dfs = []
-        for left, right in tqdm(
-            splits,
-            desc=f"Fetching settlement data from {start_block} to {end_block}",
-            unit="interval",
-        ):
-            params = {
-                "start_block": left,
-                "end_block": right,
-                "network": self.config.network,
-            }
-            df = self.query_dune_data(self.config.dune_query_settle, params)
-            dfs.append(df)
-
-        if dfs:
-            df = pl.concat(dfs).to_pandas()
+        if df is not None and len(df) > 0:
+            df = df.to_pandas()
             df["gas_price"] = df["gas_price"].astype(int)
 
             with self.db_manager.connect() as conn:
@@ -341,9 +538,162 @@ class DataFetcher:
             for start in range(beginning_block, current_block + 1, interval_len)
         ]
 
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
+    @staticmethod
+    def plan_price_windows(
+        blocks: List[int], max_gap: int, max_length: int
+    ) -> List[Tuple[int, int]]:
+        """Merges sorted blocks into windows (inclusive), starting a new window when the
+        gap to the previous block exceeds max_gap or the window would exceed max_length."""
+        windows = []
+        for block in blocks:
+            if (
+                windows
+                and block - windows[-1][1] <= max_gap
+                and block - windows[-1][0] < max_length
+            ):
+                windows[-1] = (windows[-1][0], block)
+            else:
+                windows.append((block, block))
+        return windows
+
+    def create_interval_stats_table(self):
+        if "dune_interval_stats" in self.created_tables:
+            return
+        self.created_tables.add("dune_interval_stats")
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trade_envy.dune_interval_stats (
+                    network TEXT,
+                    dataset TEXT,
+                    rows_per_block DOUBLE PRECISION,
+                    seconds_per_block DOUBLE PRECISION,
+                    PRIMARY KEY (network, dataset)
+                );
+                """
+            )
+            conn.commit()
+
+    def get_splitter(self, dataset: str, default_length: int) -> AdaptiveSplitter:
+        """Adaptive splitter of a dataset, starting from the stored estimates."""
+        if dataset in self.splitters:
+            return self.splitters[dataset]
+        self.create_interval_stats_table()
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT rows_per_block, seconds_per_block
+                FROM trade_envy.dune_interval_stats
+                WHERE network = %s AND dataset = %s
+                """,
+                (self.config.network, dataset),
+            )
+            row = cursor.fetchone()
+        rows_per_block, seconds_per_block = row if row is not None else (None, None)
+        splitter = AdaptiveSplitter(
+            dataset,
+            default_length,
+            self.config.target_rows_per_query,
+            self.config.target_seconds_per_query,
+            rows_per_block=rows_per_block,
+            seconds_per_block=seconds_per_block,
+        )
+        self.splitters[dataset] = splitter
+        return splitter
+
+    def save_splitter(self, splitter: AdaptiveSplitter):
+        if splitter.rows_per_block is None:
+            return
+        df = pd.DataFrame(
+            {
+                "network": [self.config.network],
+                "dataset": [splitter.dataset],
+                "rows_per_block": [splitter.rows_per_block],
+                "seconds_per_block": [splitter.seconds_per_block],
+            }
+        )
+        with self.db_manager.connect() as conn:
+            upsert_data("dune_interval_stats", df, conn)
+
+    def query_dune_intervals(
+        self,
+        query_nr: int,
+        params: dict,
+        start_block: int,
+        end_block: int,
+        interval_length: int,
+        dataset: str,
+        desc: str,
+    ) -> List[pl.DataFrame]:
+        """Results of a Dune query with start_block/end_block parameters for the block
+        range (inclusive), in intervals of interval_length or adaptive ones."""
+
+        def query(left: int, right: int) -> pl.DataFrame:
+            return self.query_dune_data(
+                query_nr, {**params, "start_block": left, "end_block": right}
+            )
+
+        if self.config.adaptive_intervals:
+            splitter = self.get_splitter(dataset, interval_length)
+            dfs = splitter.fetch(start_block, end_block, query, desc)
+            self.save_splitter(splitter)
+            return dfs
+
+        splits = self.split_intervals(start_block, end_block, interval_length)
+        return [
+            query(left, right)
+            for left, right in tqdm(splits, desc=desc, unit="interval")
+        ]
+
+    @cached_property
+    def dune_archive(self) -> Optional[DuneArchive]:
+        if self.config.dune_archive_dir is None:
+            return None
+        return DuneArchive(self.config.dune_archive_dir)
+
     def query_dune_data(self, query_nr: int, parameters: dict) -> pl.DataFrame:
-        return spice.query(query_nr, parameters=parameters, verbose=False)
+        """Results of the query, from the archive if it has been run with the same
+        parameters before."""
+        archive = self.dune_archive
+        if archive is None:
+            return self.execute_dune_query(query_nr, parameters)
+
+        df = archive.load(query_nr, parameters)
+        if df is not None:
+            instrumentation.count("dune_archive_hits")
+            return df
+        df = self.execute_dune_query(query_nr, parameters)
+        archive.save(query_nr, parameters, df)
+        return df
+
+    @instrumentation.timed("dune_query")
+    @retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
+    def execute_dune_query(self, query_nr: int, parameters: dict) -> pl.DataFrame:
+        archive = self.dune_archive
+        if archive is None:
+            return spice.query(query_nr, parameters=parameters, verbose=False)
+
+        # results of an earlier execution that was not archived (e.g. a crashed run)
+        execution = archive.get_execution(query_nr, parameters)
+        if execution is not None:
+            try:
+                df = spice.query(execution, verbose=False)
+                instrumentation.count("dune_executions_reused")
+                return df
+            except Exception as e:
+                warning(
+                    f"Could not reuse execution {execution['execution_id']} of query "
+                    f"{query_nr} ({e}), executing again"
+                )
+                archive.drop_execution(query_nr, parameters)
+
+        result = spice.query(query_nr, parameters=parameters, verbose=False, poll=False)
+        # without refresh, spice answers from its cache or the latest results of the
+        # query if there are any, only a new execution is returned as a handle
+        if isinstance(result, pl.DataFrame):
+            return result
+        archive.save_execution(query_nr, parameters, result)
+        return spice.query(result, verbose=False)
 
     def populate_settlement_table(self):
         self.create_settlement_table()
@@ -364,7 +714,8 @@ class DataFetcher:
 
         self.populate_settlement_table_by_blockrange(beginning_block, current_block)
 
-    def populate_price_tables(self):
+    def get_price_tokens(self) -> List[Token]:
+        """Tokens of the used pools and the native token."""
         used_pools = self.config.used_pools
         pool_tokens = [pool.TOKEN0 for pool in used_pools] + [
             pool.TOKEN1 for pool in used_pools
@@ -375,11 +726,277 @@ class DataFetcher:
         native_token = tokens.native
         if native_token not in tokens_to_query:
             tokens_to_query.append(native_token)
+        return tokens_to_query
 
-        for token in tokens_to_query:
+    def populate_price_tables(self):
+        if self.config.demand_driven_prices:
+            self.populate_needed_prices()
+            return
+        for token in self.get_price_tokens():
             self.populate_price_table(token)
 
+    def create_price_coverage_table(self):
+        """Block ranges the prices have been fetched for, per token. Needed in demand
+        driven mode because the price tables are sparse there."""
+        table_name = f"{self.config.network}_price_coverage"
+        if table_name in self.created_tables:
+            return
+        self.created_tables.add(table_name)
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (f"trade_envy.{table_name}",))
+            exists = cursor.fetchone()[0] is not None
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
+                    token TEXT,
+                    start_block INTEGER,
+                    end_block INTEGER,
+                    PRIMARY KEY (token, start_block)
+                );
+                """
+            )
+            if not exists:
+                # price tables filled block by block cover their whole range
+                for token in self.get_price_tokens():
+                    price_table = (
+                        f"trade_envy.{self.config.network}_{token.address}_price"
+                    )
+                    cursor.execute("SELECT to_regclass(%s)", (price_table,))
+                    if cursor.fetchone()[0] is None:
+                        continue
+                    cursor.execute(
+                        f"""
+                        INSERT INTO trade_envy.{table_name}
+                        SELECT %s, MIN(block_number), MAX(block_number)
+                        FROM {price_table}
+                        HAVING COUNT(*) > 0
+                        """,
+                        (token.address,),
+                    )
+            conn.commit()
+
+    def get_price_demand(
+        self, min_block: Optional[int] = None
+    ) -> Dict[Token, List[int]]:
+        """Blocks of candidate settlements whose prices are needed and not fetched yet.
+        Conversion rates are only looked up for the token1 of a pool if it is not the
+        native token, together with the native price at the same block."""
+        self.create_settlement_table()
+        self.create_price_coverage_table()
+        network = self.config.network
+        native = tokens_factory(network).native
+        pools_by_token = {}
+        for pool in self.config.used_pools:
+            if pool.TOKEN1 != native:
+                pools_by_token.setdefault(pool.TOKEN1, []).append(pool)
+                pools_by_token.setdefault(native, []).append(pool)
+
+        block_filter = "" if min_block is None else "AND call_block_number >= %s"
+        block_params = () if min_block is None else (min_block,)
+        demand = {}
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            for token, pools in pools_by_token.items():
+                condition, params = self.eligible_settlement_filter(pools)
+                cursor.execute(
+                    f"""
+                    SELECT DISTINCT call_block_number
+                    FROM trade_envy.{network}_settle
+                    WHERE {condition}
+                    {block_filter}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM trade_envy.{network}_price_coverage AS coverage
+                        WHERE coverage.token = %s
+                        AND call_block_number
+                            BETWEEN coverage.start_block AND coverage.end_block
+                    )
+                    ORDER BY call_block_number
+                    """,
+                    params + block_params + (token.address,),
+                )
+                blocks = [row[0] for row in cursor.fetchall()]
+                if blocks:
+                    demand[token] = blocks
+        return demand
+
+    def populate_needed_prices(self, min_block: Optional[int] = None):
+        """Fetches the prices of the blocks in get_price_demand only, in windows that
+        merge nearby blocks into one query."""
+        for token, blocks in self.get_price_demand(min_block).items():
+            windows = self.plan_price_windows(
+                blocks, self.config.price_window_gap, self.config.interval_length_price
+            )
+            n_blocks = sum(right - left + 1 for left, right in windows)
+            print(
+                f"Fetching {token.name} price for {len(blocks)} settlement blocks "
+                f"in {len(windows)} windows ({n_blocks} blocks)"
+            )
+            instrumentation.count("price_blocks_planned", n_blocks)
+            covered = []
+            for left, right in windows:
+                if self.populate_price_table_by_blockrange(token, left, right):
+                    covered.append((token.address, left, right))
+
+            if covered:
+                with self.db_manager.connect() as conn, conn.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        f"""
+                        INSERT INTO trade_envy.{self.config.network}_price_coverage
+                        (token, start_block, end_block) VALUES %s
+                        ON CONFLICT (token, start_block)
+                        DO UPDATE SET end_block = GREATEST(
+                            {self.config.network}_price_coverage.end_block,
+                            EXCLUDED.end_block
+                        )
+                        """,
+                        covered,
+                    )
+                    conn.commit()
+
+    def create_block_time_table(self):
+        table_name = f"{self.config.network}_block_time"
+        if table_name in self.created_tables:
+            return
+        self.created_tables.add(table_name)
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
+                    block_number INTEGER PRIMARY KEY,
+                    block_time TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS {table_name}_block_time
+                ON trade_envy.{table_name} (block_time);
+                """
+            )
+
+            # the settlements already tell the time of many blocks
+            settle_table = f"trade_envy.{self.config.network}_settle"
+            cursor.execute("SELECT to_regclass(%s)", (settle_table,))
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(
+                    f"""
+                    INSERT INTO trade_envy.{table_name} (block_number, block_time)
+                    SELECT DISTINCT call_block_number, call_block_time
+                    FROM {settle_table}
+                    WHERE NOT EXISTS (SELECT 1 FROM trade_envy.{table_name})
+                    ON CONFLICT DO NOTHING;
+                    """
+                )
+            conn.commit()
+
+    def get_block_time_bracket(
+        self, time: datetime.datetime
+    ) -> Tuple[
+        Optional[Tuple[int, datetime.datetime]], Optional[Tuple[int, datetime.datetime]]
+    ]:
+        """Closest stored blocks at or before and after the time (None if unknown)."""
+        table_name = f"{self.config.network}_block_time"
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT block_number, block_time FROM trade_envy.{table_name}
+                WHERE block_time <= %s ORDER BY block_time DESC LIMIT 1
+                """,
+                (time,),
+            )
+            lower = cursor.fetchone()
+            cursor.execute(
+                f"""
+                SELECT block_number, block_time FROM trade_envy.{table_name}
+                WHERE block_time > %s ORDER BY block_time LIMIT 1
+                """,
+                (time,),
+            )
+            upper = cursor.fetchone()
+        return lower, upper
+
+    def store_block_times(self, timestamps: Dict[int, int]):
+        df = pd.DataFrame(
+            {
+                "block_number": list(timestamps.keys()),
+                "block_time": [
+                    datetime.datetime.fromtimestamp(ts, datetime.UTC).replace(
+                        tzinfo=None
+                    )
+                    for ts in timestamps.values()
+                ],
+            }
+        )
+        with self.db_manager.connect() as conn:
+            upsert_data(f"{self.config.network}_block_time", df, conn)
+
+    @staticmethod
+    def search_block_by_time(
+        get_timestamp: Callable[[int], int], timestamp: int, low: int, high: int
+    ) -> int:
+        """
+        Last block with a timestamp at or before `timestamp`, by binary search between
+        block `low` (at or before the timestamp) and block `high` (after it).
+        """
+        while high - low > 1:
+            mid = (low + high) // 2
+            if get_timestamp(mid) <= timestamp:
+                low = mid
+            else:
+                high = mid
+        return low
+
+    def get_block_number_by_time_from_node(
+        self,
+        time: datetime.datetime,
+        lower: Optional[Tuple[int, datetime.datetime]],
+        upper: Optional[Tuple[int, datetime.datetime]],
+    ) -> int:
+        eth = self.w3_helper.w3.eth
+        timestamps = {}
+
+        def get_timestamp(block_num: int) -> int:
+            timestamps[block_num] = eth.get_block(block_num)["timestamp"]
+            return timestamps[block_num]
+
+        timestamp = int(time.replace(tzinfo=datetime.UTC).timestamp())
+        low = lower[0] if lower is not None else 0
+        if upper is not None:
+            high = upper[0]
+        else:
+            latest = eth.get_block("latest")
+            timestamps[latest["number"]] = latest["timestamp"]
+            if latest["timestamp"] <= timestamp:
+                self.store_block_times(timestamps)
+                return latest["number"]
+            high = latest["number"]
+
+        block_num = self.search_block_by_time(get_timestamp, timestamp, low, high)
+        self.store_block_times(timestamps)
+        return block_num
+
     def get_block_number_by_time(self, time: str) -> int:
+        """
+        Last block at or before the time (UTC). Answered from the stored block times if
+        possible, otherwise by a binary search on the node and only as a last resort
+        with a Dune query.
+        """
+        self.create_block_time_table()
+        time_parsed = pd.Timestamp(time)
+        if time_parsed.tzinfo is not None:
+            time_parsed = time_parsed.tz_convert("UTC").tz_localize(None)
+        time_parsed = time_parsed.to_pydatetime()
+        lower, upper = self.get_block_time_bracket(time_parsed)
+        if lower is not None and upper is not None and upper[0] == lower[0] + 1:
+            instrumentation.count("block_time_cache.hit")
+            return lower[0]
+        instrumentation.count("block_time_cache.miss")
+
+        try:
+            return self.get_block_number_by_time_from_node(time_parsed, lower, upper)
+        except Exception as e:
+            warning(
+                f"Could not get the block of {time} from the node ({e}), using Dune"
+            )
+            return self.get_block_number_by_time_from_dune(time)
+
+    def get_block_number_by_time_from_dune(self, time: str) -> int:
         # convert to UTC
         blocktime_query = self.config.dune_query_blockoftime
         params = {
@@ -396,6 +1013,9 @@ class DataFetcher:
 
     def create_price_table(self, token_address: str):
         table_name = f"{self.config.network}_{token_address}_price"
+        if table_name in self.created_tables:
+            return
+        self.created_tables.add(table_name)
         create_table_query = f"""
         CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
             block_number INTEGER PRIMARY KEY,
@@ -429,32 +1049,24 @@ class DataFetcher:
 
     def populate_price_table_by_blockrange(
         self, token: Token, start_block: int, end_block: int
-    ):
+    ) -> bool:
+        """Returns whether prices were written."""
         if start_block > end_block:
-            return
+            return False
         token_address = token.address
         self.create_price_table(token_address)
 
         table_name = f"{self.config.network}_{token_address}_price"
-        splits = self.split_intervals(
-            start_block, end_block, self.config.interval_length_price
+        dfs = self.query_dune_intervals(
+            self.config.dune_query_price,
+            {"contract_address": token_address, "network": self.config.network},
+            start_block,
+            end_block,
+            self.config.interval_length_price,
+            "price",
+            f"Fetching {token.name} price from {start_block} to {end_block}",
         )
 
-        dfs = []
-        for left, right in tqdm(
-            splits,
-            desc=f"Fetching {token.name} price from {start_block} to {end_block}",
-            unit="interval",
-        ):
-            params = {
-                "contract_address": token_address,
-                "network": self.config.network,
-                "start_block": left,
-                "end_block": right,
-            }
-            df = self.query_dune_data(self.config.dune_query_price, params)
-            dfs.append(df)
-
         if dfs:
             df = pl.concat(dfs).to_pandas()
 
@@ -462,7 +1074,7 @@ class DataFetcher:
                 warning(
                     f"All NaNs in {token.name} price. Not writing new price data for this token"
                 )
-                return
+                return False
 
             df["price"] = df["price"].astype(float)
             df["price"] = df["price"].interpolate(method="linear")
@@ -473,10 +1085,17 @@ class DataFetcher:
 
             with self.db_manager.connect() as conn:
                 upsert_data(table_name, df, conn)
+            return True
+        return False
 
+    @instrumentation.timed("db_price_lookup")
     def get_token_to_native_rate(
         self, token_address: str, block_number: int
     ) -> float | None:
+        if self.price_index is not None:
+            return self.price_index.get_token_to_native_rate(
+                token_address, block_number
+            )
         network = self.config.network
         table_name = f"{network}_{token_address}_price"
         native = tokens_factory(network).native.address
@@ -517,6 +1136,105 @@ class DataFetcher:
 
         return token_to_native_rate
 
+    @staticmethod
+    def pool_settlement_filter(pool: BCowPool) -> Tuple[str, tuple]:
+        """SQL condition for settlements that can contain a trade on the pool."""
+        condition = """(
+            LOWER(tokens) LIKE %s AND LOWER(tokens) LIKE %s
+            AND call_block_number >= %s
+        )"""
+        params = (
+            f"%{pool.TOKEN0.address}%",
+            f"%{pool.TOKEN1.address}%",
+            pool.first_block_active,
+        )
+        return condition, params
+
+    def eligible_settlement_filter(
+        self, pools: Optional[List[BCowPool]] = None
+    ) -> Tuple[str, tuple]:
+        """SQL condition for settlements that can contain a trade on any of the pools."""
+        if pools is None:
+            pools = self.config.used_pools
+        conditions, params = [], ()
+        for pool in pools:
+            condition, pool_params = self.pool_settlement_filter(pool)
+            conditions.append(condition)
+            params += pool_params
+        return "(" + " OR ".join(conditions) + ")", params
+
+    def create_pool_reserves_table(self):
+        table_name = f"{self.config.network}_pool_reserves"
+        if table_name in self.created_tables:
+            return
+        self.created_tables.add(table_name)
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
+            pool TEXT,
+            block_number INTEGER,
+            reserve0 NUMERIC,
+            reserve1 NUMERIC,
+            PRIMARY KEY (pool, block_number)
+        );
+        """
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(create_table_query)
+            conn.commit()
+
+    def populate_pool_reserves(self):
+        """Stores the token balances of the used pools at every block with a
+        settlement that can trade on the pool."""
+        self.create_pool_reserves_table()
+        network = self.config.network
+        table_name = f"{network}_pool_reserves"
+
+        for pool in self.config.used_pools:
+            condition, params = self.pool_settlement_filter(pool)
+            with self.db_manager.connect() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    SELECT DISTINCT settle.call_block_number
+                    FROM trade_envy.{network}_settle AS settle
+                    WHERE {condition}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM trade_envy.{table_name} AS reserves
+                        WHERE reserves.pool = %s
+                        AND reserves.block_number = settle.call_block_number
+                    )
+                    ORDER BY settle.call_block_number
+                    """,
+                    params + (pool.ADDRESS,),
+                )
+                blocks = [row[0] for row in cursor.fetchall()]
+
+            if not blocks:
+                continue
+
+            calls = [
+                (token.address, pool.ADDRESS, block_num)
+                for block_num in blocks
+                for token in (pool.TOKEN0, pool.TOKEN1)
+            ]
+            balances = []
+            for i in tqdm(
+                range(0, len(calls), 2000),
+                desc=f"Fetching {pool.NAME} reserves for {len(blocks)} blocks",
+            ):
+                balances += self.w3_helper.balance_of_batch(calls[i : i + 2000])
+
+            df = pd.DataFrame(
+                {
+                    "pool": pool.ADDRESS,
+                    "block_number": blocks,
+                    "reserve0": balances[0::2],
+                    "reserve1": balances[1::2],
+                }
+            )
+            with self.db_manager.connect() as conn:
+                upsert_data(table_name, df, conn)
+
     def populate_settlement_and_price(self):
         self.populate_settlement_table()
         self.populate_price_tables()
+        if self.config.ingest_pool_reserves:
+            self.populate_pool_reserves()
@@ -1,6 +1,51 @@
+import io
+import re
+from typing import Dict, Optional
+
 import pandas as pd
+import polars as pl
+from psycopg2.extensions import cursor
 from psycopg2.extras import execute_values
 
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+TABLE_PATTERN = re.compile(r"(?:trade_envy|information_schema)\.(\w+)")
+# set by the database when a row is inserted or updated, used for incremental syncs
+UPDATED_AT = "updated_at"
+# polars types of Postgres type OIDs, other types are read as text. NUMERIC (1700) is
+# not listed, its values can exceed float64 and Decimal128, so it stays exact as text
+# like the big integers stored as text (prices, amounts)
+PG_TYPES = {
+    16: pl.Boolean,
+    20: pl.Int64,
+    21: pl.Int64,
+    23: pl.Int64,
+    700: pl.Float64,
+    701: pl.Float64,
+    1114: pl.Datetime("us"),
+    1184: pl.Datetime("us", "UTC"),
+}
+
+
+def sql_labels(query) -> dict:
+    """Statement type and first table of a query, used to label SQL timings."""
+    if isinstance(query, bytes):
+        query = query[:500].decode(errors="ignore")
+    words = query.split(maxsplit=1)
+    table = TABLE_PATTERN.search(query)
+    return {
+        "statement": words[0].upper() if words else "",
+        "table": table.group(1) if table else "",
+    }
+
+
+class TimedCursor(cursor):
+    """Cursor that reports the duration of every statement as `sql` timing."""
+
+    def execute(self, query, vars=None):
+        with instrumentation.timer("sql", **sql_labels(query)):
+            return super().execute(query, vars)
+
 
 def get_pkeys(table_name: str, conn) -> list:
     """
@@ -20,6 +65,7 @@ def get_pkeys(table_name: str, conn) -> list:
     return [pk[0] for pk in primary_keys]
 
 
+@instrumentation.timed("upsert_data")
 def upsert_data(table_name: str, df: pd.DataFrame, conn):
     """
     Upserts data into a PostgreSQL table.
@@ -30,7 +76,14 @@ def upsert_data(table_name: str, df: pd.DataFrame, conn):
         )
         columns = [row[0] for row in cursor.fetchall()]
 
-    df = df[columns]
+    track_updates = UPDATED_AT in columns and UPDATED_AT not in df.columns
+    if track_updates:
+        columns.remove(UPDATED_AT)
+
+    # missing values (e.g. the envy components of dummy rows) are NaN in float
+    # columns, stored as NULL instead (NaN is out of range for INTEGER columns)
+    df = df[columns].astype(object)
+    df = df.where(df.notna(), None)
     primary_keys = get_pkeys(table_name, conn)
 
     column_list = ", ".join(columns)
@@ -41,6 +94,7 @@ def upsert_data(table_name: str, df: pd.DataFrame, conn):
             for column in columns
             if column not in primary_keys
         ]
+        + ([f"{UPDATED_AT} = now()"] if track_updates else [])
     )
     conflict_clause = (
         f"ON CONFLICT ({', '.join(primary_keys)}) DO UPDATE SET {update_clause}"
@@ -59,3 +113,49 @@ def upsert_data(table_name: str, df: pd.DataFrame, conn):
             df.values.tolist(),
         )
     conn.commit()
+    instrumentation.count(f"rows_upserted.{table_name}", len(df))
+
+
+def frame_from_csv(data: io.BytesIO, schema: Dict[str, pl.DataType]) -> pl.DataFrame:
+    """Decodes the output of `COPY ... TO STDOUT WITH (FORMAT csv, HEADER)`. NULL is an
+    unquoted empty field, booleans are t/f, timestamps are ISO formatted."""
+    df = pl.read_csv(data, infer_schema=False)
+    columns = []
+    for name, dtype in schema.items():
+        column = pl.col(name)
+        if dtype == pl.Boolean:
+            column = column == "t"
+        elif dtype == pl.Datetime("us"):
+            column = column.str.to_datetime("%Y-%m-%d %H:%M:%S%.f", time_unit="us")
+        elif dtype == pl.Datetime("us", "UTC"):
+            column = column.str.to_datetime(
+                "%Y-%m-%d %H:%M:%S%.f%#z", time_unit="us", time_zone="UTC"
+            )
+        elif dtype != pl.Utf8:
+            column = column.cast(dtype)
+        columns.append(column.alias(name))
+    return df.select(columns)
+
+
+def read_frame(conn, query: str, params: Optional[tuple | dict] = None) -> pl.DataFrame:
+    """Result of a query as polars frame, read with COPY in one CSV stream instead of
+    fetching Python tuples. The column types come from the result description."""
+    query = query.strip().rstrip(";")
+    with conn.cursor() as cursor:
+        if params is not None:
+            query = cursor.mogrify(query, params).decode()
+        # types of the result columns, without running the query
+        cursor.execute(f"SELECT * FROM ({query}) AS result LIMIT 0")
+        schema = {
+            desc.name: PG_TYPES.get(desc.type_code, pl.Utf8)
+            for desc in cursor.description
+        }
+
+        copy_query = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        data = io.BytesIO()
+        with instrumentation.timer("sql", **sql_labels(copy_query)):
+            cursor.copy_expert(copy_query, data)
+    data.seek(0)
+    df = frame_from_csv(data, schema)
+    instrumentation.count("rows_read", len(df))
+    return df
@@ -0,0 +1,94 @@
+"""
+Local archive of raw Dune results.
+
+Results are stored as zstd Parquet under `{directory}/query_{query_id}/{key}.parquet`,
+where the key is the hash of the query id and the canonical (sorted, JSON encoded)
+parameters, so the same query with the same parameters is only paid for once, also
+after a DB reset. The execution id of a started query is recorded next to it
+(`{key}.json`) before its results are awaited, so that a run that fails while polling
+or downloading picks up the results of that execution instead of executing again.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Mapping, Optional
+
+import polars as pl
+
+
+def canonical_parameters(query_id: int, parameters: Mapping[str, Any]) -> str:
+    return json.dumps(
+        {"query_id": int(query_id), "parameters": parameters},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+
+
+class DuneArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def key(query_id: int, parameters: Mapping[str, Any]) -> str:
+        return hashlib.sha256(
+            canonical_parameters(query_id, parameters).encode()
+        ).hexdigest()
+
+    def path(self, query_id: int, parameters: Mapping[str, Any], suffix: str) -> str:
+        return os.path.join(
+            self.directory,
+            f"query_{query_id}",
+            f"{self.key(query_id, parameters)}{suffix}",
+        )
+
+    @staticmethod
+    def write_atomically(path: str, write):
+        """Writes to a temporary file first, a crash never leaves a partial file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(
+        self, query_id: int, parameters: Mapping[str, Any]
+    ) -> Optional[pl.DataFrame]:
+        path = self.path(query_id, parameters, ".parquet")
+        if not os.path.exists(path):
+            return None
+        return pl.read_parquet(path)
+
+    def save(self, query_id: int, parameters: Mapping[str, Any], df: pl.DataFrame):
+        self.write_atomically(
+            self.path(query_id, parameters, ".parquet"),
+            lambda path: df.write_parquet(path, compression="zstd"),
+        )
+
+    def get_execution(
+        self, query_id: int, parameters: Mapping[str, Any]
+    ) -> Optional[dict]:
+        path = self.path(query_id, parameters, ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)["execution"]
+
+    def save_execution(
+        self, query_id: int, parameters: Mapping[str, Any], execution: dict
+    ):
+        record = {
+            "query": json.loads(canonical_parameters(query_id, parameters)),
+            "execution": dict(execution),
+        }
+
+        def write(path: str):
+            with open(path, "w") as f:
+                json.dump(record, f, default=str)
+
+        self.write_atomically(self.path(query_id, parameters, ".json"), write)
+
+    def drop_execution(self, query_id: int, parameters: Mapping[str, Any]):
+        path = self.path(query_id, parameters, ".json")
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,146 @@
+"""
+Incremental sync of the envy tables to Dune.
+
+Every envy row has an `updated_at` timestamp. Before a sync, `prepare` copies the rows
+changed since the last synced high-water mark into `{network}_envy_delta`, which the
+dune-sync jobs (dune_sync_config.yaml) append to the Dune table. After a successful
+upload, `commit` moves the high-water mark forward, so a failed upload is repeated in
+full by the next sync. With `full_resync` the delta holds the whole table and the
+`_full` jobs replace the Dune table.
+
+`updated_at` is the start time of the writing transaction, so a transaction that is
+still running during `prepare` can commit rows older than `MAX(updated_at)`. The
+high-water mark is therefore capped at `safety_margin_minutes` before now (longer than
+any envy transaction), rows after it are uploaded by the next sync.
+
+Rows that change after their first sync are appended again, and rows close to the
+high-water mark can be uploaded twice. Consumers on Dune must deduplicate by the
+latest `updated_at` per (call_tx_hash, trade_index) and then drop `superseded` rows.
+Rows are never deleted: a dummy row that was replaced by envy is marked as superseded,
+so the change is uploaded like any other update.
+"""
+
+import os
+
+from dotenv import load_dotenv
+from fire import Fire
+
+from cow_amm_trade_envy.configs import PGConfig
+from cow_amm_trade_envy.datasources import DatabaseManager
+
+
+class DuneSync:
+    def __init__(self, db_manager: DatabaseManager, network: str):
+        self.db_manager = db_manager
+        self.network = network
+        self.destination = f"envy_{network}"  # table name on Dune
+        self.table_name = f"{network}_envy"
+        self.delta_table_name = f"{network}_envy_delta"
+
+    def create_sync_state_table(self):
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trade_envy.sync_state (
+                    destination TEXT PRIMARY KEY,
+                    synced_until TIMESTAMP,
+                    pending_until TIMESTAMP
+                );
+                """
+            )
+            conn.commit()
+
+    def prepare(
+        self, full_resync: bool = False, safety_margin_minutes: int = 10
+    ) -> int:
+        """Fills the delta table with the rows to upload, returns their number."""
+        self.create_sync_state_table()
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT synced_until FROM trade_envy.sync_state WHERE destination = %s",
+                (self.destination,),
+            )
+            row = cursor.fetchone()
+            synced_until = None if full_resync or row is None else row[0]
+
+            # rows of transactions that commit after this are still ahead of the mark
+            cursor.execute(
+                f"""
+                SELECT LEAST(
+                    MAX(updated_at),
+                    LOCALTIMESTAMP - make_interval(mins => %s)
+                )
+                FROM trade_envy.{self.table_name}
+                """,
+                (safety_margin_minutes,),
+            )
+            pending_until = cursor.fetchone()[0]
+
+            cursor.execute(f"DROP TABLE IF EXISTS trade_envy.{self.delta_table_name}")
+            cursor.execute(
+                f"""
+                CREATE TABLE trade_envy.{self.delta_table_name} AS
+                SELECT * FROM trade_envy.{self.table_name}
+                WHERE (%(synced_until)s::timestamp IS NULL
+                    OR updated_at > %(synced_until)s)
+                AND updated_at <= %(pending_until)s
+                """,
+                {"synced_until": synced_until, "pending_until": pending_until},
+            )
+            n_rows = cursor.rowcount
+
+            cursor.execute(
+                """
+                INSERT INTO trade_envy.sync_state (destination, pending_until)
+                VALUES (%s, %s)
+                ON CONFLICT (destination) DO UPDATE
+                SET pending_until = EXCLUDED.pending_until
+                """,
+                (self.destination, pending_until),
+            )
+            conn.commit()
+
+        print(
+            f"{n_rows} envy rows to sync to {self.destination} "
+            f"(changed after {synced_until}, up to {pending_until})"
+        )
+        return n_rows
+
+    def commit(self):
+        """Marks the prepared rows as synced."""
+        self.create_sync_state_table()
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE trade_envy.sync_state
+                SET synced_until = COALESCE(pending_until, synced_until),
+                    pending_until = NULL
+                WHERE destination = %s
+                """,
+                (self.destination,),
+            )
+            conn.commit()
+
+
+def get_db_manager() -> DatabaseManager:
+    load_dotenv()
+    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+    return DatabaseManager(0, pg_config)
+
+
+def prepare_sync(
+    networks: list, full_resync: bool = False, safety_margin_minutes: int = 10
+):
+    db_manager = get_db_manager()
+    for network in networks:
+        DuneSync(db_manager, network).prepare(full_resync, safety_margin_minutes)
+
+
+def commit_sync(networks: list):
+    db_manager = get_db_manager()
+    for network in networks:
+        DuneSync(db_manager, network).commit()
+
+
+if __name__ == "__main__":
+    Fire({"prepare": prepare_sync, "commit": commit_sync})
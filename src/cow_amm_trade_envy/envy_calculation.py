@@ -1,7 +1,8 @@
 import json
 import pandas as pd
+import polars as pl
 from tqdm import tqdm
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Mapping
 
 from cow_amm_trade_envy.configs import EnvyCalculatorConfig, DataFetcherConfig
 from cow_amm_trade_envy.models import (
@@ -16,20 +17,62 @@ from cow_amm_trade_envy.models import (
     CoWAmmOrderData,
 )
 from cow_amm_trade_envy.datasources import BCoWHelper, DataFetcher
-from cow_amm_trade_envy.db_utils import upsert_data
+from cow_amm_trade_envy.db_utils import read_frame, upsert_data
+from psycopg2.extras import execute_values
+from cow_amm_trade_envy.instrumentation import instrumentation
 import math
 
+# stored with every envy row: trade_envy = (surplus_token1 * conversion_rate
+# - gas_price * gas_cost_estimate) / 10**native decimals
+ENVY_COMPONENTS = [
+    "surplus_token1",
+    "conversion_rate",
+    "gas_price",
+    "gas_cost_estimate",
+]
+# columns of the {network}_envy table written by create_envy_data
+ENVY_COLUMNS = [
+    "call_tx_hash",
+    "block_number",
+    "block_time",
+    "trade_index",
+    "pool",
+    "pool_name",
+    "solver",
+    "trade_envy",
+    "pool_used_already",
+    *ENVY_COMPONENTS,
+]
+# one entry of calc_envy_per_settlement
+ENVY_SCHEMA = pl.Schema(
+    {
+        "pool": pl.Utf8,
+        "trade_envy": pl.Float64,
+        "trade_index": pl.Int64,
+        "surplus_token1": pl.Float64,
+        "conversion_rate": pl.Float64,
+        "gas_price": pl.Int64,
+        "gas_cost_estimate": pl.Int64,
+    }
+)
+
 
 class TradeEnvyCalculator:
     def __init__(
         self,
         config: EnvyCalculatorConfig,
-        dfc: DataFetcherConfig,
+        dfc: Optional[DataFetcherConfig] = None,
         used_pool_list: List[BCowPool] = None,
+        helper: Optional[BCoWHelper] = None,
+        data_fetcher: Optional[DataFetcher] = None,
     ):
+        # helper and data_fetcher can be injected (e.g. by the offline replay engine)
+        # so that no node or DB connection is needed
         self.config = config
-        self.helper = BCoWHelper(dfc)
-        self.data_fetcher = DataFetcher(dfc)
+        self.helper = helper if helper is not None else BCoWHelper(dfc)
+        self.data_fetcher = (
+            data_fetcher if data_fetcher is not None else DataFetcher(dfc)
+        )
         self.network_pools: Pools = pools_factory(self.config.network)
         if used_pool_list is None:
             used_pool_list = self.network_pools.get_pools()
@@ -37,9 +80,10 @@ class TradeEnvyCalculator:
         self.tokens = tokens_factory(self.config.network)
 
     @staticmethod
-    def preprocess_row(row: pd.Series) -> pd.Series:
+    @instrumentation.timed("preprocess_row")
+    def preprocess_row(row: Mapping[str, Any]) -> Dict[str, Any]:
         """Preprocesses a row of settlement data."""
-        row = row.copy()
+        row = dict(row)
         row["tokens"] = row["tokens"].lower().strip("[]").split()
         row["clearing_prices"] = row["clearing_prices"].lower().strip("[]").split()
         row["trades"] = json.loads(row["trades"].replace(" ", ","))
@@ -155,6 +199,8 @@ class TradeEnvyCalculator:
             surplus = surplus * ucp[pool.TOKEN0] / ucp[pool.TOKEN1]
 
         # make sure its denominated in native token using pre-downloaded prices
+        # (native atoms per token1 atom)
+        conversion_rate = 1.0
         if pool.TOKEN1 != self.tokens.native:
             rate_in_wrapped_native = self.data_fetcher.get_token_to_native_rate(
                 pool.TOKEN1.address, block_num
@@ -162,16 +208,26 @@ class TradeEnvyCalculator:
             decimal_correction_factor = 10 ** (
                 self.tokens.native.decimals - pool.TOKEN1.decimals
             )
-            surplus = surplus * rate_in_wrapped_native * decimal_correction_factor
+            conversion_rate = rate_in_wrapped_native * decimal_correction_factor
 
-        return {"surplus": surplus, "pool": pool.ADDRESS}
+        return {
+            "surplus": surplus * conversion_rate,
+            "surplus_token1": surplus,
+            "conversion_rate": conversion_rate,
+            "pool": pool.ADDRESS,
+        }
 
     def calc_gas(self, gas_price: int) -> int:
         """Calculates gas cost for a trade."""
         return gas_price * self.config.gas_cost_estimate
 
-    def calc_envy_per_settlement(self, row: pd.Series) -> List[Dict[str, Any]]:
-        """Calculates envy for all trades in a settlement."""
+    def calc_surplus_per_settlement(
+        self, row: Mapping[str, Any], pools: Optional[List[BCowPool]] = None
+    ) -> List[Dict[str, Any]]:
+        """Calculates the surplus (in native token atoms) for all trades in a settlement
+        on the pools (default: the used pools)."""
+        if pools is None:
+            pools = self.used_pool_list
         row = self.preprocess_row(row)
 
         settlement_trades = trades_from_lists(
@@ -204,57 +260,143 @@ class TradeEnvyCalculator:
         eligible_settlement_trades = [
             (i, trade)
             for i, trade in eligible_settlement_trades_indexed
-            if self.network_pools.get_fitting_pool(trade) in self.used_pool_list
+            if self.network_pools.get_fitting_pool(trade) in pools
         ]
 
-        envy_list = []
+        surplus_list = []
         for i, trade in eligible_settlement_trades:
             surplus_data = self.calc_surplus_per_trade(
                 ucp, trade, row["call_block_number"]
             )
             if surplus_data:
-                surplus = surplus_data["surplus"]
-                pool = surplus_data["pool"]
-                gas = self.calc_gas(row["gas_price"])
-                trade_envy = (surplus - gas) * 10 ** (-self.tokens.native.decimals)
-                envy_list.append(
-                    {"trade_envy": trade_envy, "pool": pool, "trade_index": i}
-                )
+                surplus_list.append({**surplus_data, "trade_index": i})
 
-        return envy_list
+        return surplus_list
 
-    def check_pool_already_used(self, df: pd.DataFrame):
-        def isin_pool(topic: str, pool_address: str) -> bool:
-            assert "0x" == pool_address[:2]
-            return pool_address[2:] in topic
+    @instrumentation.timed("calc_envy_per_settlement")
+    def calc_envy_per_settlement(
+        self, row: Mapping[str, Any], pools: Optional[List[BCowPool]] = None
+    ) -> List[Dict[str, Any]]:
+        """Calculates envy for all trades in a settlement, with the components needed to
+        re-price it in SQL (see repricing.py)."""
+        gas_price = int(row["gas_price"])
+        gas = self.calc_gas(gas_price)
 
-        def log_is_used(log, pool_address: str) -> bool:
-            return any(isin_pool(topic, pool_address) for topic in log["topics"])
+        envy_list = []
+        for surplus_data in self.calc_surplus_per_settlement(row, pools):
+            trade_envy = (surplus_data["surplus"] - gas) * 10 ** (
+                -self.tokens.native.decimals
+            )
+            envy_list.append(
+                {
+                    "trade_envy": trade_envy,
+                    "pool": surplus_data["pool"],
+                    "trade_index": surplus_data["trade_index"],
+                    "surplus_token1": surplus_data["surplus_token1"],
+                    "conversion_rate": surplus_data["conversion_rate"],
+                    "gas_price": gas_price,
+                    "gas_cost_estimate": self.config.gas_cost_estimate,
+                }
+            )
 
-        def logs_are_used(logs, pool_address: str) -> bool | None:
-            if pool_address is None:
-                return False
-            return any(log_is_used(log, pool_address) for log in logs)
+        return envy_list
 
-        # Convert the 'call_tx_hash' column to a list
-        mask_poolnotna = [not pd.isna(x) for x in df["pool"]]
-        call_tx_hashes = list(set(df["call_tx_hash"][mask_poolnotna].tolist()))
+    def check_pool_already_used(self, envy: pl.LazyFrame) -> pl.LazyFrame:
+        """Whether the pool of an envy row is already used in its settlement, i.e. a log
+        of the settlement has the pool address in a topic. One row per (call_tx_hash,
+        pool) of the rows with a pool."""
+        pairs = envy.select("call_tx_hash", "pool").filter(pl.col("pool").is_not_null())
+        tx_hashes = (
+            pairs.select(pl.col("call_tx_hash").unique(maintain_order=True))
+            .collect()["call_tx_hash"]
+            .to_list()
+        )
+        logs_list = self.helper.get_logs_batch(tx_hashes)
+        # one row per topic of the logs of a settlement
+        topics = [
+            [topic for log in logs for topic in log["topics"]] for logs in logs_list
+        ]
+        topics = pl.LazyFrame(
+            {
+                "call_tx_hash": [
+                    tx_hash
+                    for tx_hash, tx_topics in zip(tx_hashes, topics)
+                    for _ in tx_topics
+                ],
+                "topic": [topic for tx_topics in topics for topic in tx_topics],
+            },
+            schema={"call_tx_hash": pl.Utf8, "topic": pl.Utf8},
+        )
 
-        logs_list = self.helper.get_logs_batch(call_tx_hashes)
-        tx_hash_to_logs = dict(zip(call_tx_hashes, logs_list))
-        df["logs"] = df["call_tx_hash"].apply(lambda x: tx_hash_to_logs.get(x))
+        return (
+            pairs.unique()
+            .join(topics, on="call_tx_hash", how="left")
+            .with_columns(
+                pl.col("topic")
+                .str.contains(pl.col("pool").str.slice(2), literal=True)
+                .fill_null(False)
+                .alias("used")
+            )
+            .group_by("call_tx_hash", "pool")
+            .agg(pl.col("used").any().alias("pool_used_already"))
+        )
 
-        df["pool_used_already"] = None
-        df.loc[mask_poolnotna, "pool_used_already"] = [
-            logs_are_used(logs, pool_address)
-            for logs, pool_address in list(
-                zip(df["logs"][mask_poolnotna], df["pool"][mask_poolnotna])
+    @instrumentation.timed("build_envy_data")
+    def build_envy_data(
+        self, ucp_data: pl.DataFrame, trade_envy_per_settlement: List[list]
+    ) -> pd.DataFrame:
+        """Flattens the envy per settlement into one row per trade (or a dummy row)."""
+        # flat rows with the index of their settlement, settlements without envy get
+        # a dummy row (nulls) from the left join
+        envy_rows = pl.from_dicts(
+            [data for envy_list in trade_envy_per_settlement for data in envy_list],
+            schema=ENVY_SCHEMA,
+        ).with_columns(
+            pl.Series(
+                "row",
+                [
+                    row
+                    for row, envy_list in enumerate(trade_envy_per_settlement)
+                    for _ in envy_list
+                ],
+                dtype=pl.UInt32,
             )
-        ]
+        )
+        envy = (
+            ucp_data.select("call_tx_hash")
+            .with_row_index("row")
+            .lazy()
+            .join(envy_rows.lazy(), on="row", how="left")
+        )
+        pools = self.network_pools.get_pools()
+        pool_names = pl.LazyFrame(
+            {
+                "pool": [pool.ADDRESS for pool in pools],
+                "pool_name": [pool.NAME for pool in pools],
+            }
+        )
+        settlements = ucp_data.lazy().select(
+            "call_tx_hash",
+            "solver",
+            pl.col("call_block_number").alias("block_number"),
+            pl.col("call_block_time").alias("block_time"),
+        )
 
-        return df
+        envy_data = (
+            envy.join(
+                self.check_pool_already_used(envy),
+                on=["call_tx_hash", "pool"],
+                how="left",
+            )
+            .join(settlements, on="call_tx_hash", how="left")
+            .join(pool_names, on="pool", how="left")
+            .sort("row", maintain_order=True)
+            .with_columns(pl.col("trade_index").fill_null(-1))
+            .select(ENVY_COLUMNS)
+        )
+        return envy_data.collect().to_pandas()
 
-    def create_envy_data(self):
+    def create_envy_table(self):
         table_name = f"{self.config.network}_envy"
         create_table_query = f"""
         CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
@@ -267,91 +409,240 @@ class TradeEnvyCalculator:
             solver TEXT,
             trade_envy NUMERIC,
             pool_used_already BOOLEAN,
+            surplus_token1 NUMERIC,
+            conversion_rate NUMERIC,
+            gas_price NUMERIC,
+            gas_cost_estimate INTEGER,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            superseded BOOLEAN NOT NULL DEFAULT FALSE,
             PRIMARY KEY (call_tx_hash, trade_index)
         );
         """
+        with self.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(create_table_query)
+            # tables created before the incremental Dune sync, the envy components and
+            # the superseded dummy rows, the components of older rows stay NULL until
+            # they are recalculated
+            cursor.execute(
+                f"""
+                ALTER TABLE trade_envy.{table_name}
+                ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now(),
+                ADD COLUMN IF NOT EXISTS surplus_token1 NUMERIC,
+                ADD COLUMN IF NOT EXISTS conversion_rate NUMERIC,
+                ADD COLUMN IF NOT EXISTS gas_price NUMERIC,
+                ADD COLUMN IF NOT EXISTS gas_cost_estimate INTEGER,
+                ADD COLUMN IF NOT EXISTS superseded BOOLEAN NOT NULL DEFAULT FALSE;
+                CREATE INDEX IF NOT EXISTS {table_name}_updated_at
+                ON trade_envy.{table_name} (updated_at);
+                """
+            )
+            conn.commit()
+
+    def create_ledger_table(self):
+        """(settlement, pool) pairs the envy has been calculated for. Dummy rows in the
+        envy table can't tell which pools were checked, so adding pools to the used
+        pools only calculates the missing pairs with the ledger."""
+        network = self.config.network
+        table_name = f"{network}_envy_ledger"
+        with self.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (f"trade_envy.{table_name}",))
+            exists = cursor.fetchone()[0] is not None
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS trade_envy.{table_name} (
+                    call_tx_hash TEXT,
+                    pool TEXT,
+                    block_number INTEGER,
+                    PRIMARY KEY (call_tx_hash, pool)
+                );
+                """
+            )
+            if not exists:
+                # only the pairs with envy are known to be processed, the pools that
+                # were not used before (dummy rows) are calculated again
+                cursor.execute(
+                    f"""
+                    INSERT INTO trade_envy.{table_name}
+                    SELECT DISTINCT call_tx_hash, pool, block_number
+                    FROM trade_envy.{network}_envy
+                    WHERE trade_index <> -1 AND pool IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                    """
+                )
+            conn.commit()
+
+    def get_missing_pools(
+        self, min_block: Optional[int] = None
+    ) -> Dict[str, List[BCowPool]]:
+        """Used pools per settlement that can trade on them but are not in the ledger."""
+        network = self.config.network
+        block_filter = "" if min_block is None else "AND call_block_number >= %s"
+        block_params = () if min_block is None else (min_block,)
+
+        missing_pools = {}
+        with self.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+            for pool in self.used_pool_list:
+                condition, params = self.data_fetcher.pool_settlement_filter(pool)
+                cursor.execute(
+                    f"""
+                    SELECT settle.call_tx_hash
+                    FROM trade_envy.{network}_settle AS settle
+                    WHERE {condition}
+                    {block_filter}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM trade_envy.{network}_envy_ledger AS ledger
+                        WHERE ledger.call_tx_hash = settle.call_tx_hash
+                        AND ledger.pool = %s
+                    )
+                    """,
+                    params + block_params + (pool.ADDRESS,),
+                )
+                for (call_tx_hash,) in cursor.fetchall():
+                    missing_pools.setdefault(call_tx_hash, []).append(pool)
+        return missing_pools
 
+    def upsert_envy_data(
+        self,
+        envy_data: pd.DataFrame,
+        ucp_data: pl.DataFrame,
+        processed_pools: Dict[str, List[BCowPool]],
+    ):
+        """Stores the envy and marks the (settlement, pool) pairs as processed. The dummy
+        row of a settlement is only valid while it has no envy on any pool. It is marked
+        as superseded instead of deleted, so the incremental Dune sync uploads the
+        change."""
+        network = self.config.network
+        table_name = f"{network}_envy"
+        is_dummy = envy_data["trade_index"] == -1
         with self.data_fetcher.db_manager.connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(create_table_query)
-                cursor.execute(f"""
-                                SELECT settle.* 
-                                FROM trade_envy.{self.config.network}_settle AS settle
-                                LEFT JOIN trade_envy.{table_name} AS envy
-                                ON settle.call_tx_hash = envy.call_tx_hash
-                                WHERE envy.call_tx_hash IS NULL;
-                            """)
-                ucp_data = pd.DataFrame(
-                    cursor.fetchall(), columns=[desc[0] for desc in cursor.description]
+                cursor.execute(
+                    f"""
+                    SELECT DISTINCT call_tx_hash FROM trade_envy.{table_name}
+                    WHERE call_tx_hash = ANY(%s) AND trade_index <> -1
+                    """,
+                    (envy_data["call_tx_hash"].unique().tolist(),),
+                )
+                with_envy = {row[0] for row in cursor.fetchall()}
+                with_envy |= set(envy_data.loc[~is_dummy, "call_tx_hash"])
+                cursor.execute(
+                    f"""
+                    UPDATE trade_envy.{table_name}
+                    SET superseded = TRUE, updated_at = now()
+                    WHERE trade_index = -1 AND NOT superseded
+                    AND call_tx_hash = ANY(%s)
+                    """,
+                    (list(with_envy),),
                 )
+            envy_data = envy_data[
+                ~(is_dummy & envy_data["call_tx_hash"].isin(with_envy))
+            ].assign(superseded=False)
+            upsert_data(table_name, envy_data, conn)
 
-        ucp_data = ucp_data.sort_values("call_block_number", ascending=False)
-        ucp_data.reset_index(drop=True, inplace=True)
-        trade_envy_per_settlement = [
-            self.calc_envy_per_settlement(row)
-            for _, row in tqdm(
-                ucp_data.iterrows(),
-                total=len(ucp_data),
-                desc="Calculating envy for all pools per settlement (including helper query)",
+            block_numbers = dict(
+                zip(ucp_data["call_tx_hash"], ucp_data["call_block_number"])
             )
-        ]
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    f"""
+                    INSERT INTO trade_envy.{network}_envy_ledger
+                    (call_tx_hash, pool, block_number) VALUES %s
+                    ON CONFLICT DO NOTHING
+                    """,
+                    [
+                        (call_tx_hash, pool.ADDRESS, int(block_numbers[call_tx_hash]))
+                        for call_tx_hash, pools in processed_pools.items()
+                        for pool in pools
+                    ],
+                )
+            conn.commit()
 
-        df_envy = pd.DataFrame(
-            {
-                "data": trade_envy_per_settlement,
-                "call_tx_hash": ucp_data["call_tx_hash"],
-            }
-        )
-        df_envy = df_envy.explode("data")
-        df_envy["pool"] = df_envy["data"].apply(
-            lambda x: None if pd.isna(x) else x["pool"]
-        )
-        df_envy["trade_envy"] = df_envy["data"].apply(
-            lambda x: None if pd.isna(x) else x["trade_envy"]
-        )
-        df_envy["trade_index"] = df_envy["data"].apply(
-            lambda x: None if pd.isna(x) else x["trade_index"]
-        )
-        df_envy = self.check_pool_already_used(df_envy)
-
-        # Merge the solver column from the settlement (ucp_data) into the envy DataFrame.
-        df_envy = df_envy.merge(
-            ucp_data[
-                ["call_tx_hash", "solver", "call_block_number", "call_block_time"]
-            ],
-            on="call_tx_hash",
-            how="left",
-        )
+    def create_envy_data(self, min_block: Optional[int] = None):
+        """Envy of the (settlement, used pool) pairs not calculated yet, for settlements
+        from `min_block` on if given."""
+        table_name = f"{self.config.network}_envy"
+        self.create_envy_table()
+        self.create_ledger_table()
 
-        # Compute the pool_name based on the pool address, if available.
-        df_envy["pool_name"] = df_envy["pool"].apply(
-            lambda x: self.network_pools.get_name_from_address(x)
-            if pd.notna(x)
-            else None
+        network = self.config.network
+        eligible, params = self.data_fetcher.eligible_settlement_filter(
+            self.used_pool_list
         )
+        # lets the follow mode only look at the settlements of the new blocks
+        block_filter = ""
+        if min_block is not None:
+            block_filter = "AND settle.call_block_number >= %s"
+            params = params + (min_block,)
+        with self.data_fetcher.db_manager.connect() as conn:
+            with conn.cursor() as cursor:
+                # Settlements without a possible trade on a used pool get the dummy
+                # row directly in SQL, so they are never fetched or parsed
+                cursor.execute(
+                    f"""
+                    INSERT INTO trade_envy.{table_name} (
+                        call_tx_hash, block_number, block_time, trade_index,
+                        pool, pool_name, solver, trade_envy, pool_used_already
+                    )
+                    SELECT settle.call_tx_hash, settle.call_block_number,
+                        settle.call_block_time, -1, NULL, NULL, settle.solver,
+                        NULL, NULL
+                    FROM trade_envy.{network}_settle AS settle
+                    WHERE NOT COALESCE({eligible}, FALSE)
+                    {block_filter}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM trade_envy.{table_name} AS envy
+                        WHERE envy.call_tx_hash = settle.call_tx_hash
+                    )
+                    ON CONFLICT DO NOTHING;
+                    """,
+                    params,
+                )
+                n_skipped = cursor.rowcount
+                conn.commit()
 
-        envy_data = pd.DataFrame(
-            {
-                "call_tx_hash": df_envy["call_tx_hash"],
-                "block_number": df_envy["call_block_number"],
-                "block_time": df_envy["call_block_time"],
-                "trade_index": [
-                    int(x) if pd.notna(x) else -1 for x in df_envy["trade_index"]
-                ],
-                "pool": df_envy["pool"],
-                "pool_name": df_envy["pool_name"],
-                "solver": df_envy["solver"],
-                "trade_envy": df_envy["trade_envy"],
-                "pool_used_already": df_envy["pool_used_already"],
-            }
+        missing_pools = self.get_missing_pools(min_block)
+        with self.data_fetcher.db_manager.connect() as conn:
+            ucp_data = read_frame(
+                conn,
+                f"""
+                SELECT * FROM trade_envy.{network}_settle
+                WHERE call_tx_hash = ANY(%s)
+                ORDER BY call_block_number DESC
+                """,
+                (list(missing_pools),),
+            )
+
+        print(
+            f"Skipped {n_skipped} settlements without eligible trades, "
+            f"{len(ucp_data)} candidate settlements left"
         )
+        envy_data = pd.DataFrame(columns=ENVY_COLUMNS)
+        if len(ucp_data) > 0:
+            trade_envy_per_settlement = []
+            for row in tqdm(
+                ucp_data.iter_rows(named=True),
+                total=len(ucp_data),
+                desc="Calculating envy for all pools per settlement (including helper query)",
+            ):
+                trade_envy_per_settlement.append(
+                    self.calc_envy_per_settlement(
+                        row, missing_pools[row["call_tx_hash"]]
+                    )
+                )
+                instrumentation.count("settlements_processed")
 
-        with self.data_fetcher.db_manager.connect() as conn:
-            upsert_data(table_name, envy_data, conn)
+            envy_data = self.build_envy_data(ucp_data, trade_envy_per_settlement)
+            self.upsert_envy_data(envy_data, ucp_data, missing_pools)
+
+        self.helper.report_dedup()
 
         # todo remove in the end
-        if self.config.network == "ethereum" and len(self.used_pool_list) == len(
-            pools_factory(self.config.network).get_pools()
+        if (
+            min_block is None
+            and self.config.network == "ethereum"
+            and len(self.used_pool_list)
+            == len(pools_factory(self.config.network).get_pools())
         ):
             outfile = "data/cow_amm_missed_surplus.csv"
             envy_data.to_csv(outfile)  # keep this for now to see changes in the diffs
@@ -0,0 +1,103 @@
+"""
+Follow mode: keeps the envy tables up to date while the chain advances.
+
+The follower polls the node for new blocks, ingests settlements and prices of the new
+blocks in small windows and computes envy only for the new settlements. The clients
+(node, Dune, helper cache) and the in-memory price index are kept
+between iterations, so an iteration only costs the queries for its own blocks.
+"""
+
+import time
+from logging import warning
+from typing import Callable, Optional
+
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.indexes import PriceIndex
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+
+class ChainFollower:
+    def __init__(
+        self,
+        calculator: TradeEnvyCalculator,
+        poll_interval: float = 60,
+        window_blocks: int = 300,
+    ):
+        self.calculator = calculator
+        self.data_fetcher = calculator.data_fetcher
+        self.helper = calculator.helper
+        self.network = calculator.config.network
+        self.poll_interval = poll_interval
+        self.window_blocks = window_blocks
+        self.tokens = self.data_fetcher.get_price_tokens()
+        self.next_block: Optional[int] = None
+
+    def start(self):
+        """Continues after the last ingested settlement, with the prices from there on
+        loaded into memory."""
+        db_manager = self.data_fetcher.db_manager
+        self.data_fetcher.create_settlement_table()
+        next_block = db_manager.get_first_block_to_ingest(
+            f"{self.network}_settle", "call_block_number"
+        )
+        self.data_fetcher.price_index = PriceIndex(
+            self.network, db_manager.get_prices(self.network, self.tokens, next_block)
+        )
+        self.next_block = next_block
+        print(f"Following the chain from block {self.next_block}")
+
+    def step(self) -> int:
+        """Processes the next window of blocks, returns the number of blocks left behind
+        the highest ingestable block."""
+        if self.next_block is None:
+            self.start()
+
+        with instrumentation.timer("follow_iteration"):
+            self.data_fetcher.w3_helper.refresh_block_number()
+            highest_block = self.data_fetcher.get_highest_block()
+            if highest_block < self.next_block:
+                return 0
+            start_block = self.next_block
+            end_block = min(highest_block, start_block + self.window_blocks - 1)
+
+            db_manager = self.data_fetcher.db_manager
+            self.data_fetcher.populate_settlement_table_by_blockrange(
+                start_block, end_block
+            )
+            if self.data_fetcher.config.demand_driven_prices:
+                self.data_fetcher.populate_needed_prices(start_block)
+            else:
+                for token in self.tokens:
+                    self.data_fetcher.populate_price_table_by_blockrange(
+                        token, start_block, end_block
+                    )
+            self.data_fetcher.price_index.update(
+                db_manager.get_prices(self.network, self.tokens, start_block, end_block)
+            )
+            if self.data_fetcher.config.ingest_pool_reserves:
+                self.data_fetcher.populate_pool_reserves()
+
+            self.calculator.create_envy_data(min_block=start_block)
+            self.helper.clear_results()
+
+        instrumentation.count("follow_blocks", end_block - start_block + 1)
+        self.next_block = end_block + 1
+        return highest_block - end_block
+
+    def run(self, on_iteration: Optional[Callable[[], None]] = None):
+        """Runs until interrupted. A failed window is retried in the next iteration."""
+        while True:
+            try:
+                blocks_behind = self.step()
+            except Exception as e:
+                warning(
+                    f"Follow iteration from block {self.next_block} failed ({e}), "
+                    f"retrying in {self.poll_interval}s"
+                )
+                blocks_behind = 0
+
+            if on_iteration is not None:
+                on_iteration()
+            # catch up without waiting, then wait for new blocks
+            if blocks_behind == 0:
+                time.sleep(self.poll_interval)
@@ -0,0 +1,106 @@
+"""
+Raw calldata of the helper queries, without web3's contract machinery (ABI lookup,
+argument normalization and checksum validation, decoding of the whole response).
+
+The selectors are precomputed (configs.py) and the arguments are written as ABI words
+directly, like the balanceOf calldata in rpc.py. Of the response (order,
+preInteractions, postInteractions, sig) only the order is decoded: GPv2Order.Data has
+only static fields, so it is encoded in place in the first 12 words of the return data
+and every field can be read from its word. The interactions and the signature are not
+needed for the envy.
+
+The order is returned in the format of the cached responses (see
+`BCoWHelper.json_serializer`), except that addresses are not checksummed.
+"""
+
+from typing import List
+
+from cow_amm_trade_envy.configs import (
+    HELPER_ORDER_FROM_BUY_AMOUNT_SELECTOR,
+    HELPER_ORDER_SELECTOR,
+)
+
+WORD = 32
+
+
+def encode_uint(value: int) -> str:
+    if not 0 <= value < 2**256:
+        raise ValueError(f"{value} is not a uint256")
+    return f"{value:064x}"
+
+
+def encode_address(address: str) -> str:
+    return address[2:].lower().rjust(64, "0")
+
+
+def encode_order(pool: str, prices: List[int]) -> str:
+    # head: pool, offset of the prices array (2 words); tail: length, elements
+    return (
+        HELPER_ORDER_SELECTOR
+        + encode_address(pool)
+        + encode_uint(2 * WORD)
+        + encode_uint(len(prices))
+        + "".join(encode_uint(price) for price in prices)
+    )
+
+
+def encode_order_from_buy_amount(pool: str, buy_token: str, buy_amount: int) -> str:
+    return (
+        HELPER_ORDER_FROM_BUY_AMOUNT_SELECTOR
+        + encode_address(pool)
+        + encode_address(buy_token)
+        + encode_uint(buy_amount)
+    )
+
+
+def encode_call(function_name: str, pool: str, params: dict) -> str:
+    """Calldata of a helper query, with the parameters of its cache key."""
+    if function_name == "order":
+        return encode_order(pool, params["prices"])
+    if function_name == "orderFromBuyAmount":
+        return encode_order_from_buy_amount(
+            pool, params["buyToken"], params["buyAmount"]
+        )
+    raise ValueError(f"Unknown helper function {function_name}")
+
+
+def decode_address(word: bytes) -> str:
+    return "0x" + word[12:].hex()
+
+
+def decode_uint(word: bytes) -> int:
+    return int.from_bytes(word, "big")
+
+
+def decode_bytes32(word: bytes) -> str:
+    return word.hex()
+
+
+def decode_bool(word: bytes) -> bool:
+    return word[-1] == 1
+
+
+# fields of GPv2Order.Data
+ORDER_DECODERS = [
+    decode_address,  # sellToken
+    decode_address,  # buyToken
+    decode_address,  # receiver
+    decode_uint,  # sellAmount
+    decode_uint,  # buyAmount
+    decode_uint,  # validTo
+    decode_bytes32,  # appData
+    decode_uint,  # feeAmount
+    decode_bytes32,  # kind
+    decode_bool,  # partiallyFillable
+    decode_bytes32,  # sellTokenBalance
+    decode_bytes32,  # buyTokenBalance
+]
+
+
+def decode_order(data: bytes) -> list:
+    if len(data) < WORD * len(ORDER_DECODERS):
+        raise ValueError(f"Helper response too short for an order: 0x{data.hex()}")
+    return [
+        decoder(data[i * WORD : (i + 1) * WORD])
+        for i, decoder in enumerate(ORDER_DECODERS)
+    ]
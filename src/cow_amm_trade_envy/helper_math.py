@@ -0,0 +1,149 @@
+"""
+Local reimplementation of the order computation of the BCoW helper contracts.
+
+The helpers are deterministic given the token balances (reserves) of the pool at the
+queried block, so the order can be computed without an eth_call. All arithmetic is
+done on Python ints to reproduce the uint256 fixed point math of the contracts. The
+functions also work element-wise on NumPy arrays with dtype=object, which allows
+evaluating many (reserves, prices) combinations at once.
+
+Only 50/50 pools are supported by the helpers, so the weights are left out.
+
+Not yet validated against recorded helper responses, so the pipeline still queries the
+helpers; the benchmark fakes use it to answer like the helpers would.
+"""
+
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from cow_amm_trade_envy.models import BCowPool
+
+BONE = 10**18
+MIN_BPOW_BASE = 1
+MAX_BPOW_BASE = 2 * BONE - 1
+
+ZERO_ADDRESS = "0x" + "0" * 40
+# constants of the orders created by the helpers (app data of the helper, sell order,
+# erc20 balances)
+HELPER_APP_DATA = "362e5182440b52aa8fffe70a251550fbbcbca424740fe5a14f59bf0c1b06fe1d"
+KIND_SELL = "f3b277728b3fee749481eb3e0b3b48980dbbab78658fc419025cb16eee346775"
+BALANCE_ERC20 = "5a28e9363bb942b639270062aa6bb295f434bcdfc42c97267bf003f272060dc9"
+
+
+def select(condition, a, b):
+    # np.where would cast python ints to int64, so only use it for arrays
+    if isinstance(condition, np.ndarray):
+        return np.where(condition, a, b)
+    return a if condition else b
+
+
+def ceil_div(a, b):
+    return -((-a) // b)
+
+
+def bmul(a, b):
+    return (a * b + BONE // 2) // BONE
+
+
+def bdiv(a, b):
+    return (a * BONE + b // 2) // b
+
+
+def calc_out_given_in(balance_in, balance_out, amount_in):
+    """BMath.calcOutGivenIn for equal weights and no swap fee."""
+    # weight ratio is BONE, so bpow(y, BONE) == y; adjusted_in == amount_in
+    y = bdiv(balance_in, balance_in + amount_in)
+    if np.any(y < MIN_BPOW_BASE) or np.any(y > MAX_BPOW_BASE):
+        raise ValueError("BNum_BPowBaseTooLow/High")
+    return bmul(balance_out, BONE - y)
+
+
+def tradeable_order(reserve0, reserve1, price0, price1) -> tuple:
+    """
+    Order of the full-CoW helper (`order(pool, prices)`).
+
+    The pool trades half way towards the price given by the clearing prices.
+    Returns (sell_token0, sell_amount, buy_amount) where sell_token0 tells if the
+    pool sells token0 (and buys token1) or the other way around.
+    """
+    # pool sells token0 if it is cheaper in the pool than given by the prices
+    sell_token0 = reserve1 * price1 < reserve0 * price0
+
+    sell_amount0 = reserve0 // 2 - ceil_div(reserve1 * price1, 2 * price0)
+    sell_amount1 = reserve1 // 2 - ceil_div(reserve0 * price0, 2 * price1)
+    sell_amount = select(sell_token0, sell_amount0, sell_amount1)
+    if np.any(sell_amount <= 0):
+        raise ValueError("NoOrder")
+
+    reserve_sell = select(sell_token0, reserve0, reserve1)
+    reserve_buy = select(sell_token0, reserve1, reserve0)
+    buy_amount = ceil_div(sell_amount * reserve_buy, reserve_sell - sell_amount)
+
+    # the helper recomputes the sell amount with calcOutGivenIn to avoid rounding
+    # issues in the settlement
+    sell_amount = calc_out_given_in(reserve_buy, reserve_sell, buy_amount)
+
+    if isinstance(sell_token0, np.ndarray):
+        return sell_token0, sell_amount, buy_amount
+    return bool(sell_token0), int(sell_amount), int(buy_amount)
+
+
+def order_from_buy_amount(reserve_buy, reserve_sell, buy_amount):
+    """Sell amount of the partial-CoW helper (`orderFromBuyAmount`)."""
+    return calc_out_given_in(reserve_buy, reserve_sell, buy_amount)
+
+
+def order_response(
+    sell_token: str, buy_token: str, sell_amount: int, buy_amount: int
+) -> List:
+    """
+    Order in the format of a (serialized) helper response.
+
+    validTo depends on the block timestamp and is not reproduced; it is not used by
+    the envy calculation.
+    """
+    return [
+        sell_token,
+        buy_token,
+        ZERO_ADDRESS,
+        sell_amount,
+        buy_amount,
+        0,
+        HELPER_APP_DATA,
+        0,
+        KIND_SELL,
+        True,
+        BALANCE_ERC20,
+        BALANCE_ERC20,
+    ]
+
+
+def pool_order(pool: "BCowPool", reserves: Tuple[int, int], prices: list) -> List:
+    """Response order of `order(pool, prices)` given the reserves of the pool."""
+    sell_token0, sell_amount, buy_amount = tradeable_order(
+        reserves[0], reserves[1], prices[0], prices[1]
+    )
+    sell_token, buy_token = (
+        (pool.TOKEN0, pool.TOKEN1) if sell_token0 else (pool.TOKEN1, pool.TOKEN0)
+    )
+    return order_response(
+        sell_token.address, buy_token.address, sell_amount, buy_amount
+    )
+
+
+def pool_order_from_buy_amount(
+    pool: "BCowPool", reserves: Tuple[int, int], buy_token: str, buy_amount: int
+) -> List:
+    """Response order of `orderFromBuyAmount(pool, buy_token, buy_amount)` given the
+    reserves of the pool."""
+    reserve0, reserve1 = reserves
+    if buy_token.lower() == pool.TOKEN0.address:
+        sell_token, reserve_buy, reserve_sell = pool.TOKEN1, reserve0, reserve1
+    else:
+        sell_token, reserve_buy, reserve_sell = pool.TOKEN0, reserve1, reserve0
+    sell_amount = order_from_buy_amount(reserve_buy, reserve_sell, buy_amount)
+    return order_response(
+        sell_token.address, buy_token.lower(), sell_amount, buy_amount
+    )
@@ -0,0 +1,103 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import polars as pl
+
+from cow_amm_trade_envy.models import tokens_factory
+
+
+class PriceIndex:
+    """In-memory replacement for the price table lookups of the DataFetcher.
+
+    Prices are stored per token as sorted block numbers so that the price valid
+    at a block is found with a binary search instead of a DB round-trip.
+    """
+
+    def __init__(self, network: str, prices: pl.DataFrame):
+        self.network = network
+        self.native_address = tokens_factory(network).native.address
+        self.series: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for (token_address,), df in prices.sort("block_number").group_by(
+            "token", maintain_order=True
+        ):
+            self.series[token_address] = (
+                df["block_number"].to_numpy().astype(np.int64),
+                df["price"].to_numpy().astype(np.float64),
+            )
+
+    def update(self, prices: pl.DataFrame):
+        """Adds prices of later blocks, e.g. of newly ingested ranges."""
+        for (token_address,), df in prices.sort("block_number").group_by(
+            "token", maintain_order=True
+        ):
+            blocks = df["block_number"].to_numpy().astype(np.int64)
+            values = df["price"].to_numpy().astype(np.float64)
+            if token_address in self.series:
+                old_blocks, old_values = self.series[token_address]
+                keep = old_blocks < blocks[0]
+                blocks = np.concatenate([old_blocks[keep], blocks])
+                values = np.concatenate([old_values[keep], values])
+            self.series[token_address] = (blocks, values)
+
+    def get_price(self, token_address: str, block_number: int) -> Optional[float]:
+        if token_address not in self.series:
+            return None
+        blocks, prices = self.series[token_address]
+        # last price at or before the block, same as the SQL lookup
+        idx = np.searchsorted(blocks, block_number, side="right") - 1
+        if idx < 0:
+            return None
+        return float(prices[idx])
+
+    def get_token_to_native_rate(
+        self, token_address: str, block_number: int
+    ) -> float | None:
+        price = self.get_price(token_address, block_number)  # usd/token
+        native_price = self.get_price(self.native_address, block_number)  # usd/native
+        if price is None or native_price is None:
+            return None
+        return price / native_price
+
+
+class PoolReserveIndex:
+    """Pool token balances keyed by pool and block.
+
+    The blocks of each pool are kept in a sorted array so that a lookup is a binary
+    search. Reserves are python ints (object arrays) because they exceed int64.
+    """
+
+    def __init__(self, reserves: pl.DataFrame):
+        self.series: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for (pool_address,), df in reserves.sort("block_number").group_by(
+            "pool", maintain_order=True
+        ):
+            self.series[pool_address] = (
+                df["block_number"].to_numpy().astype(np.int64),
+                np.array(df["reserve0"].to_list(), dtype=object),
+                np.array(df["reserve1"].to_list(), dtype=object),
+            )
+
+    def update(self, reserves: pl.DataFrame):
+        """Adds reserves of later blocks, e.g. of newly ingested ranges."""
+        for (pool_address,), df in reserves.sort("block_number").group_by(
+            "pool", maintain_order=True
+        ):
+            blocks = df["block_number"].to_numpy().astype(np.int64)
+            reserves0 = np.array(df["reserve0"].to_list(), dtype=object)
+            reserves1 = np.array(df["reserve1"].to_list(), dtype=object)
+            if pool_address in self.series:
+                old_blocks, old_reserves0, old_reserves1 = self.series[pool_address]
+                keep = old_blocks < blocks[0]
+                blocks = np.concatenate([old_blocks[keep], blocks])
+                reserves0 = np.concatenate([old_reserves0[keep], reserves0])
+                reserves1 = np.concatenate([old_reserves1[keep], reserves1])
+            self.series[pool_address] = (blocks, reserves0, reserves1)
+
+    def get(self, pool_address: str, block_number: int) -> Optional[Tuple[int, int]]:
+        if pool_address not in self.series:
+            return None
+        blocks, reserves0, reserves1 = self.series[pool_address]
+        idx = np.searchsorted(blocks, block_number)
+        if idx == len(blocks) or blocks[idx] != block_number:
+            return None
+        return int(reserves0[idx]), int(reserves1[idx])
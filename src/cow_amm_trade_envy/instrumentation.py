@@ -0,0 +1,162 @@
+import functools
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class Instrumentation:
+    """Collects durations per pipeline stage, counters and gauges for one run.
+
+    Use `timer` as a context manager or `timed` as decorator. Listeners are called
+    for every measured duration / counter increment / gauge value, e.g. to export
+    metrics. Calls and total time are exact, the percentiles come from a uniform
+    sample of at most `max_samples` durations per stage, so long runs (follow mode)
+    use bounded memory.
+    """
+
+    def __init__(self, max_samples: int = 10_000):
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.random = random.Random(0)
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.total_seconds: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+        # last value per gauge and label values
+        self.gauges: Dict[str, float] = {}
+        self.timer_listeners: List[Callable[[str, float, dict], None]] = []
+        self.counter_listeners: List[Callable[[str, int, dict], None]] = []
+        self.gauge_listeners: List[Callable[[str, float, dict], None]] = []
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.record(stage, duration)
+            for listener in self.timer_listeners:
+                listener(stage, duration, labels)
+
+    def record(self, stage: str, duration: float):
+        # reservoir sampling, every duration is kept with probability max_samples/calls
+        self.calls[stage] += 1
+        self.total_seconds[stage] += duration
+        sample = self.durations[stage]
+        if len(sample) < self.max_samples:
+            sample.append(duration)
+        else:
+            i = self.random.randrange(self.calls[stage])
+            if i < self.max_samples:
+                sample[i] = duration
+
+    def timed(self, stage: str) -> Callable:
+        def decorator(fun: Callable) -> Callable:
+            @functools.wraps(fun)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return fun(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, n: int = 1, **labels):
+        with self.lock:
+            self.counters[name] += n
+        for listener in self.counter_listeners:
+            listener(name, n, labels)
+
+    def gauge(self, name: str, value: float, **labels):
+        key = name
+        if labels:
+            key += "[" + ",".join(str(v) for _, v in sorted(labels.items())) + "]"
+        with self.lock:
+            self.gauges[key] = value
+        for listener in self.gauge_listeners:
+            listener(name, value, labels)
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        """Hit rate for every pair of `<cache>.hit` and `<cache>.miss` counters."""
+        caches = {name.rsplit(".", 1)[0] for name in self.counters}
+        rates = {}
+        for cache in sorted(caches):
+            hits = self.counters.get(f"{cache}.hit", 0)
+            misses = self.counters.get(f"{cache}.miss", 0)
+            if hits + misses > 0:
+                rates[cache] = hits / (hits + misses)
+        return rates
+
+    def summary(self) -> List[dict]:
+        rows = []
+        with self.lock:
+            durations = {
+                stage: list(values) for stage, values in self.durations.items()
+            }
+            calls, total_seconds = dict(self.calls), dict(self.total_seconds)
+        for stage, values in sorted(durations.items()):
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            rows.append(
+                {
+                    "stage": stage,
+                    "calls": calls[stage],
+                    "total_s": total_seconds[stage],
+                    "p50_ms": float(p50),
+                    "p95_ms": float(p95),
+                    "p99_ms": float(p99),
+                }
+            )
+        return rows
+
+    def report(self, json_path: Optional[str] = None):
+        summary = self.summary()
+        hit_rates = self.cache_hit_rates()
+
+        print(
+            f"{'stage':<32}{'calls':>10}{'total s':>12}"
+            f"{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}"
+        )
+        for row in summary:
+            print(
+                f"{row['stage']:<32}{row['calls']:>10}{row['total_s']:>12.2f}"
+                f"{row['p50_ms']:>12.2f}{row['p95_ms']:>12.2f}{row['p99_ms']:>12.2f}"
+            )
+        for name, value in sorted(self.counters.items()):
+            print(f"{name:<32}{value:>10}")
+        for name, value in sorted(self.gauges.items()):
+            print(f"{name:<32}{value:>10.1f}")
+        for cache, rate in hit_rates.items():
+            print(f"{cache + ' hit rate':<32}{rate:>10.1%}")
+
+        if json_path is not None:
+            with open(json_path, "w") as f:
+                json.dump(
+                    {
+                        "stages": summary,
+                        "counters": dict(self.counters),
+                        "gauges": dict(self.gauges),
+                        "cache_hit_rates": hit_rates,
+                    },
+                    f,
+                    indent=2,
+                )
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.calls.clear()
+            self.total_seconds.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+
+# shared by all components of the pipeline
+instrumentation = Instrumentation()
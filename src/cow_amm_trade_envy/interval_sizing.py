@@ -0,0 +1,121 @@
+import time
+from logging import warning
+from typing import Callable, List, Optional
+
+import polars as pl
+import requests
+from tenacity import RetryError
+from tqdm import tqdm
+
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+# spice raises a plain Exception for executions that failed on Dune (mostly the time
+# limit) and for API errors, matched by their message
+SIZE_ERROR_MESSAGES = ("query failed", "timed out", "timeout", "too large")
+
+
+def is_size_error(e: BaseException) -> bool:
+    """Whether a failed query could succeed on a smaller interval (timeout or too
+    large result)."""
+    if isinstance(e, RetryError):  # after the retries of execute_dune_query
+        e = e.last_attempt.exception()
+    if isinstance(e, (TimeoutError, requests.Timeout)):
+        return True
+    return any(message in str(e).lower() for message in SIZE_ERROR_MESSAGES)
+
+
+class AdaptiveSplitter:
+    """Sizes the block intervals of a Dune dataset after the rows per block (and
+    seconds per block) seen in earlier results, so that an interval returns about
+    `target_rows` rows (and runs at most about `target_seconds`).
+
+    The estimates are moving averages over the results. A query that times out or
+    returns a too large result counts as a sign that the interval was about twice too
+    large: the estimates are raised accordingly and the interval is retried in halves.
+    Other errors are raised.
+    """
+
+    def __init__(
+        self,
+        dataset: str,
+        default_length: int,
+        target_rows: int,
+        target_seconds: Optional[float] = None,
+        min_length: int = 1,
+        max_length: Optional[int] = None,
+        rows_per_block: Optional[float] = None,
+        seconds_per_block: Optional[float] = None,
+        smoothing: float = 0.3,
+    ):
+        self.dataset = dataset
+        self.default_length = default_length
+        self.target_rows = target_rows
+        self.target_seconds = target_seconds
+        self.min_length = min_length
+        self.max_length = max_length if max_length is not None else 10 * default_length
+        self.rows_per_block = rows_per_block
+        self.seconds_per_block = seconds_per_block
+        self.smoothing = smoothing
+
+    def next_length(self) -> int:
+        if self.rows_per_block is None:
+            return self.default_length
+        lengths = [self.target_rows / max(self.rows_per_block, 1e-9)]
+        if self.target_seconds is not None and self.seconds_per_block is not None:
+            lengths.append(self.target_seconds / max(self.seconds_per_block, 1e-9))
+        return int(max(self.min_length, min(self.max_length, *lengths)))
+
+    def average(self, current: Optional[float], observed: float) -> float:
+        if current is None:
+            return observed
+        return (1 - self.smoothing) * current + self.smoothing * observed
+
+    def observe(self, n_blocks: int, n_rows: int, seconds: float):
+        self.rows_per_block = self.average(self.rows_per_block, n_rows / n_blocks)
+        self.seconds_per_block = self.average(
+            self.seconds_per_block, seconds / n_blocks
+        )
+
+    def observe_failure(self, n_blocks: int):
+        self.rows_per_block = max(
+            self.rows_per_block or 0.0, 2 * self.target_rows / n_blocks
+        )
+        if self.target_seconds is not None:
+            self.seconds_per_block = max(
+                self.seconds_per_block or 0.0, 2 * self.target_seconds / n_blocks
+            )
+
+    def fetch(
+        self,
+        start_block: int,
+        end_block: int,
+        query: Callable[[int, int], pl.DataFrame],
+        desc: str = "",
+    ) -> List[pl.DataFrame]:
+        """Results of `query(left, right)` for intervals covering the block range
+        (inclusive). Raises if a query of min_length blocks fails or a query fails
+        for another reason than its size."""
+        dfs = []
+        left = start_block
+        with tqdm(total=end_block - start_block + 1, desc=desc, unit="block") as pbar:
+            while left <= end_block:
+                right = min(left + self.next_length() - 1, end_block)
+                n_blocks = right - left + 1
+                start = time.perf_counter()
+                try:
+                    df = query(left, right)
+                except Exception as e:
+                    if n_blocks <= self.min_length or not is_size_error(e):
+                        raise
+                    warning(
+                        f"{self.dataset} query for blocks {left} to {right} failed "
+                        f"({e}), retrying in smaller intervals"
+                    )
+                    instrumentation.count("dune_interval_splits", dataset=self.dataset)
+                    self.observe_failure(n_blocks)
+                    continue
+                self.observe(n_blocks, len(df), time.perf_counter() - start)
+                dfs.append(df)
+                pbar.update(n_blocks)
+                left = right + 1
+        return dfs
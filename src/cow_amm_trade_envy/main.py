@@ -6,48 +6,136 @@ from cow_amm_trade_envy.configs import EnvyCalculatorConfig, DataFetcherConfig,
 from fire import Fire
 import datetime
 from cow_amm_trade_envy.models import pools_factory
+from cow_amm_trade_envy.instrumentation import instrumentation
+from cow_amm_trade_envy.metrics_exporter import PrometheusExporter
+from cow_amm_trade_envy.profiling import IOTracer, profiled
+from cow_amm_trade_envy.follow import ChainFollower
+from contextlib import ExitStack
 
 SUPPORTED_NETWORKS = ["ethereum", "gnosis"]
 
 
 def main_by_time(
-    network: str, time_start: str, time_end: str = None, used_pool_names: list = None
+    network: str,
+    time_start: str,
+    time_end: str = None,
+    used_pool_names: list = None,
+    metrics_report: str = None,
+    metrics_port: int = None,
+    metrics_textfile: str = None,
+    profile: str = None,
+    profile_top: int = 30,
+    trace_io=None,
+    follow: bool = False,
+    poll_interval: float = 60,
+    window_blocks: int = 300,
+    settlement_source: str = "dune",
+    demand_driven_prices: bool = False,
+    adaptive_intervals: bool = False,
+    dune_archive_dir: str = None,
+    rpc_hedge_after: float = None,
 ):
-    load_dotenv()
-
-    # check that the env vars are set
-    with open(".env.example", "r") as f:
-        for line in f.readlines():
-            var_name = line.split("=")[0]
-            if os.getenv(var_name) is None:
-                raise ValueError(f"Env var {var_name} is not set.")
-
-    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
-
-    data_fetcher = DataFetcher(
-        DataFetcherConfig(
-            min_block=0,  # just a dummy
-            pg_config=pg_config,
-            network=network,
+    """
+    profile: profile the run and write it to <profile>.pstats (cProfile) or
+        <profile>.speedscope.json (if pyinstrument is installed)
+    trace_io: log every Dune, RPC and SQL call with its duration. Pass a path to write
+        them as JSON lines to a file instead of stdout.
+    follow: after catching up, keep polling for new blocks and compute the envy of
+        new settlements every poll_interval seconds, in windows of window_blocks
+        (time_end is ignored)
+    settlement_source: "dune" or "node" (decode the settle calls from the node, without
+        the indexing delay of Dune, e.g. together with --follow)
+    demand_driven_prices: only fetch the prices at the blocks of candidate settlements
+        that need a conversion rate, instead of every block of every pool token
+    adaptive_intervals: size the Dune query intervals after the rows per block of
+        earlier results (stored in dune_interval_stats), failed intervals are split
+    dune_archive_dir: keep the raw Dune results in this directory and answer repeated
+        queries (same query id and parameters) from there
+    rpc_hedge_after: with several node URLs (comma separated), send an eth_call that
+        got no response after this many seconds also to the next endpoint
+    """
+    with ExitStack() as stack:
+        if trace_io is not None:
+            tracer = IOTracer(None if trace_io is True else trace_io)
+            tracer.attach(instrumentation)
+            stack.callback(tracer.close)
+        if profile is not None:
+            stack.enter_context(profiled(profile, profile_top))
+
+        load_dotenv()
+
+        # check that the env vars are set
+        with open(".env.example", "r") as f:
+            for line in f.readlines():
+                var_name = line.split("=")[0]
+                if os.getenv(var_name) is None:
+                    raise ValueError(f"Env var {var_name} is not set.")
+
+        pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+
+        data_fetcher = DataFetcher(
+            DataFetcherConfig(
+                min_block=0,  # just a dummy
+                pg_config=pg_config,
+                network=network,
+            )
         )
-    )
-    if time_end is None:
-        date_end = datetime.datetime.now(datetime.timezone.utc)
-        time_end = date_end.strftime("%Y-%m-%d %H:%M:%S")
-
-    print(
-        f"Getting blocks for times {time_start} and {time_end} (minus potential backoff)..."
-    )
-    min_block = data_fetcher.get_block_number_by_time(time_start)
-    max_block = data_fetcher.get_block_number_by_time(time_end)
-    print(f"Got blocks {min_block} and {max_block}")
+        if time_end is None and not follow:
+            date_end = datetime.datetime.now(datetime.timezone.utc)
+            time_end = date_end.strftime("%Y-%m-%d %H:%M:%S")
 
-    main(network, min_block, max_block, used_pool_names)
+        print(
+            f"Getting blocks for times {time_start} and {time_end} (minus potential backoff)..."
+        )
+        min_block = data_fetcher.get_block_number_by_time(time_start)
+        max_block = None
+        if not follow:
+            max_block = data_fetcher.get_block_number_by_time(time_end)
+        print(f"Got blocks {min_block} and {max_block}")
+
+        main(
+            network,
+            min_block,
+            max_block,
+            used_pool_names,
+            metrics_report,
+            metrics_port,
+            metrics_textfile,
+            follow,
+            poll_interval,
+            window_blocks,
+            settlement_source,
+            demand_driven_prices,
+            adaptive_intervals,
+            dune_archive_dir,
+            rpc_hedge_after,
+        )
 
 
 def main(
-    network: str, min_block: int, max_block: int = None, used_pool_names: list = None
+    network: str,
+    min_block: int,
+    max_block: int = None,
+    used_pool_names: list = None,
+    metrics_report: str = None,
+    metrics_port: int = None,
+    metrics_textfile: str = None,
+    follow: bool = False,
+    poll_interval: float = 60,
+    window_blocks: int = 300,
+    settlement_source: str = "dune",
+    demand_driven_prices: bool = False,
+    adaptive_intervals: bool = False,
+    dune_archive_dir: str = None,
+    rpc_hedge_after: float = None,
 ):
+    exporter = None
+    if metrics_port is not None or metrics_textfile is not None:
+        exporter = PrometheusExporter(network)
+        exporter.attach(instrumentation)
+        if metrics_port is not None:
+            exporter.serve(metrics_port)
+
     supported_pools = pools_factory(network).get_pools()
 
     # make sure there are no duplicates
@@ -78,6 +166,11 @@ def main(
         max_block=max_block,  # 21525891,
         pg_config=pg_config,
         used_pools=used_pools,
+        settlement_source=settlement_source,
+        demand_driven_prices=demand_driven_prices,
+        adaptive_intervals=adaptive_intervals,
+        dune_archive_dir=dune_archive_dir,
+        rpc_hedge_after=rpc_hedge_after,
     )
 
     data_fetcher = DataFetcher(dfc)
@@ -85,8 +178,22 @@ def main(
 
     # fetch data (from dune)
     data_fetcher.populate_settlement_and_price()
-    calculator = TradeEnvyCalculator(config, dfc, used_pools)
+    calculator = TradeEnvyCalculator(config, dfc, used_pools, data_fetcher=data_fetcher)
     calculator.create_envy_data()
+    data_fetcher.settlement_source.report_skipped()
+
+    # per-stage timings and cache hit rates of this run
+    instrumentation.report(metrics_report)
+    if metrics_textfile is not None:
+        exporter.write_textfile(metrics_textfile)
+
+    if follow:
+
+        def on_iteration():
+            if metrics_textfile is not None:
+                exporter.write_textfile(metrics_textfile)
+
+        ChainFollower(calculator, poll_interval, window_blocks).run(on_iteration)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+Prometheus exporter for the pipeline instrumentation.
+
+Timers are exported as histograms `trade_envy_<stage>_seconds`, counters as
+`trade_envy_<name>_total` and gauges as `trade_envy_<name>`. Metrics are served on a local HTTP endpoint and/or written
+in the text format for the node exporter's textfile collector.
+"""
+
+import os
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from cow_amm_trade_envy.instrumentation import Instrumentation
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels)
+    return "{" + inner + "}"
+
+
+class PrometheusExporter:
+    def __init__(self, network: str, prefix: str = "trade_envy"):
+        self.network = network
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelSet, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        # per label set: bucket counts, sum, count
+        self.histograms: Dict[str, Dict[LabelSet, List]] = defaultdict(dict)
+        self.gauges: Dict[str, Dict[LabelSet, float]] = defaultdict(dict)
+
+    def attach(self, instrumentation: Instrumentation):
+        instrumentation.timer_listeners.append(self.observe)
+        instrumentation.counter_listeners.append(self.increment)
+        instrumentation.gauge_listeners.append(
+            lambda name, value, labels: self.set_gauge(name, value, **labels)
+        )
+
+    def label_set(self, labels: dict) -> LabelSet:
+        return tuple(sorted({"network": self.network, **labels}.items()))
+
+    def metric_name(self, name: str) -> str:
+        return f"{self.prefix}_{name}".replace(".", "_").replace("-", "_")
+
+    def observe(self, stage: str, duration: float, labels: dict):
+        name = self.metric_name(stage) + "_seconds"
+        label_set = self.label_set(labels)
+        with self.lock:
+            if label_set not in self.histograms[name]:
+                self.histograms[name][label_set] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram = self.histograms[name][label_set]
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += duration
+            histogram[2] += 1
+
+    def increment(self, name: str, n: int, labels: dict):
+        labels = dict(labels)
+        # <cache>.hit / <cache>.miss -> cache_requests_total{cache, result}
+        cache, _, result = name.rpartition(".")
+        if result in ("hit", "miss"):
+            name = "cache_requests"
+            labels.update({"cache": cache, "result": result})
+        elif name.startswith("rows_upserted."):
+            labels["table"] = name.split(".", 1)[1]
+            name = "rows_upserted"
+
+        with self.lock:
+            self.counters[self.metric_name(name) + "_total"][
+                self.label_set(labels)
+            ] += n
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[self.metric_name(name)][self.label_set(labels)] = value
+
+    def cache_hit_ratios(self) -> Dict[LabelSet, float]:
+        requests = self.counters.get(self.metric_name("cache_requests") + "_total", {})
+        totals, hits = defaultdict(float), defaultdict(float)
+        for label_set, value in requests.items():
+            labels = dict(label_set)
+            result = labels.pop("result")
+            key = tuple(sorted(labels.items()))
+            totals[key] += value
+            if result == "hit":
+                hits[key] += value
+        return {key: hits[key] / total for key, total in totals.items() if total > 0}
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for label_set, value in series.items():
+                    lines.append(f"{name}{format_labels(label_set)} {value}")
+
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+            gauges[self.metric_name("cache_hit_ratio")] = self.cache_hit_ratios()
+            for name, series in sorted(gauges.items()):
+                if not series:
+                    continue
+                lines.append(f"# TYPE {name} gauge")
+                for label_set, value in series.items():
+                    lines.append(f"{name}{format_labels(label_set)} {value}")
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for label_set, (bucket_counts, total, count) in series.items():
+                    for bound, bucket_count in zip(BUCKETS, bucket_counts):
+                        bucket_labels = label_set + (("le", str(bound)),)
+                        lines.append(
+                            f"{name}_bucket{format_labels(bucket_labels)} {bucket_count}"
+                        )
+                    inf_labels = label_set + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{format_labels(inf_labels)} {count}")
+                    lines.append(f"{name}_sum{format_labels(label_set)} {total}")
+                    lines.append(f"{name}_count{format_labels(label_set)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Atomic write, as required by the textfile collector."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -1,8 +1,15 @@
-from web3 import Web3
 from typing import Dict, List, Tuple, ClassVar
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
 
-w3 = Web3()
+
+# the same few token and pool addresses are checksummed over and over
+@lru_cache(maxsize=1024)
+def to_checksum_address(address: str) -> str:
+    # eth_utils takes a while to import, only load it when a checksum is needed
+    from eth_utils import to_checksum_address
+
+    return to_checksum_address(address)
 
 
 @dataclass(frozen=True)
@@ -128,9 +135,9 @@ class BCowPool:
     TOKEN1: Token
     creation_block: int
 
-    @property
+    @cached_property
     def checksum_address(self) -> str:
-        return w3.to_checksum_address(self.ADDRESS)
+        return to_checksum_address(self.ADDRESS)
 
     @property
     def first_block_active(self) -> int:
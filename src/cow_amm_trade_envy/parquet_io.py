@@ -0,0 +1,264 @@
+"""
+Export and import of the pipeline tables (settle, price, envy) as Parquet.
+
+A table is written to `{out_dir}/{network}/{table}/{first block}_{last block}.parquet`,
+one file per `partition_blocks` blocks, so a block range can be loaded with a glob
+(`pl.scan_parquet(".../ethereum/envy/*.parquet")`). Rows are streamed from a
+server-side cursor ordered by block and written in row groups, the export only holds
+one chunk in memory. Columns are typed after the Postgres types: NUMERIC (prices,
+envy) is written as text to stay exact (cast with `str.to_decimal()` or to float for
+analyses), the big-int lists of the settlements stay text as in the tables.
+Partitions are always exported whole, the block range is widened to their bounds, so
+exporting a partition again overwrites its file with all of its rows. The exported
+`updated_at` is not imported, imported envy rows are new to the incremental Dune sync.
+"""
+
+import glob
+import os
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import polars as pl
+import psycopg2.extensions
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from fire import Fire
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, EnvyCalculatorConfig, PGConfig
+from cow_amm_trade_envy.datasources import DatabaseManager, DataFetcher
+from cow_amm_trade_envy.db_utils import PG_TYPES, UPDATED_AT, upsert_data
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+
+# block column per table, the price tables are exported together with a token column
+TABLES = {
+    "settle": "call_block_number",
+    "price": "block_number",
+    "envy": "block_number",
+}
+# NUMERIC values as the text Postgres sends, like read_frame
+NUMERIC_AS_TEXT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, "NUMERIC_AS_TEXT", lambda value, cursor: value
+)
+
+
+def partition_path(
+    out_dir: str, network: str, table: str, partition: int, partition_blocks: int
+) -> str:
+    first_block = partition * partition_blocks
+    last_block = first_block + partition_blocks - 1
+    return os.path.join(
+        out_dir, network, table, f"{first_block:09d}_{last_block:09d}.parquet"
+    )
+
+
+def table_paths(in_dir: str, network: str, table: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(in_dir, network, table, "*.parquet")))
+
+
+class PartitionWriter:
+    """Writes chunks ordered by block to one Parquet file per block range."""
+
+    def __init__(
+        self,
+        out_dir: str,
+        network: str,
+        table: str,
+        block_column: str,
+        partition_blocks: int,
+    ):
+        self.out_dir = out_dir
+        self.network = network
+        self.table = table
+        self.block_column = block_column
+        self.partition_blocks = partition_blocks
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.partition: Optional[int] = None
+
+    def write(self, df: pl.DataFrame):
+        df = df.with_columns(
+            (pl.col(self.block_column) // self.partition_blocks).alias("partition")
+        )
+        for (partition,), chunk in df.group_by("partition", maintain_order=True):
+            chunk = chunk.drop("partition").to_arrow()
+            if partition != self.partition:
+                self.close()
+                self.partition = partition
+                path = partition_path(
+                    self.out_dir,
+                    self.network,
+                    self.table,
+                    partition,
+                    self.partition_blocks,
+                )
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.writer = pq.ParquetWriter(path, chunk.schema, compression="zstd")
+            self.writer.write_table(chunk)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class ParquetExporter:
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        network: str,
+        out_dir: str,
+        partition_blocks: int = 100_000,
+        chunk_rows: int = 50_000,
+    ):
+        self.db_manager = db_manager
+        self.network = network
+        self.out_dir = out_dir
+        self.partition_blocks = partition_blocks
+        self.chunk_rows = chunk_rows
+
+    def price_tables(self) -> List[str]:
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'trade_envy' AND table_name LIKE %s
+                """,
+                (f"{self.network}\\_0x%\\_price",),
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def table_query(self, table: str) -> Optional[str]:
+        block_column = TABLES[table]
+        if table != "price":
+            source = f"trade_envy.{self.network}_{table}"
+            return f"""
+                SELECT * FROM {source}
+                WHERE {block_column} BETWEEN %(start)s AND %(end)s
+                ORDER BY {block_column}
+                """
+
+        price_tables = self.price_tables()
+        if not price_tables:
+            return None
+        # the token is part of the table name
+        selects = [
+            f"""
+            SELECT '{table_name.split("_")[1]}' AS token, block_number, price
+            FROM trade_envy.{table_name}
+            WHERE block_number BETWEEN %(start)s AND %(end)s
+            """
+            for table_name in price_tables
+        ]
+        return " UNION ALL ".join(selects) + " ORDER BY block_number, token"
+
+    def partition_bounds(self, start_block: int, end_block: int) -> Tuple[int, int]:
+        """The block range widened to whole partitions."""
+        first_partition = start_block // self.partition_blocks
+        last_partition = end_block // self.partition_blocks
+        return (
+            first_partition * self.partition_blocks,
+            (last_partition + 1) * self.partition_blocks - 1,
+        )
+
+    def export_table(self, table: str, start_block: int, end_block: int) -> int:
+        query = self.table_query(table)
+        if query is None:
+            return 0
+        # a partial partition would overwrite the file with a subset of its rows
+        start_block, end_block = self.partition_bounds(start_block, end_block)
+        writer = PartitionWriter(
+            self.out_dir, self.network, table, TABLES[table], self.partition_blocks
+        )
+
+        n_rows = 0
+        with self.db_manager.connect() as conn:
+            # server-side cursor, rows are fetched in chunks while they are written
+            with conn.cursor(name=f"export_{self.network}_{table}") as cursor:
+                cursor.itersize = self.chunk_rows
+                psycopg2.extensions.register_type(NUMERIC_AS_TEXT, cursor)
+                cursor.execute(query, {"start": start_block, "end": end_block})
+                while rows := cursor.fetchmany(self.chunk_rows):
+                    schema = {
+                        desc.name: PG_TYPES.get(desc.type_code, pl.Utf8)
+                        for desc in cursor.description
+                    }
+                    writer.write(pl.DataFrame(rows, schema=schema, orient="row"))
+                    n_rows += len(rows)
+
+        writer.close()
+        return n_rows
+
+
+def load_table(in_dir: str, network: str, table: str) -> pl.LazyFrame:
+    """All exported partitions of a table, e.g. for analyses or tests."""
+    return pl.scan_parquet(os.path.join(in_dir, network, table, "*.parquet"))
+
+
+def import_table(data_fetcher: DataFetcher, in_dir: str, table: str) -> int:
+    """Upserts the exported partitions of a table, creating the tables if needed."""
+    network = data_fetcher.config.network
+    if table == "settle":
+        data_fetcher.create_settlement_table()
+    elif table == "envy":
+        TradeEnvyCalculator(
+            EnvyCalculatorConfig(network=network),
+            data_fetcher.config,
+            data_fetcher=data_fetcher,
+        ).create_envy_table()
+
+    n_rows = 0
+    for path in table_paths(in_dir, network, table):
+        df = pl.read_parquet(path)
+        if table == "price":
+            partitions = df.partition_by("token", as_dict=True)
+        else:
+            partitions = {(None,): df}
+
+        for (token,), partition in partitions.items():
+            table_name = f"{network}_{table}"
+            if token is not None:
+                table_name = f"{network}_{token}_price"
+                data_fetcher.create_price_table(token)
+                partition = partition.drop("token")
+            # imported rows count as changed (updated_at = now()), so the next
+            # incremental Dune sync uploads them even if older than its high-water mark
+            if UPDATED_AT in partition.columns:
+                partition = partition.drop(UPDATED_AT)
+            # python objects, so that nulls stay None and ints are not cast to float
+            pdf = pd.DataFrame(
+                partition.rows(), columns=partition.columns, dtype=object
+            )
+            with data_fetcher.db_manager.connect() as conn:
+                upsert_data(table_name, pdf, conn)
+        n_rows += len(df)
+    return n_rows
+
+
+def export_tables(
+    network: str,
+    out_dir: str,
+    start_block: int = 0,
+    end_block: int = 2**31 - 1,
+    tables: list = None,
+    partition_blocks: int = 100_000,
+):
+    load_dotenv()
+    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+    exporter = ParquetExporter(
+        DatabaseManager(start_block, pg_config), network, out_dir, partition_blocks
+    )
+    for table in tables or list(TABLES):
+        n_rows = exporter.export_table(table, start_block, end_block)
+        print(f"Exported {n_rows} rows of {network} {table} to {out_dir}")
+
+
+def import_tables(network: str, in_dir: str, tables: list = None):
+    load_dotenv()
+    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+    data_fetcher = DataFetcher(DataFetcherConfig(network, 0, pg_config))
+    for table in tables or list(TABLES):
+        n_rows = import_table(data_fetcher, in_dir, table)
+        print(f"Imported {n_rows} rows of {network} {table} from {in_dir}")
+
+
+if __name__ == "__main__":
+    Fire({"export": export_tables, "import": import_tables})
@@ -0,0 +1,129 @@
+"""
+Profiling and I/O tracing of a pipeline run.
+
+`profiled` runs a block under a profiler: pyinstrument (sampling, speedscope output)
+if it is installed, cProfile (pstats output) otherwise. Both print the functions
+with the most own time. `IOTracer` logs every external call (Dune, RPC, SQL) with
+its duration, based on the timings of the instrumentation.
+"""
+
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from cow_amm_trade_envy.instrumentation import Instrumentation
+
+# stages of the instrumentation that measure a single external call
+IO_STAGES = ("dune_query", "rpc_request", "sql")
+
+
+class IOTracer:
+    """Logs external calls to stdout, or as JSON lines to a file if a path is given."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.file = open(path, "a") if path is not None else None
+        self.lock = threading.Lock()
+        self.instrumentation = None
+
+    def attach(self, instrumentation: Instrumentation):
+        instrumentation.timer_listeners.append(self.on_timer)
+        self.instrumentation = instrumentation
+
+    def on_timer(self, stage: str, duration: float, labels: dict):
+        if stage not in IO_STAGES:
+            return
+        record = {
+            "start": time.time() - duration,
+            "stage": stage,
+            "duration_ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+            **labels,
+        }
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(record) + "\n")
+                self.file.flush()
+            else:
+                details = " ".join(f"{key}={value}" for key, value in labels.items())
+                print(f"[io] {stage} {details} {duration * 1000:.1f} ms")
+
+    def close(self):
+        if self.instrumentation is not None:
+            self.instrumentation.timer_listeners.remove(self.on_timer)
+            self.instrumentation = None
+        if self.file is not None:
+            self.file.close()
+
+
+def print_hot_functions(rows: List[Tuple[str, float, float]], top_n: int):
+    print(f"{'own s':>10}{'total s':>10}  function")
+    for function, own_time, total_time in rows[:top_n]:
+        print(f"{own_time:>10.2f}{total_time:>10.2f}  {function}")
+
+
+def cprofile_hot_functions(stats: pstats.Stats) -> List[Tuple[str, float, float]]:
+    rows = []
+    for key, (_, _, own_time, total_time, _) in stats.stats.items():
+        file_name, line, function = key
+        rows.append((f"{function} ({file_name}:{line})", own_time, total_time))
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+def pyinstrument_hot_functions(root_frame) -> List[Tuple[str, float, float]]:
+    own_times, total_times = defaultdict(float), defaultdict(float)
+    stack = [(root_frame, frozenset())] if root_frame is not None else []
+    while stack:
+        frame, ancestors = stack.pop()
+        if frame.is_synthetic:  # "[self]" leafs, already in total_self_time
+            continue
+        function = f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+        own_times[function] += frame.total_self_time
+        # recursive calls would otherwise be counted multiple times
+        if function not in ancestors:
+            total_times[function] += frame.time
+        stack += [(child, ancestors | {function}) for child in frame.children]
+    rows = [
+        (function, own_times[function], total_times[function]) for function in own_times
+    ]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+@contextmanager
+def profiled(out_path: str, top_n: int = 30):
+    """Profiles the block, writes the profile next to `out_path` and prints a summary."""
+    try:
+        from pyinstrument import Profiler
+        from pyinstrument.renderers import SpeedscopeRenderer
+    except ImportError:
+        Profiler = None
+
+    if Profiler is not None:
+        profiler = Profiler(async_mode="disabled")
+        profiler.start()
+        try:
+            yield
+        finally:
+            session = profiler.stop()
+            path = f"{out_path}.speedscope.json"
+            with open(path, "w") as f:
+                f.write(profiler.output(SpeedscopeRenderer()))
+            print(f"Wrote sampling profile to {path} (open with speedscope.app)")
+            print_hot_functions(pyinstrument_hot_functions(session.root_frame()), top_n)
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = f"{out_path}.pstats"
+        profiler.dump_stats(path)
+        print(f"Wrote cProfile stats to {path} (open with snakeviz or pstats)")
+        print_hot_functions(cprofile_hot_functions(pstats.Stats(profiler)), top_n)
@@ -0,0 +1,313 @@
+"""
+Offline replay of the envy calculation.
+
+A snapshot (settlements, cached helper responses and prices of a block range) is
+exported once from the database to Parquet. The replay engine then recomputes envy
+from the snapshot entirely in memory, without any node or DB connection, which makes
+parameter sweeps (e.g. over the gas cost estimate) cheap.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from logging import warning
+from typing import List, Optional, Sequence
+
+import numpy as np
+import polars as pl
+from dotenv import load_dotenv
+from fire import Fire
+from tqdm import tqdm
+
+from cow_amm_trade_envy.configs import (
+    EnvyCalculatorConfig,
+    PGConfig,
+    network_config_factory,
+)
+from cow_amm_trade_envy.datasources import BCoWHelper, DatabaseManager
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.indexes import PriceIndex
+from cow_amm_trade_envy.models import (
+    BCowPool,
+    CoWAmmOrderData,
+    pools_factory,
+    to_checksum_address,
+    tokens_factory,
+)
+
+SURPLUS_SCHEMA = {
+    "call_tx_hash": pl.Utf8,
+    "block_number": pl.Int64,
+    "trade_index": pl.Int64,
+    "pool": pl.Utf8,
+    "surplus": pl.Float64,
+    "gas_price": pl.Int64,
+}
+
+
+@dataclass
+class Snapshot:
+    settle: pl.DataFrame  # rows of the {network}_settle table
+    order_cache: pl.DataFrame  # key, response
+    prices: pl.DataFrame  # token, block_number, price
+
+    @classmethod
+    def load(cls, path: str) -> "Snapshot":
+        return cls(
+            settle=pl.read_parquet(os.path.join(path, "settle.parquet")),
+            order_cache=pl.read_parquet(os.path.join(path, "order_cache.parquet")),
+            prices=pl.read_parquet(os.path.join(path, "prices.parquet")),
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.settle.write_parquet(os.path.join(path, "settle.parquet"))
+        self.order_cache.write_parquet(os.path.join(path, "order_cache.parquet"))
+        self.prices.write_parquet(os.path.join(path, "prices.parquet"))
+
+    @classmethod
+    def from_database(
+        cls, db_manager: DatabaseManager, network: str, start_block: int, end_block: int
+    ) -> "Snapshot":
+        with db_manager.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM trade_envy.{network}_settle
+                WHERE call_block_number BETWEEN %s AND %s
+                """,
+                (start_block, end_block),
+            )
+            settle = pl.DataFrame(
+                cursor.fetchall(),
+                schema=[desc[0] for desc in cursor.description],
+                orient="row",
+                infer_schema_length=None,
+            )
+
+            # the block number is the last part of the cache key
+            cursor.execute(
+                """
+                SELECT key, response FROM trade_envy.order_cache
+                WHERE key LIKE %s
+                AND CAST(substring(key from '_([0-9]+)$') AS INTEGER) BETWEEN %s AND %s
+                """,
+                (f"{network}_%", start_block, end_block),
+            )
+            order_cache = pl.DataFrame(
+                cursor.fetchall(),
+                schema={"key": pl.Utf8, "response": pl.Utf8},
+                orient="row",
+            )
+
+        pools = pools_factory(network).get_pools()
+        tokens = {pool.TOKEN0 for pool in pools} | {pool.TOKEN1 for pool in pools}
+        tokens.add(tokens_factory(network).native)
+        prices = db_manager.get_prices(network, list(tokens), start_block, end_block)
+
+        return cls(settle=settle, order_cache=order_cache, prices=prices)
+
+
+class MissingPriceError(LookupError):
+    pass
+
+
+class MissingHelperResponseError(LookupError):
+    pass
+
+
+class SnapshotPriceIndex(PriceIndex):
+    """Prices of a snapshot. A missing rate raises instead of returning None, which
+    the calculator would only notice as a TypeError in the conversion."""
+
+    def get_token_to_native_rate(self, token_address: str, block_number: int) -> float:
+        rate = super().get_token_to_native_rate(token_address, block_number)
+        if rate is None:
+            raise MissingPriceError(
+                f"No price of {token_address} at block {block_number} in snapshot"
+            )
+        return rate
+
+
+class SnapshotHelper:
+    """Answers helper queries from the cached responses of a snapshot."""
+
+    contract_partial_cow_deployment = BCoWHelper.contract_partial_cow_deployment
+
+    def __init__(self, network: str, order_cache: pl.DataFrame):
+        self.network = network
+        network_config = network_config_factory(network)
+        self.contractaddr_full_cow = to_checksum_address(
+            network_config.contractaddr_full_cow
+        )
+        self.contractaddr_partial_cow = network_config.contractaddr_partial_cow
+        self.responses = dict(
+            zip(order_cache["key"].to_list(), order_cache["response"].to_list())
+        )
+
+    def fetch_from_cache(
+        self,
+        contract_address: str,
+        function_name: str,
+        pool: BCowPool,
+        params: dict,
+        block_num: int,
+    ) -> list:
+        cache_key = BCoWHelper.cache_key(
+            self.network, contract_address, function_name, pool, params, block_num
+        )
+        if cache_key not in self.responses:
+            raise MissingHelperResponseError(
+                f"Helper response not in snapshot: {cache_key}"
+            )
+        return json.loads(self.responses[cache_key])
+
+    def order(self, pool: BCowPool, prices: list, block_num: int) -> CoWAmmOrderData:
+        response = self.fetch_from_cache(
+            self.contractaddr_full_cow, "order", pool, {"prices": prices}, block_num
+        )
+        order, _, _, _ = response
+        return CoWAmmOrderData.from_order_response(order, self.network)
+
+    def order_from_buy_amount(
+        self, pool: BCowPool, buy_token: str, buy_amount: int, block_num: int
+    ) -> Optional[CoWAmmOrderData]:
+        if block_num <= self.contract_partial_cow_deployment:
+            return None
+
+        params = {
+            "buyAmount": buy_amount,
+            "buyToken": to_checksum_address(buy_token),
+        }
+        response = self.fetch_from_cache(
+            self.contractaddr_partial_cow,
+            "orderFromBuyAmount",
+            pool,
+            params,
+            block_num,
+        )
+        order, _, _, _ = response
+        return CoWAmmOrderData.from_order_response(order, self.network)
+
+
+class ReplayEngine:
+    def __init__(
+        self,
+        snapshot: Snapshot,
+        network: str,
+        used_pool_list: Optional[List[BCowPool]] = None,
+    ):
+        self.snapshot = snapshot
+        self.calculator = TradeEnvyCalculator(
+            EnvyCalculatorConfig(network=network),
+            used_pool_list=used_pool_list,
+            helper=SnapshotHelper(network, snapshot.order_cache),
+            data_fetcher=SnapshotPriceIndex(network, snapshot.prices),
+        )
+        self.native_decimals = tokens_factory(network).native.decimals
+        self._surplus_table: Optional[pl.DataFrame] = None
+        # settlements skipped by the replay, per missing input
+        self.skipped = {"helper_response": 0, "price": 0}
+
+    def surplus_table(self) -> pl.DataFrame:
+        """Surplus per trade, independent of the gas cost estimate. Computed once."""
+        if self._surplus_table is not None:
+            return self._surplus_table
+
+        rows = []
+        for row in tqdm(
+            self.snapshot.settle.iter_rows(named=True),
+            total=len(self.snapshot.settle),
+            desc="Replaying settlements",
+        ):
+            try:
+                surplus_list = self.calculator.calc_surplus_per_settlement(row)
+            except MissingPriceError:
+                self.skipped["price"] += 1
+                continue
+            except MissingHelperResponseError:
+                self.skipped["helper_response"] += 1
+                continue
+
+            for surplus_data in surplus_list:
+                rows.append(
+                    (
+                        row["call_tx_hash"],
+                        int(row["call_block_number"]),
+                        surplus_data["trade_index"],
+                        surplus_data["pool"],
+                        float(surplus_data["surplus"]),
+                        int(row["gas_price"]),
+                    )
+                )
+
+        if self.skipped["helper_response"]:
+            warning(
+                f"Skipped {self.skipped['helper_response']} settlements because helper responses are missing in the snapshot"
+            )
+        if self.skipped["price"]:
+            warning(
+                f"Skipped {self.skipped['price']} settlements because prices are missing in the snapshot"
+            )
+
+        self._surplus_table = pl.DataFrame(rows, schema=SURPLUS_SCHEMA, orient="row")
+        return self._surplus_table
+
+    def envy_matrix(self, gas_cost_estimates: Sequence[int]) -> np.ndarray:
+        """Envy of every trade (rows) for every gas cost estimate (columns)."""
+        df = self.surplus_table()
+        surplus = df["surplus"].to_numpy()
+        gas_price = df["gas_price"].to_numpy()
+        estimates = np.asarray(gas_cost_estimates, dtype=np.int64)
+
+        gas = gas_price[:, None] * estimates[None, :]
+        return (surplus[:, None] - gas) * 10 ** (-self.native_decimals)
+
+    def sweep(self, gas_cost_estimates: Sequence[int]) -> pl.DataFrame:
+        envy = self.envy_matrix(gas_cost_estimates)
+        positive = envy > 0
+        return pl.DataFrame(
+            {
+                "gas_cost_estimate": list(gas_cost_estimates),
+                "n_trades": [envy.shape[0]] * len(gas_cost_estimates),
+                "n_trades_with_envy": positive.sum(axis=0),
+                "total_envy": envy.sum(axis=0),
+                "total_positive_envy": np.where(positive, envy, 0.0).sum(axis=0),
+            }
+        )
+
+
+def export_snapshot(network: str, start_block: int, end_block: int, out_dir: str):
+    load_dotenv()
+    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+    db_manager = DatabaseManager(start_block, pg_config)
+    snapshot = Snapshot.from_database(db_manager, network, start_block, end_block)
+    snapshot.save(out_dir)
+    print(
+        f"Exported {len(snapshot.settle)} settlements, {len(snapshot.order_cache)} helper responses and {len(snapshot.prices)} prices to {out_dir}"
+    )
+
+
+def sweep(
+    snapshot_dir: str,
+    network: str,
+    gas_cost_estimates: list,
+    used_pool_names: list = None,
+    out_file: str = None,
+):
+    used_pool_list = None
+    if used_pool_names is not None:
+        used_pool_list = [
+            pool
+            for pool in pools_factory(network).get_pools()
+            if pool.NAME in used_pool_names
+        ]
+
+    engine = ReplayEngine(Snapshot.load(snapshot_dir), network, used_pool_list)
+    result = engine.sweep(gas_cost_estimates)
+    print(result)
+    if out_file is not None:
+        result.write_csv(out_file)
+
+
+if __name__ == "__main__":
+    Fire({"export": export_snapshot, "sweep": sweep})
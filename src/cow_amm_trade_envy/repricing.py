@@ -0,0 +1,169 @@
+"""
+Re-pricing of the stored envy in SQL, without helper calls or settlement parsing.
+
+Every envy row stores its components (surplus in token1 atoms, conversion rate to native
+atoms, gas price and gas cost estimate), so a new gas cost estimate or a fixed price
+series only needs set-based UPDATEs over the envy table:
+
+    trade_envy = (surplus_token1 * conversion_rate - gas_price * gas_cost_estimate)
+                 / 10**native decimals
+
+With `refresh_rates` the conversion rates are first recomputed from the price tables,
+like `DataFetcher.get_token_to_native_rate` does. Rows without a price at or before
+their block keep their conversion rate and are reported. Rows whose envy changes get a new
+`updated_at`, so the next incremental Dune sync uploads them. Rows calculated before
+the components were stored (NULL surplus_token1) are left untouched.
+"""
+
+import os
+from logging import warning
+from typing import Optional
+
+from dotenv import load_dotenv
+from fire import Fire
+
+from cow_amm_trade_envy.configs import PGConfig
+from cow_amm_trade_envy.datasources import DatabaseManager
+from cow_amm_trade_envy.models import pools_factory, tokens_factory
+
+
+class EnvyRepricer:
+    def __init__(self, db_manager: DatabaseManager, network: str):
+        self.db_manager = db_manager
+        self.network = network
+        self.table_name = f"{network}_envy"
+        self.native = tokens_factory(network).native
+
+    def latest_price(self, cursor, token_address: str) -> str:
+        """Subquery of the latest price at or before the block of the envy row, NULL
+        if the token has no price table."""
+        table_name = f"{self.network}_{token_address}_price"
+        cursor.execute("SELECT to_regclass(%s)", (f"trade_envy.{table_name}",))
+        if cursor.fetchone()[0] is None:
+            return "NULL::NUMERIC"
+        return f"""(
+            SELECT price FROM trade_envy.{table_name}
+            WHERE block_number <= envy.block_number
+            ORDER BY block_number DESC
+            LIMIT 1
+        )"""
+
+    def refresh_rates(self, cursor, start_block: int, end_block: int) -> int:
+        """Conversion rates from the latest prices at or before each block, one UPDATE
+        per token1 that is not the native token. Rows without prices keep their rate,
+        returns their number."""
+        pools_by_token = {}
+        for pool in pools_factory(self.network).get_pools():
+            if pool.TOKEN1 != self.native:
+                pools_by_token.setdefault(pool.TOKEN1, []).append(pool.ADDRESS)
+
+        native_price = self.latest_price(cursor, self.native.address)
+        n_skipped = 0
+        for token, pool_addresses in pools_by_token.items():
+            cursor.execute(
+                f"""
+                WITH rates AS (
+                    SELECT call_tx_hash, trade_index,
+                        {self.latest_price(cursor, token.address)}
+                            / NULLIF({native_price}, 0)
+                            * 10::NUMERIC ^ %(decimal_shift)s AS conversion_rate
+                    FROM trade_envy.{self.table_name} AS envy
+                    WHERE envy.pool = ANY(%(pools)s)
+                    AND envy.block_number BETWEEN %(start)s AND %(end)s
+                    AND envy.surplus_token1 IS NOT NULL
+                ), updated AS (
+                    UPDATE trade_envy.{self.table_name} AS envy
+                    SET conversion_rate = rates.conversion_rate
+                    FROM rates
+                    WHERE envy.call_tx_hash = rates.call_tx_hash
+                    AND envy.trade_index = rates.trade_index
+                    AND rates.conversion_rate IS NOT NULL
+                )
+                SELECT COUNT(*) FROM rates WHERE conversion_rate IS NULL
+                """,
+                {
+                    "decimal_shift": self.native.decimals - token.decimals,
+                    "pools": pool_addresses,
+                    "start": start_block,
+                    "end": end_block,
+                },
+            )
+            n_skipped += cursor.fetchone()[0]
+        return n_skipped
+
+    def reprice(
+        self,
+        start_block: int = 0,
+        end_block: int = 2**31 - 1,
+        gas_cost_estimate: Optional[int] = None,
+        refresh_rates: bool = False,
+    ) -> int:
+        """Recomputes trade_envy in the block range (inclusive), with a new gas cost
+        estimate if given. Returns the number of changed rows."""
+        with self.db_manager.connect() as conn, conn.cursor() as cursor:
+            if refresh_rates:
+                n_skipped = self.refresh_rates(cursor, start_block, end_block)
+                if n_skipped > 0:
+                    warning(
+                        f"Kept the conversion rate of {n_skipped} {self.network} envy "
+                        "rows without prices at or before their block"
+                    )
+
+            cursor.execute(
+                f"""
+                WITH repriced AS (
+                    SELECT call_tx_hash, trade_index,
+                        COALESCE(%(gas_cost_estimate)s, gas_cost_estimate)
+                            AS gas_cost_estimate,
+                        (surplus_token1 * conversion_rate - gas_price
+                            * COALESCE(%(gas_cost_estimate)s, gas_cost_estimate))
+                            / 10::NUMERIC ^ %(decimals)s AS trade_envy
+                    FROM trade_envy.{self.table_name}
+                    WHERE block_number BETWEEN %(start)s AND %(end)s
+                    AND surplus_token1 IS NOT NULL
+                )
+                UPDATE trade_envy.{self.table_name} AS envy
+                SET trade_envy = repriced.trade_envy,
+                    gas_cost_estimate = repriced.gas_cost_estimate,
+                    updated_at = now()
+                FROM repriced
+                WHERE envy.call_tx_hash = repriced.call_tx_hash
+                AND envy.trade_index = repriced.trade_index
+                AND (envy.trade_envy IS DISTINCT FROM repriced.trade_envy
+                    OR envy.gas_cost_estimate IS DISTINCT FROM repriced.gas_cost_estimate)
+                """,
+                {
+                    "gas_cost_estimate": gas_cost_estimate,
+                    "decimals": self.native.decimals,
+                    "start": start_block,
+                    "end": end_block,
+                },
+            )
+            n_rows = cursor.rowcount
+            conn.commit()
+
+        print(
+            f"Re-priced {n_rows} {self.network} envy rows "
+            f"from block {start_block} to {end_block}"
+        )
+        return n_rows
+
+
+def reprice(
+    networks: list,
+    start_block: int = 0,
+    end_block: int = 2**31 - 1,
+    gas_cost_estimate: Optional[int] = None,
+    refresh_rates: bool = False,
+):
+    load_dotenv()
+    pg_config = PGConfig(postgres_url=os.getenv("DB_URL"))
+    db_manager = DatabaseManager(start_block, pg_config)
+    for network in networks:
+        EnvyRepricer(db_manager, network).reprice(
+            start_block, end_block, gas_cost_estimate, refresh_rates
+        )
+
+
+if __name__ == "__main__":
+    Fire(reprice)
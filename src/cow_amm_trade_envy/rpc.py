@@ -0,0 +1,451 @@
+"""
+Access to the node. Kept separate from the datasources because importing web3 takes
+more than a second, so it is only imported once a node is actually used.
+
+The node URL of a network can list several endpoints, comma separated. All clients
+send their requests through one keep-alive connection pool (`shared_session`) and share
+what they observe about an endpoint (`get_endpoint`), see `PooledHTTPProvider`.
+Requests to an endpoint are paced by its `RateController`, which adapts to the 429s and
+timeouts of the provider.
+"""
+
+import threading
+import time
+from concurrent import futures
+from functools import lru_cache
+from logging import warning
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from web3._utils.batching import sort_batch_response_by_response_ids
+from web3.middleware import Web3Middleware
+from web3.providers import JSONBaseProvider
+
+from cow_amm_trade_envy.configs import ERC20_BALANCE_OF_SELECTOR
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+HEADERS = {"Content-Type": "application/json"}
+
+
+def split_node_urls(node_url: Optional[str]) -> List[str]:
+    return [url.strip() for url in (node_url or "").split(",") if url.strip()]
+
+
+@lru_cache(maxsize=None)
+def shared_session() -> requests.Session:
+    """One keep-alive connection pool for all clients and threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=64)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RPCThrottled(requests.HTTPError):
+    """The endpoint answered 429 Too Many Requests."""
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    # only the delay in seconds, HTTP dates are not used by the node providers
+    try:
+        return max(float(response.headers["Retry-After"]), 0.0)
+    except (KeyError, ValueError):
+        return None
+
+
+class RateController:
+    """Request rate (token bucket) and concurrency limits of one endpoint, adapted
+    AIMD style to what the provider accepts.
+
+    Both limits start in slow start: every successful request that found a limit
+    reached raises it by one, so it doubles per round trip. A 429 or timeout halves
+    both and ends slow start; afterwards the rate grows by about one request/s per
+    second and the concurrency by one per round trip. The limits are halved at most
+    once per `decrease_interval`, as the requests in flight at that time are likely
+    throttled as well. A 429 also pauses the endpoint for its Retry-After, or else for
+    `backoff` seconds doubled for every 429 in a row.
+
+    The current limits are published as the gauges `rpc_rate_limit` (requests/s) and
+    `rpc_concurrency_limit`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 50,
+        concurrency: float = 8,
+        min_rate: float = 1,
+        max_rate: float = 10_000,
+        max_concurrency: float = 64,
+        decrease_interval: float = 1.0,
+        backoff: float = 0.1,
+    ):
+        self.name = name
+        self.rate = rate
+        self.concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.decrease_interval = decrease_interval
+        self.backoff = backoff
+        self.throttled_in_row = 0
+        self.slow_start = True
+        # one second of requests as burst
+        self.tokens = max(1.0, rate)
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.decreased_at = float("-inf")
+        self.condition = threading.Condition()
+        self.publish()
+
+    def refill(self, now: float):
+        capacity = max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until a request of `cost` tokens may start, 0 if it may now, None
+        if it has to wait for a request in flight."""
+        if now < self.resume_at:
+            return self.resume_at - now
+        if self.in_flight >= int(self.concurrency):
+            return None
+        self.refill(now)
+        # a batch larger than the burst waits for a full bucket and goes into debt
+        needed = min(cost, max(1.0, self.rate))
+        if self.tokens < needed:
+            return (needed - self.tokens) / self.rate
+        return 0.0
+
+    def acquire(self, cost: float = 1):
+        """Blocks until the request may be sent. Every call is followed by `release`."""
+        with self.condition:
+            while True:
+                wait = self.wait_time(cost, time.monotonic())
+                if wait == 0.0:
+                    break
+                self.condition.wait(wait)
+            self.tokens -= cost
+            self.in_flight += 1
+
+    def has_capacity(self) -> bool:
+        with self.condition:
+            return self.wait_time(1, time.monotonic()) == 0.0
+
+    def release(
+        self, result: str, retry_after: Optional[float] = None, pause: bool = False
+    ):
+        """`result` is "success", "throttled" (429 or timeout) or "failed". With
+        `pause`, the endpoint is paused for `retry_after` or the backoff."""
+        with self.condition:
+            now = time.monotonic()
+            at_concurrency_limit = self.in_flight >= int(self.concurrency)
+            self.in_flight -= 1
+            if result == "success":
+                self.throttled_in_row = 0
+                self.refill(now)
+                # only grow a limit that is actually reached
+                if self.tokens < 1:
+                    self.rate += 1 if self.slow_start else 1 / self.rate
+                if at_concurrency_limit:
+                    self.concurrency += 1 if self.slow_start else 1 / self.concurrency
+            elif result == "throttled":
+                if now - self.decreased_at >= self.decrease_interval:
+                    self.decreased_at = now
+                    self.slow_start = False
+                    self.rate /= 2
+                    self.concurrency /= 2
+                self.tokens = min(self.tokens, 0.0)
+                if pause:
+                    self.throttled_in_row += 1
+                    if retry_after is None:
+                        retry_after = min(
+                            self.backoff * 2 ** (self.throttled_in_row - 1), 10.0
+                        )
+                    self.resume_at = max(self.resume_at, now + retry_after)
+            self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+            self.concurrency = min(max(self.concurrency, 1), self.max_concurrency)
+            self.condition.notify_all()
+        if result != "failed":
+            self.publish()
+
+    def publish(self):
+        instrumentation.gauge("rpc_rate_limit", self.rate, endpoint=self.name)
+        instrumentation.gauge(
+            "rpc_concurrency_limit", int(self.concurrency), endpoint=self.name
+        )
+
+
+class Endpoint:
+    """A node URL with the moving average of its latency and its failures in a row."""
+
+    def __init__(self, url: str, smoothing: float = 0.2):
+        self.url = url
+        # only the host in logs and metrics, the path often contains an API key
+        self.name = urlparse(url).hostname or "node"
+        self.smoothing = smoothing
+        self.latency = 0.0  # untried endpoints are tried first
+        self.failures = 0
+        self.unavailable_until = 0.0
+        self.lock = threading.Lock()
+        self.controller = RateController(self.name)
+
+    def score(self) -> float:
+        # expected latency of one more request, spreads concurrent requests
+        return self.latency * (1 + self.controller.in_flight)
+
+    def observe(self, seconds: float):
+        with self.lock:
+            if self.latency == 0.0:
+                self.latency = seconds
+            else:
+                self.latency += self.smoothing * (seconds - self.latency)
+            self.failures = 0
+
+    def observe_failure(self, cooldown: float):
+        """The endpoint is skipped for the cooldown, doubled for every failure in a
+        row."""
+        with self.lock:
+            self.failures += 1
+            self.unavailable_until = time.monotonic() + cooldown * 2 ** min(
+                self.failures - 1, 6
+            )
+
+
+ENDPOINTS: Dict[str, Endpoint] = {}
+ENDPOINTS_LOCK = threading.Lock()
+
+
+def get_endpoint(url: str) -> Endpoint:
+    with ENDPOINTS_LOCK:
+        if url not in ENDPOINTS:
+            ENDPOINTS[url] = Endpoint(url)
+        return ENDPOINTS[url]
+
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """JSON-RPC over HTTP to one or more endpoints of the same network.
+
+    A request goes to the available endpoint with free capacity and the lowest
+    expected latency. On connection errors, timeouts and HTTP errors the next endpoint
+    is tried, and the failed one is skipped for a while. A 429 only slows down the
+    endpoint (see `RateController`); a request throttled by all endpoints is retried up
+    to `max_throttled_retries` times. With `hedge_after`, an eth_call without response
+    after that many seconds is also sent to the next endpoint and the first response
+    is used.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        timeout: float = 60,
+        hedge_after: Optional[float] = None,
+        cooldown: float = 5,
+        max_throttled_retries: int = 5,
+    ):
+        super().__init__()
+        if not urls:
+            raise ValueError("No node URL configured")
+        self.endpoints = [get_endpoint(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.max_throttled_retries = max_throttled_retries
+        self.hedge_executor = None
+        if hedge_after is not None and len(self.endpoints) > 1:
+            self.hedge_executor = futures.ThreadPoolExecutor(
+                max_workers=32, thread_name_prefix="rpc_hedge"
+            )
+
+    def ranked_endpoints(self, endpoints: Optional[List[Endpoint]] = None):
+        endpoints = self.endpoints if endpoints is None else endpoints
+        now = time.monotonic()
+        available = [e for e in endpoints if e.unavailable_until <= now]
+        unavailable = [e for e in endpoints if e.unavailable_until > now]
+        # if all failed recently, the one that is available again first is tried first
+        return sorted(
+            available, key=lambda e: (not e.controller.has_capacity(), e.score())
+        ) + sorted(unavailable, key=lambda e: e.unavailable_until)
+
+    def post(self, endpoint: Endpoint, request_data: bytes, cost: int = 1) -> bytes:
+        controller = endpoint.controller
+        with instrumentation.timer("rpc_rate_limit_wait", endpoint=endpoint.name):
+            controller.acquire(cost)
+        # the slot is released whatever happens, also on errors other than HTTP
+        # errors (e.g. KeyboardInterrupt in a hedging thread)
+        result, pause_for, pause = "failed", None, False
+        start = time.perf_counter()
+        try:
+            with instrumentation.timer("rpc_endpoint_request", endpoint=endpoint.name):
+                response = shared_session().post(
+                    endpoint.url,
+                    data=request_data,
+                    headers=HEADERS,
+                    timeout=self.timeout,
+                )
+            if response.status_code == 429:
+                result, pause_for, pause = "throttled", retry_after(response), True
+                instrumentation.count("rpc_throttled", endpoint=endpoint.name)
+                raise RPCThrottled(
+                    f"429 Too Many Requests from {endpoint.name}", response=response
+                )
+            response.raise_for_status()
+            result = "success"
+        except RPCThrottled:
+            raise
+        except requests.Timeout:
+            result = "throttled"
+            endpoint.observe_failure(self.cooldown)
+            raise
+        except requests.RequestException:
+            endpoint.observe_failure(self.cooldown)
+            raise
+        finally:
+            controller.release(result, pause_for, pause=pause)
+        endpoint.observe(time.perf_counter() - start)
+        return response.content
+
+    def send(
+        self, request_data: bytes, endpoints: List[Endpoint], cost: int = 1
+    ) -> bytes:
+        """Response of the first of the endpoints that answers. If one of them
+        throttled the request, all are tried again once their rate allows it."""
+        for attempt in range(self.max_throttled_retries + 1):
+            throttled = False
+            for i, endpoint in enumerate(endpoints):
+                try:
+                    return self.post(endpoint, request_data, cost)
+                except requests.RequestException as e:
+                    throttled |= isinstance(e, RPCThrottled)
+                    if i == len(endpoints) - 1:
+                        if throttled and attempt < self.max_throttled_retries:
+                            break
+                        raise
+                    warning(
+                        f"RPC request to {endpoint.name} failed ({e}), "
+                        f"trying {endpoints[i + 1].name}"
+                    )
+                    instrumentation.count("rpc_failover", endpoint=endpoint.name)
+            endpoints = self.ranked_endpoints(endpoints)
+
+    def send_hedged(self, request_data: bytes) -> bytes:
+        endpoints = self.ranked_endpoints()
+        primary = self.hedge_executor.submit(self.send, request_data, endpoints)
+        try:
+            return primary.result(timeout=self.hedge_after)
+        except futures.TimeoutError:
+            pass
+
+        instrumentation.count("rpc_hedged", endpoint=endpoints[0].name)
+        # the hedge starts at the next endpoint, the slow one is still waited for
+        hedge = self.hedge_executor.submit(
+            self.send, request_data, endpoints[1:] + endpoints[:1]
+        )
+        pending = {primary, hedge}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        instrumentation.count(
+                            "rpc_hedge_won", endpoint=endpoints[1].name
+                        )
+                    return future.result()
+        # both failed
+        return primary.result()
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        if method == "eth_call" and self.hedge_executor is not None:
+            raw_response = self.send_hedged(request_data)
+        else:
+            raw_response = self.send(request_data, self.ranked_endpoints())
+        return self.decode_rpc_response(raw_response)
+
+    def make_batch_request(self, batch_requests):
+        request_data = self.encode_batch_rpc_request(batch_requests)
+        raw_response = self.send(
+            request_data, self.ranked_endpoints(), cost=len(batch_requests)
+        )
+        return sort_batch_response_by_response_ids(
+            self.decode_rpc_response(raw_response)
+        )
+
+
+class RPCTimingMiddleware(Web3Middleware):
+    """Reports the duration of every request to the node as `rpc_request` timing."""
+
+    def wrap_make_request(self, make_request):
+        def middleware(method, params):
+            with instrumentation.timer("rpc_request", method=method):
+                return make_request(method, params)
+
+        return middleware
+
+    def wrap_make_batch_request(self, make_batch_request):
+        def middleware(requests_info):
+            with instrumentation.timer("rpc_request", method="batch"):
+                return make_batch_request(requests_info)
+
+        return middleware
+
+
+class Web3Helper:
+    def __init__(self, node_url: str, hedge_after: Optional[float] = None):
+        self.w3 = Web3(
+            PooledHTTPProvider(
+                split_node_urls(node_url), timeout=60, hedge_after=hedge_after
+            )
+        )
+        self.w3.middleware_onion.add(RPCTimingMiddleware, "rpc_timing")
+        # only read calls with hex addresses are made: the validation (which requests the
+        # chain id for every eth_call, to check the chainId of transactions) and the ENS
+        # name resolution (which walks the params of every request) are not needed
+        self.w3.middleware_onion.remove("validation")
+        self.w3.middleware_onion.remove("ens_name_to_address")
+        self.block_number = None
+
+    def get_block_number(self) -> int:
+        # fetched on first use, constant for the lifetime of the object
+        if self.block_number is None:
+            self.block_number = self.w3.eth.get_block_number()
+        return self.block_number
+
+    def refresh_block_number(self) -> int:
+        self.block_number = self.w3.eth.get_block_number()
+        return self.block_number
+
+    def to_checksum_address(self, address: str) -> str:
+        return self.w3.to_checksum_address(address)
+
+    def call(self, to: str, data: str, block_num: int) -> bytes:
+        """Return data of an eth_call with raw calldata. Skips the request and result
+        formatters of `w3.eth.call`, the middlewares (timing) still apply."""
+        result = self.w3.manager.request_blocking(
+            "eth_call", [{"to": to, "data": data}, hex(block_num)]
+        )
+        return bytes.fromhex(result[2:])
+
+    def balance_of_batch(
+        self, calls: List[Tuple[str, str, int]], batch_size: int = 200
+    ) -> List[int]:
+        """ERC-20 balances for (token, owner, block) triples via batched eth_calls."""
+        balances = []
+        for i in range(0, len(calls), batch_size):
+            with self.w3.batch_requests() as batch:
+                for token, owner, block_num in calls[i : i + batch_size]:
+                    data = ERC20_BALANCE_OF_SELECTOR + owner[2:].lower().rjust(64, "0")
+                    batch.add(
+                        self.w3.eth.call(
+                            {"to": self.to_checksum_address(token), "data": data},
+                            block_num,
+                        )
+                    )
+                with instrumentation.timer("rpc_balance_batch"):
+                    responses = batch.execute()
+            balances += [int.from_bytes(response, "big") for response in responses]
+        return balances
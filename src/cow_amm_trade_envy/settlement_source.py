@@ -0,0 +1,255 @@
+"""
+Sources of the `{network}_settle` rows.
+
+The Dune source runs the settlement query, the node source reads the `settle` calls of
+GPv2Settlement from the node: the Settlement events give the transactions and the
+solver, the calldata of the transactions is decoded into the same text format as the
+Dune results. The node source is not bound to the indexing delay of Dune and costs no
+credits, but only sees direct calls to the settlement contract (no traces). The
+settlements it skips are counted and reported at the end of the run.
+"""
+
+import datetime
+import json
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from logging import warning
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import polars as pl
+
+from cow_amm_trade_envy.configs import (
+    GPV2_SETTLEMENT_ADDRESS,
+    SETTLE_ARGUMENT_TYPES,
+    SETTLE_SELECTOR,
+    SETTLEMENT_EVENT_TOPIC,
+)
+from cow_amm_trade_envy.instrumentation import instrumentation
+
+if TYPE_CHECKING:
+    from cow_amm_trade_envy.datasources import DataFetcher
+    from cow_amm_trade_envy.rpc import Web3Helper
+
+SETTLE_SCHEMA = {
+    "call_tx_hash": pl.Utf8,
+    "contract_address": pl.Utf8,
+    "call_success": pl.Boolean,
+    "call_trace_address": pl.Utf8,
+    "call_block_time": pl.Datetime,
+    "call_block_number": pl.Int64,
+    "tokens": pl.Utf8,
+    "clearing_prices": pl.Utf8,
+    "trades": pl.Utf8,
+    "interactions": pl.Utf8,
+    "gas_price": pl.Int64,
+    "solver": pl.Utf8,
+}
+TRADE_FIELDS = [
+    "sellTokenIndex",
+    "buyTokenIndex",
+    "receiver",
+    "sellAmount",
+    "buyAmount",
+    "validTo",
+    "appData",
+    "feeAmount",
+    "flags",
+    "executedAmount",
+    "signature",
+]
+
+
+def to_hex(value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    return value.lower()
+
+
+def to_json(value: dict) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def decode_settle_calldata(calldata: bytes) -> Dict[str, str]:
+    """tokens, clearing_prices, trades and interactions of a settle call, formatted
+    like the Dune results (space separated lists)."""
+    from eth_abi import decode
+
+    if to_hex(calldata[:4]) != SETTLE_SELECTOR:
+        raise ValueError(f"Not a settle call: {to_hex(calldata[:4])}")
+    tokens, clearing_prices, trades, interactions = decode(
+        SETTLE_ARGUMENT_TYPES, bytes(calldata[4:])
+    )
+
+    trades_data = []
+    for trade in trades:
+        trade_data = dict(zip(TRADE_FIELDS, trade))
+        for field in ["receiver", "appData", "signature"]:
+            trade_data[field] = to_hex(trade_data[field])
+        trades_data.append(trade_data)
+
+    interactions_data = [
+        [
+            {"target": to_hex(target), "value": value, "callData": to_hex(call_data)}
+            for target, value, call_data in stage
+        ]
+        for stage in interactions
+    ]
+
+    return {
+        "tokens": "[" + " ".join(to_hex(token) for token in tokens) + "]",
+        "clearing_prices": "["
+        + " ".join(str(price) for price in clearing_prices)
+        + "]",
+        "trades": "[" + " ".join(to_json(trade) for trade in trades_data) + "]",
+        "interactions": "["
+        + " ".join(
+            "[" + " ".join(to_json(interaction) for interaction in stage) + "]"
+            for stage in interactions_data
+        )
+        + "]",
+    }
+
+
+class SettlementSource(ABC):
+    @abstractmethod
+    def fetch(self, start_block: int, end_block: int) -> Optional[pl.DataFrame]:
+        """Settlements in the block range (inclusive), None if there are none."""
+
+    def report_skipped(self):
+        pass
+
+
+class DuneSettlementSource(SettlementSource):
+    def __init__(self, data_fetcher: "DataFetcher"):
+        self.data_fetcher = data_fetcher
+        self.config = data_fetcher.config
+
+    def fetch(self, start_block: int, end_block: int) -> Optional[pl.DataFrame]:
+        dfs = self.data_fetcher.query_dune_intervals(
+            self.config.dune_query_settle,
+            {"network": self.config.network},
+            start_block,
+            end_block,
+            self.config.interval_length_settle,
+            "settle",
+            f"Fetching settlement data from {start_block} to {end_block}",
+        )
+        return pl.concat(dfs) if dfs else None
+
+
+class NodeSettlementSource(SettlementSource):
+    def __init__(
+        self,
+        w3_helper: "Web3Helper",
+        interval_length: int = 2_000,
+        batch_size: int = 100,
+        max_workers: int = 8,
+    ):
+        self.w3_helper = w3_helper
+        self.interval_length = interval_length
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        # settlements that call settle through another contract, over all fetches
+        self.skipped_tx_hashes: List[str] = []
+
+    def report_skipped(self):
+        if self.skipped_tx_hashes:
+            print(
+                f"Skipped {len(self.skipped_tx_hashes)} settlements that call settle "
+                "through another contract (only visible in the traces, fetch them with "
+                "settlement_source='dune')"
+            )
+
+    def get_settlement_logs(self, block_range: tuple) -> List[dict]:
+        left, right = block_range
+        return self.w3_helper.w3.eth.get_logs(
+            {
+                "address": self.w3_helper.to_checksum_address(GPV2_SETTLEMENT_ADDRESS),
+                "topics": [SETTLEMENT_EVENT_TOPIC],
+                "fromBlock": left,
+                "toBlock": right,
+            }
+        )
+
+    def get_batch(self, request: Callable, items: list) -> list:
+        """Results of `request(eth, item)` for all items, in batches of batch_size."""
+        w3 = self.w3_helper.w3
+        results = []
+        for i in range(0, len(items), self.batch_size):
+            with w3.batch_requests() as batch:
+                for item in items[i : i + self.batch_size]:
+                    batch.add(request(w3.eth, item))
+                results += batch.execute()
+        return results
+
+    @instrumentation.timed("node_settlements")
+    def fetch(self, start_block: int, end_block: int) -> Optional[pl.DataFrame]:
+        splits = [
+            (left, min(left + self.interval_length - 1, end_block))
+            for left in range(start_block, end_block + 1, self.interval_length)
+        ]
+        # the log ranges are independent, fetch them concurrently
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            logs = [
+                log
+                for chunk in executor.map(self.get_settlement_logs, splits)
+                for log in chunk
+            ]
+
+        # one settle call per transaction, like the primary key of the table
+        solvers = {}
+        for log in logs:
+            solvers[to_hex(log["transactionHash"])] = (
+                "0x" + to_hex(log["topics"][1])[-40:]
+            )
+        if not solvers:
+            return None
+
+        tx_hashes = list(solvers)
+        txs = self.get_batch(
+            lambda eth, tx_hash: eth.get_transaction(tx_hash), tx_hashes
+        )
+        block_numbers = sorted({tx["blockNumber"] for tx in txs})
+        blocks = self.get_batch(
+            lambda eth, block_num: eth.get_block(block_num), block_numbers
+        )
+        timestamps = {block["number"]: block["timestamp"] for block in blocks}
+
+        rows, skipped = [], []
+        for tx_hash, tx in zip(tx_hashes, txs):
+            calldata = bytes(tx["input"])
+            if (
+                tx["to"] is None
+                or tx["to"].lower() != GPV2_SETTLEMENT_ADDRESS
+                or to_hex(calldata[:4]) != SETTLE_SELECTOR
+            ):
+                # settle called by another contract, only visible in the traces
+                skipped.append(tx_hash)
+                continue
+
+            block_time = datetime.datetime.fromtimestamp(
+                timestamps[tx["blockNumber"]], datetime.UTC
+            ).replace(tzinfo=None)
+            rows.append(
+                {
+                    "call_tx_hash": tx_hash,
+                    "contract_address": GPV2_SETTLEMENT_ADDRESS,
+                    "call_success": True,  # reverted calls emit no events
+                    "call_trace_address": "[]",
+                    "call_block_time": block_time,
+                    "call_block_number": tx["blockNumber"],
+                    **decode_settle_calldata(calldata),
+                    "gas_price": tx["gasPrice"],
+                    "solver": solvers[tx_hash],
+                }
+            )
+
+        if skipped:
+            warning(
+                f"Skipping {len(skipped)} settlements in blocks {start_block} to "
+                f"{end_block} that are not direct settle calls: {', '.join(skipped)}"
+            )
+            instrumentation.count("node_settlements_skipped", len(skipped))
+            self.skipped_tx_hashes += skipped
+
+        return pl.DataFrame(rows, schema=SETTLE_SCHEMA) if rows else None
@@ -0,0 +1,23 @@
+"""
+Tests that need Postgres run against the throwaway database in TEST_DB_URL (its
+trade_envy schema is dropped for every test) and are skipped without it.
+"""
+
+import os
+
+import psycopg2
+import pytest
+
+from cow_amm_trade_envy.configs import PGConfig
+
+
+@pytest.fixture
+def pg_config() -> PGConfig:
+    db_url = os.getenv("TEST_DB_URL")
+    if not db_url:
+        pytest.skip("TEST_DB_URL not set")
+    conn = psycopg2.connect(db_url)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("DROP SCHEMA IF EXISTS trade_envy CASCADE")
+    conn.close()
+    return PGConfig(db_url)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from cow_amm_trade_envy.datasources import DataFetcher
+
+
+def test_search_block_by_time():
+    # 12s blocks with some missed slots
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.choice([12, 12, 12, 24], 10_000)) + 1_700_000_000
+    calls = []
+
+    def get_timestamp(block_num: int) -> int:
+        calls.append(block_num)
+        return int(timestamps[block_num])
+
+    for timestamp in [timestamps[0], timestamps[5000], timestamps[5000] + 5]:
+        expected = np.searchsorted(timestamps, timestamp, side="right") - 1
+        assert (
+            DataFetcher.search_block_by_time(get_timestamp, timestamp, 0, 9999)
+            == expected
+        )
+    assert len(calls) <= 3 * 14  # log2(10_000) per search
+
+    # a known bracket needs fewer node calls
+    calls.clear()
+    timestamp = int(timestamps[5000])
+    assert (
+        DataFetcher.search_block_by_time(get_timestamp, timestamp, 4990, 5010) == 5000
+    )
+    assert len(calls) <= 5
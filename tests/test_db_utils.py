@@ -0,0 +1,98 @@
+import datetime
+import io
+
+import pandas as pd
+import polars as pl
+from psycopg2.extensions import adapt
+
+from cow_amm_trade_envy.db_utils import frame_from_csv, upsert_data
+
+
+class RecordingCursor:
+    def __init__(self, connection: "RecordingConnection"):
+        self.connection = connection
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def mogrify(self, query: bytes, args) -> bytes:
+        return query % tuple(adapt(arg).getquoted() for arg in args)
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            self.connection.queries.append(query.decode())
+            self.result = []
+        elif "information_schema.columns" in query:
+            self.result = [(column,) for column in self.connection.columns]
+        elif "PRIMARY KEY" in query:
+            self.result = [("call_tx_hash",), ("trade_index",)]
+
+    def fetchall(self):
+        return self.result
+
+
+class RecordingConnection:
+    encoding = "UTF8"
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.queries = []
+
+    def cursor(self) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def commit(self):
+        pass
+
+
+def test_upsert_data_updated_at():
+    conn = RecordingConnection(
+        ["call_tx_hash", "trade_index", "trade_envy", "updated_at"]
+    )
+    df = pd.DataFrame(
+        {"call_tx_hash": ["0x01"], "trade_index": [0], "trade_envy": [1.5]}
+    )
+    upsert_data("ethereum_envy", df, conn)
+
+    (query,) = conn.queries
+    # set by the column default on insert and by the update clause on conflict
+    assert "(call_tx_hash, trade_index, trade_envy)" in query
+    assert "trade_envy = EXCLUDED.trade_envy, updated_at = now()" in query
+
+
+def test_frame_from_csv():
+    # as written by COPY ... TO STDOUT WITH (FORMAT csv, HEADER)
+    data = io.BytesIO(
+        b"call_tx_hash,call_success,call_block_time,call_block_number,tokens,price\n"
+        b'0x01,t,2024-09-27 14:36:35,20842716,"[0xa 0xb]",1.5\n'
+        b'0x02,f,2024-09-27 14:36:35.25,20842717,"",\n'
+    )
+    schema = {
+        "call_tx_hash": pl.Utf8,
+        "call_success": pl.Boolean,
+        "call_block_time": pl.Datetime("us"),
+        "call_block_number": pl.Int64,
+        "tokens": pl.Utf8,
+        "price": pl.Float64,
+    }
+    df = frame_from_csv(data, schema)
+
+    assert df.schema == pl.Schema(schema)
+    assert df.row(0) == (
+        "0x01",
+        True,
+        datetime.datetime(2024, 9, 27, 14, 36, 35),
+        20842716,
+        "[0xa 0xb]",
+        1.5,
+    )
+    # quoted empty strings stay strings, unquoted empty fields are NULL
+    assert df["tokens"][1] == ""
+    assert df["price"][1] is None
+    assert df["call_block_time"][1] == datetime.datetime(
+        2024, 9, 27, 14, 36, 35, 250000
+    )
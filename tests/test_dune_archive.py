@@ -0,0 +1,71 @@
+import os
+
+import polars as pl
+import pytest
+import spice
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, PGConfig
+from cow_amm_trade_envy.datasources import DataFetcher
+from cow_amm_trade_envy.dune_archive import DuneArchive
+
+
+def test_dune_archive(tmp_path):
+    archive = DuneArchive(str(tmp_path))
+    params = {"start_block": 10, "end_block": 20, "network": "ethereum"}
+    assert archive.load(4761062, params) is None
+
+    df = pl.DataFrame({"call_tx_hash": ["0x01", "0x02"], "gas_price": [1, 2]})
+    archive.save(4761062, params, df)
+    # the key does not depend on the parameter order, but on the values and query
+    reordered = {"network": "ethereum", "end_block": 20, "start_block": 10}
+    assert archive.load(4761062, reordered).equals(df)
+    assert archive.load(4761062, {**params, "end_block": 21}) is None
+    assert archive.load(4761101, params) is None
+    assert os.listdir(tmp_path / "query_4761062") == [
+        f"{DuneArchive.key(4761062, params)}.parquet"
+    ]
+
+    assert archive.get_execution(4761062, params) is None
+    archive.save_execution(4761062, params, {"execution_id": "01ABC"})
+    assert archive.get_execution(4761062, reordered) == {"execution_id": "01ABC"}
+    archive.drop_execution(4761062, params)
+    assert archive.get_execution(4761062, params) is None
+
+
+@pytest.mark.parametrize("new_execution", [True, False])
+def test_query_dune_data_archives_both_results_of_spice(
+    tmp_path, monkeypatch, new_execution
+):
+    df = pl.DataFrame({"call_tx_hash": ["0x01"], "gas_price": [1]})
+    execution = {"execution_id": "01ABC"}
+    calls = []
+
+    def query(query_or_execution, **kwargs):
+        calls.append(query_or_execution)
+        if query_or_execution == execution:
+            return df
+        assert kwargs["poll"] is False
+        # spice returns cached or latest results directly, without an execution
+        return execution if new_execution else df
+
+    monkeypatch.setattr(spice, "query", query)
+    data_fetcher = DataFetcher(
+        DataFetcherConfig(
+            "ethereum",
+            0,
+            PGConfig("postgresql://u:p@localhost:1/db"),
+            dune_archive_dir=str(tmp_path),
+        )
+    )
+    params = {"start_block": 10, "end_block": 20, "network": "ethereum"}
+    assert data_fetcher.query_dune_data(4761062, params).equals(df)
+    assert calls == ([4761062, execution] if new_execution else [4761062])
+    archive = data_fetcher.dune_archive
+    assert archive.load(4761062, params).equals(df)
+    assert archive.get_execution(4761062, params) == (
+        execution if new_execution else None
+    )
+
+    # answered from the archive
+    assert data_fetcher.query_dune_data(4761062, params).equals(df)
+    assert len(calls) == (2 if new_execution else 1)
@@ -0,0 +1,54 @@
+import datetime
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, EnvyCalculatorConfig
+from cow_amm_trade_envy.datasources import DataFetcher
+from cow_amm_trade_envy.dune_sync import DuneSync
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+
+
+def insert_envy(db_manager, call_tx_hash: str, minutes_ago: int):
+    with db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO trade_envy.ethereum_envy (call_tx_hash, trade_index, updated_at)
+            VALUES (%s, 0, LOCALTIMESTAMP - make_interval(mins => %s))
+            """,
+            (call_tx_hash, minutes_ago),
+        )
+        conn.commit()
+
+
+def delta_rows(db_manager) -> list:
+    with db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT call_tx_hash FROM trade_envy.ethereum_envy_delta ORDER BY 1"
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_high_water_mark_keeps_a_safety_margin(pg_config):
+    data_fetcher = DataFetcher(DataFetcherConfig("ethereum", 0, pg_config))
+    TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        data_fetcher.config,
+        data_fetcher=data_fetcher,
+    ).create_envy_table()
+    db_manager = data_fetcher.db_manager
+    sync = DuneSync(db_manager, "ethereum")
+
+    insert_envy(db_manager, "0x01", 120)
+    insert_envy(db_manager, "0x02", 1)
+    # the recent row waits for the next sync
+    assert sync.prepare(safety_margin_minutes=10) == 1
+    assert delta_rows(db_manager) == ["0x01"]
+    sync.commit()
+    with db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT synced_until, LOCALTIMESTAMP FROM trade_envy.sync_state")
+        synced_until, now = cursor.fetchone()
+    assert now - synced_until >= datetime.timedelta(minutes=10)
+
+    # committed after the first sync by a transaction that started earlier, it would
+    # be behind a high-water mark of MAX(updated_at)
+    insert_envy(db_manager, "0x03", 5)
+    assert sync.prepare(safety_margin_minutes=0) == 2
+    assert delta_rows(db_manager) == ["0x02", "0x03"]
@@ -0,0 +1,268 @@
+"""
+Envy calculation against Postgres (TEST_DB_URL, see conftest.py). The helper
+responses and receipts are put into order_cache and receipt_cache, so no node is
+needed.
+"""
+
+import datetime
+import json
+
+import polars as pl
+import pytest
+
+from cow_amm_trade_envy.configs import (
+    DataFetcherConfig,
+    EnvyCalculatorConfig,
+    PGConfig,
+)
+from cow_amm_trade_envy.dune_sync import DuneSync
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.models import pools_factory
+
+from tests.test_replay import SETTLEMENT, make_snapshot
+
+USDC = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+DAI = "0x6b175474e89094c44da98b954eedeac495271d0f"
+USDT = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+
+
+def settlement(call_tx_hash: str, block_number: int, tokens: list) -> dict:
+    return {
+        **SETTLEMENT,
+        "call_tx_hash": call_tx_hash,
+        "call_block_number": block_number,
+        "tokens": "[" + " ".join(tokens) + "]",
+    }
+
+
+# SETTLEMENT trades USDC -> WETH on USDC-WETH
+OTHER_PAIR = settlement("0x" + "01" * 32, 20842479, [DAI, USDT, DAI, USDT])
+BEFORE_POOL = settlement("0x" + "02" * 32, 20_000_000, [USDC, WETH, USDC, WETH])
+
+
+def make_calculator(pg_config: PGConfig, pool_names: list) -> TradeEnvyCalculator:
+    pools = [
+        pool
+        for pool in pools_factory("ethereum").get_pools()
+        if pool.NAME in pool_names
+    ]
+    return TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        DataFetcherConfig("ethereum", 0, pg_config),
+        used_pool_list=pools,
+    )
+
+
+def insert_settlements(calculator: TradeEnvyCalculator, settlements: list):
+    data_fetcher = calculator.data_fetcher
+    data_fetcher.create_settlement_table()
+    with data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        for row in settlements:
+            cursor.execute(
+                """
+                INSERT INTO trade_envy.ethereum_settle (
+                    call_tx_hash, call_block_time, call_block_number, tokens,
+                    clearing_prices, trades, gas_price, solver
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    row["call_tx_hash"],
+                    datetime.datetime(2024, 9, 27, 14, 0),
+                    row["call_block_number"],
+                    row["tokens"],
+                    row["clearing_prices"],
+                    row["trades"],
+                    row["gas_price"],
+                    "0x" + "ab" * 20,
+                ),
+            )
+        # helper response of SETTLEMENT, settlements without logs
+        snapshot = make_snapshot()
+        for key, response in snapshot.order_cache.iter_rows():
+            # cached responses hold only the order, the rest is not decoded
+            order = json.loads(response)[0]
+            cursor.execute(
+                "INSERT INTO trade_envy.order_cache VALUES (%s, %s)",
+                (key, calculator.helper.serialize_order(order)),
+            )
+        for row in settlements:
+            cursor.execute(
+                "INSERT INTO trade_envy.receipt_cache VALUES (%s, %s)",
+                (f"ethereum_{row['call_tx_hash']}", "[]"),
+            )
+        conn.commit()
+
+
+def ledger_rows(calculator: TradeEnvyCalculator) -> list:
+    with calculator.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT call_tx_hash, pool FROM trade_envy.ethereum_envy_ledger ORDER BY 1, 2"
+        )
+        return cursor.fetchall()
+
+
+def envy_rows(calculator: TradeEnvyCalculator, table: str = "ethereum_envy") -> list:
+    """Rows that are not superseded."""
+    with calculator.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT call_tx_hash, trade_index, pool_name FROM trade_envy.{table}
+            WHERE NOT superseded
+            ORDER BY call_tx_hash, trade_index
+            """
+        )
+        return cursor.fetchall()
+
+
+def test_settlements_without_eligible_trades_get_dummy_rows_in_sql(pg_config, capsys):
+    calculator = make_calculator(pg_config, ["USDC-WETH"])
+    insert_settlements(calculator, [SETTLEMENT, OTHER_PAIR, BEFORE_POOL])
+
+    calculator.create_envy_data()
+    output = capsys.readouterr().out
+    assert "Skipped 2 settlements without eligible trades, 1 candidate" in output
+    # only the candidate is parsed and queried
+    assert calculator.helper.n_requests == 1
+    assert envy_rows(calculator) == sorted(
+        [
+            (OTHER_PAIR["call_tx_hash"], -1, None),
+            (BEFORE_POOL["call_tx_hash"], -1, None),
+            (SETTLEMENT["call_tx_hash"], 0, "USDC-WETH"),
+        ]
+    )
+
+    # nothing left to do, the dedup report is still printed
+    calculator.create_envy_data()
+    output = capsys.readouterr().out
+    assert "Skipped 0 settlements without eligible trades, 0 candidate" in output
+    assert "Helper queries: 1 requests" in output
+
+
+@pytest.mark.parametrize("pool_names", [["USDC-WETH"], ["USDC-WETH", "BAL-WETH"]])
+def test_eligible_settlement_filter(pg_config, pool_names):
+    calculator = make_calculator(pg_config, pool_names)
+    insert_settlements(calculator, [SETTLEMENT, OTHER_PAIR, BEFORE_POOL])
+    condition, params = calculator.data_fetcher.eligible_settlement_filter(
+        calculator.used_pool_list
+    )
+    with calculator.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT call_tx_hash FROM trade_envy.ethereum_settle WHERE {condition}",
+            params,
+        )
+        assert cursor.fetchall() == [(SETTLEMENT["call_tx_hash"],)]
+
+
+def test_adding_a_pool_calculates_only_the_missing_pairs(pg_config):
+    calculator = make_calculator(pg_config, ["WETH-UNI"])
+    insert_settlements(calculator, [SETTLEMENT, OTHER_PAIR])
+    calculator.create_envy_data()
+    assert calculator.helper.n_requests == 0
+    assert envy_rows(calculator) == sorted(
+        [
+            (OTHER_PAIR["call_tx_hash"], -1, None),
+            (SETTLEMENT["call_tx_hash"], -1, None),
+        ]
+    )
+
+    calculator = make_calculator(pg_config, ["WETH-UNI", "USDC-WETH"])
+    (usdc_weth,) = [
+        pool for pool in calculator.used_pool_list if pool.NAME == "USDC-WETH"
+    ]
+    assert calculator.get_missing_pools() == {SETTLEMENT["call_tx_hash"]: [usdc_weth]}
+    calculator.create_envy_data()
+    assert calculator.helper.n_requests == 1
+    # the envy replaces the dummy row
+    assert envy_rows(calculator) == sorted(
+        [
+            (OTHER_PAIR["call_tx_hash"], -1, None),
+            (SETTLEMENT["call_tx_hash"], 0, "USDC-WETH"),
+        ]
+    )
+    assert ledger_rows(calculator) == [(SETTLEMENT["call_tx_hash"], usdc_weth.ADDRESS)]
+    assert calculator.get_missing_pools() == {}
+
+
+def test_dummy_row_of_a_candidate_is_stored_with_nulls(pg_config):
+    calculator = make_calculator(pg_config, ["USDC-WETH"])
+    insert_settlements(calculator, [SETTLEMENT])
+    calculator.create_envy_table()
+    calculator.create_ledger_table()
+    ucp_data = pl.DataFrame(
+        {
+            "call_tx_hash": [SETTLEMENT["call_tx_hash"]],
+            "call_block_number": [SETTLEMENT["call_block_number"]],
+            "call_block_time": [datetime.datetime(2024, 9, 27, 14, 0)],
+            "solver": ["0x" + "ab" * 20],
+        }
+    )
+    # no envy on any pool
+    envy_data = calculator.build_envy_data(ucp_data, [[]])
+    calculator.upsert_envy_data(envy_data, ucp_data, {})
+    with calculator.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT trade_index, trade_envy, surplus_token1, gas_cost_estimate
+            FROM trade_envy.ethereum_envy
+            """
+        )
+        assert cursor.fetchall() == [(-1, None, None, None)]
+
+
+def test_replaced_dummy_row_is_synced_to_dune(pg_config):
+    calculator = make_calculator(pg_config, ["WETH-UNI"])
+    insert_settlements(calculator, [SETTLEMENT])
+    calculator.create_envy_data()
+    db_manager = calculator.data_fetcher.db_manager
+    sync = DuneSync(db_manager, "ethereum")
+    assert sync.prepare(safety_margin_minutes=-1) == 1
+    sync.commit()
+
+    calculator = make_calculator(pg_config, ["WETH-UNI", "USDC-WETH"])
+    calculator.create_envy_data()
+    # the dummy row is uploaded again as superseded, together with the envy
+    assert sync.prepare(safety_margin_minutes=-1) == 2
+    with db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT trade_index, superseded FROM trade_envy.ethereum_envy_delta
+            ORDER BY trade_index
+            """
+        )
+        assert cursor.fetchall() == [(-1, True), (0, False)]
+    assert envy_rows(calculator, "ethereum_envy_delta") == [
+        (SETTLEMENT["call_tx_hash"], 0, "USDC-WETH")
+    ]
+
+
+def test_ledger_is_seeded_only_with_pairs_with_envy(pg_config):
+    calculator = make_calculator(pg_config, ["USDC-WETH"])
+    insert_settlements(calculator, [SETTLEMENT, OTHER_PAIR])
+    calculator.create_envy_data()
+    with calculator.data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE trade_envy.ethereum_envy_ledger")
+        # processed before with a pool subset, the settlement has only a dummy row
+        cursor.execute(
+            """
+            INSERT INTO trade_envy.ethereum_settle (call_tx_hash, call_block_number,
+                tokens, clearing_prices, trades, gas_price, solver)
+            SELECT %s, call_block_number, tokens, clearing_prices, trades,
+                gas_price, solver
+            FROM trade_envy.ethereum_settle WHERE call_tx_hash = %s
+            """,
+            ("0x" + "03" * 32, SETTLEMENT["call_tx_hash"]),
+        )
+        cursor.execute(
+            """
+            INSERT INTO trade_envy.ethereum_envy (call_tx_hash, trade_index)
+            VALUES (%s, -1)
+            """,
+            ("0x" + "03" * 32,),
+        )
+        conn.commit()
+
+    calculator.create_ledger_table()
+    (usdc_weth,) = calculator.used_pool_list
+    assert ledger_rows(calculator) == [(SETTLEMENT["call_tx_hash"], usdc_weth.ADDRESS)]
+    assert list(calculator.get_missing_pools()) == ["0x" + "03" * 32]
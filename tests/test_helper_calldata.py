@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from eth_abi import encode
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from cow_amm_trade_envy import helper_calldata, helper_math
+from cow_amm_trade_envy.configs import (
+    BCOW_PARTIAL_COW_HELPER_ABI,
+    network_config_factory,
+)
+from cow_amm_trade_envy.datasources import BCoWHelper
+from cow_amm_trade_envy.rpc import Web3Helper
+
+POOL = "0xf08D4dEa369C456d26a3168ff0024B904F2d8b91"
+USDC = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+ORDER_OUTPUTS = [
+    "(address,address,address,uint256,uint256,uint32,bytes32,uint256,bytes32,bool,bytes32,bytes32)",
+    "(address,uint256,bytes)[]",
+    "(address,uint256,bytes)[]",
+    "bytes",
+]
+ORDER = (
+    "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48",
+    "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
+    "0x0000000000000000000000000000000000000000",
+    1_234_567,
+    3 * 10**17,
+    1_700_000_000,
+    bytes.fromhex(helper_math.HELPER_APP_DATA),
+    0,
+    bytes.fromhex(helper_math.KIND_SELL),
+    True,
+    bytes.fromhex(helper_math.BALANCE_ERC20),
+    bytes.fromhex(helper_math.BALANCE_ERC20),
+)
+# the helper answers with commit interactions and an EIP-1271 signature
+RESPONSE = encode(
+    ORDER_OUTPUTS,
+    [ORDER, [(POOL, 0, b"\x01" * 100)], [], b"\x02" * 400],
+)
+
+
+class StaticNode(BaseProvider):
+    """Answers every eth_call with RESPONSE and records the requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def make_request(self, method, params):
+        self.requests.append((method, params))
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 0, "result": "0x1"}
+        return {"jsonrpc": "2.0", "id": 0, "result": "0x" + RESPONSE.hex()}
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+def test_calldata_matches_web3():
+    contract = Web3().eth.contract(
+        address=network_config_factory("ethereum").contractaddr_partial_cow,
+        abi=BCOW_PARTIAL_COW_HELPER_ABI,
+    )
+    prices = [10**25, 33347683 * 10**9]
+    assert helper_calldata.encode_call(
+        "order", POOL, {"prices": prices}
+    ) == contract.encode_abi("order", [POOL, prices])
+    assert helper_calldata.encode_call(
+        "orderFromBuyAmount", POOL, {"buyAmount": 10**18, "buyToken": USDC}
+    ) == contract.encode_abi("orderFromBuyAmount", [POOL, USDC, 10**18])
+    with pytest.raises(ValueError):
+        helper_calldata.encode_order(POOL, [-1, 1])
+
+
+def test_decode_order_matches_web3():
+    w3 = Web3(StaticNode())
+    contract = w3.eth.contract(
+        address=network_config_factory("ethereum").contractaddr_partial_cow,
+        abi=BCOW_PARTIAL_COW_HELPER_ABI,
+    )
+    response = contract.functions.order(POOL, [1, 2]).call(block_identifier=1)
+    order, _, _, _ = BCoWHelper.json_serializer(response)
+
+    decoded = helper_calldata.decode_order(RESPONSE)
+    # only the addresses are not checksummed
+    assert decoded == [
+        field.lower() if i < 3 else field for i, field in enumerate(order)
+    ]
+
+
+def test_raw_call_and_cache_codec():
+    w3_helper = Web3Helper("http://localhost:1")
+    node = StaticNode()
+    w3_helper.w3.provider = node
+    calldata = helper_calldata.encode_order(POOL, [1, 2])
+    data = w3_helper.call(POOL, calldata, 21_000_000)
+    assert data == RESPONSE
+    # a single request, no chain id lookups
+    assert node.requests == [
+        ("eth_call", [{"to": POOL, "data": calldata}, hex(21_000_000)])
+    ]
+
+    order = helper_calldata.decode_order(data)
+    assert BCoWHelper.deserialize_order(BCoWHelper.serialize_order(order)) == order
+    # full responses cached by the web3 contract calls
+    full_response = json.dumps([order, [[POOL, 0, "01"]], [], "02"])
+    assert BCoWHelper.deserialize_order(full_response) == order
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from cow_amm_trade_envy import helper_math
+
+
+def test_tradeable_order_small_numbers():
+    """
+    Reserves 1000/1000 and token0 is worth 2 token1 (prices [2, 1]).
+    The pool sells token0: 1000 / 2 - ceil(1000 * 1 / (2 * 2)) = 250
+    and wants ceil(250 * 1000 / 750) = 334 token1 for it.
+    calcOutGivenIn(1000, 1000, 334) = 1000 * (1 - 1000 / 1334) = 250.37 -> 250
+    """
+    assert helper_math.tradeable_order(1000, 1000, 2, 1) == (True, 250, 334)
+    # same situation mirrored
+    assert helper_math.tradeable_order(1000, 1000, 1, 2) == (False, 250, 334)
+
+
+def test_tradeable_order_no_order_at_pool_price():
+    with pytest.raises(ValueError):
+        helper_math.tradeable_order(1000, 1000, 1, 1)
+
+
+def test_order_keeps_constant_product():
+    reserve0, reserve1 = 1_234_567_890_123, 400 * 10**18  # USDC, WETH
+    sell_token0, sell_amount, buy_amount = helper_math.tradeable_order(
+        reserve0, reserve1, 10**25, 33347683 * 10**9
+    )
+    assert not sell_token0
+    assert (reserve1 - sell_amount) * (reserve0 + buy_amount) >= reserve0 * reserve1
+
+
+def test_batch_equals_scalar():
+    rng = np.random.default_rng(0)
+    reserves0 = [int(x) * 10**12 for x in rng.integers(10**6, 10**9, 50)]
+    reserves1 = [int(x) * 10**18 for x in rng.integers(10**3, 10**6, 50)]
+    prices0 = [int(x) * 10**30 for x in rng.integers(10**3, 10**6, 50)]
+    prices1 = [int(x) * 10**24 for x in rng.integers(10**3, 10**6, 50)]
+
+    batch = helper_math.tradeable_order(
+        np.array(reserves0, dtype=object),
+        np.array(reserves1, dtype=object),
+        np.array(prices0, dtype=object),
+        np.array(prices1, dtype=object),
+    )
+    for i in range(50):
+        scalar = helper_math.tradeable_order(
+            reserves0[i], reserves1[i], prices0[i], prices1[i]
+        )
+        assert scalar == (bool(batch[0][i]), batch[1][i], batch[2][i])
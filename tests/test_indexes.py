@@ -0,0 +1,48 @@
+import polars as pl
+
+from cow_amm_trade_envy.indexes import PoolReserveIndex, PriceIndex
+
+USDC = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+USDC_WETH = "0xf08d4dea369c456d26a3168ff0024b904f2d8b91"
+
+
+def test_price_index_update():
+    prices = pl.DataFrame(
+        {
+            "token": [USDC, USDC, WETH],
+            "block_number": [10, 20, 5],
+            "price": [1.0, 2.0, 4.0],
+        }
+    )
+    index = PriceIndex("ethereum", prices)
+    # a newer window, starting with the last price before it
+    index.update(
+        pl.DataFrame(
+            {"token": [USDC, USDC], "block_number": [20, 30], "price": [2.0, 8.0]}
+        )
+    )
+    assert index.get_token_to_native_rate(USDC, 15) == 0.25
+    assert index.get_token_to_native_rate(USDC, 25) == 0.5
+    assert index.get_token_to_native_rate(USDC, 35) == 2.0
+    assert list(index.series[USDC][0]) == [10, 20, 30]
+
+
+def test_pool_reserve_index():
+    reserves = pl.DataFrame(
+        [(USDC_WETH, 20, 10**30, 2), (USDC_WETH, 10, 7, 8)],
+        schema={
+            "pool": pl.Utf8,
+            "block_number": pl.Int64,
+            "reserve0": pl.Object,
+            "reserve1": pl.Object,
+        },
+        orient="row",
+    )
+    index = PoolReserveIndex(reserves)
+    assert index.get(USDC_WETH, 20) == (10**30, 2)
+    assert index.get(USDC_WETH, 10) == (7, 8)
+    # only exact blocks, the reserves can change between stored blocks
+    assert index.get(USDC_WETH, 15) is None
+    assert index.get(USDC_WETH, 21) is None
+    assert index.get(USDC, 10) is None
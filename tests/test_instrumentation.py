@@ -0,0 +1,143 @@
+import json
+import urllib.request
+
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from cow_amm_trade_envy.rpc import RPCTimingMiddleware
+from cow_amm_trade_envy.db_utils import sql_labels
+from cow_amm_trade_envy.instrumentation import Instrumentation, instrumentation
+from cow_amm_trade_envy.metrics_exporter import PrometheusExporter
+from cow_amm_trade_envy.profiling import IOTracer
+
+
+def test_timer_counters_and_report(tmp_path):
+    instrumentation = Instrumentation()
+
+    @instrumentation.timed("stage_a")
+    def work(x):
+        return x * 2
+
+    assert [work(i) for i in range(10)] == [i * 2 for i in range(10)]
+    with instrumentation.timer("stage_b"):
+        pass
+    instrumentation.count("order_cache.hit", 3)
+    instrumentation.count("order_cache.miss")
+
+    summary = {row["stage"]: row for row in instrumentation.summary()}
+    assert summary["stage_a"]["calls"] == 10
+    assert summary["stage_b"]["calls"] == 1
+    assert summary["stage_a"]["p50_ms"] <= summary["stage_a"]["p99_ms"]
+    assert instrumentation.cache_hit_rates() == {"order_cache": 0.75}
+
+    report_file = tmp_path / "report.json"
+    instrumentation.report(str(report_file))
+    report = json.loads(report_file.read_text())
+    assert report["counters"] == {"order_cache.hit": 3, "order_cache.miss": 1}
+    assert len(report["stages"]) == 2
+
+
+def test_durations_are_sampled():
+    instrumentation = Instrumentation(max_samples=100)
+    for i in range(1000):
+        instrumentation.record("stage", i / 1000)
+
+    assert len(instrumentation.durations["stage"]) == 100
+    (row,) = instrumentation.summary()
+    assert row["calls"] == 1000
+    assert row["total_s"] == sum(i / 1000 for i in range(1000))
+    # a uniform sample, not the first or last 100 durations
+    assert 300 < row["p50_ms"] < 700
+
+
+def test_prometheus_exporter(tmp_path):
+    instrumentation = Instrumentation()
+    exporter = PrometheusExporter("ethereum")
+    exporter.attach(instrumentation)
+
+    with instrumentation.timer("rpc_helper_call", pool="USDC-WETH"):
+        pass
+    instrumentation.count("order_cache.hit", 3, pool="USDC-WETH")
+    instrumentation.count("order_cache.miss", 1, pool="USDC-WETH")
+    instrumentation.count("rows_upserted.ethereum_envy", 10)
+    instrumentation.gauge("rpc_rate_limit", 12.5, endpoint="node.example")
+
+    text = exporter.render()
+    assert (
+        'trade_envy_rpc_helper_call_seconds_count{network="ethereum",pool="USDC-WETH"} 1'
+        in text
+    )
+    assert (
+        'trade_envy_rows_upserted_total{network="ethereum",table="ethereum_envy"} 10'
+        in text
+    )
+    assert (
+        'trade_envy_cache_hit_ratio{cache="order_cache",network="ethereum",pool="USDC-WETH"} 0.75'
+        in text
+    )
+
+    assert (
+        'trade_envy_rpc_rate_limit{endpoint="node.example",network="ethereum"} 12.5'
+        in text
+    )
+    assert instrumentation.gauges == {"rpc_rate_limit[node.example]": 12.5}
+
+    textfile = tmp_path / "trade_envy.prom"
+    exporter.write_textfile(str(textfile))
+    assert textfile.read_text() == text
+
+    server = exporter.serve(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode() == exporter.render()
+    finally:
+        server.shutdown()
+
+
+def test_io_tracer(tmp_path):
+    instrumentation = Instrumentation()
+    path = tmp_path / "io.jsonl"
+    tracer = IOTracer(str(path))
+    tracer.attach(instrumentation)
+
+    query = "SELECT * FROM trade_envy.ethereum_settle WHERE call_block_number > 1"
+    with instrumentation.timer("sql", **sql_labels(query)):
+        pass
+    with instrumentation.timer("rpc_request", method="eth_call"):
+        pass
+    with instrumentation.timer("calc_envy_per_settlement"):  # not an external call
+        pass
+    tracer.close()
+    assert instrumentation.timer_listeners == []
+    with instrumentation.timer("sql", **sql_labels(query)):  # after close
+        pass
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["stage"] for record in records] == ["sql", "rpc_request"]
+    assert records[0]["statement"] == "SELECT"
+    assert records[0]["table"] == "ethereum_settle"
+    assert records[1]["method"] == "eth_call"
+    assert sql_labels(b"INSERT INTO trade_envy.order_cache (key) VALUES ('a')") == {
+        "statement": "INSERT",
+        "table": "order_cache",
+    }
+
+
+class FakeProvider(BaseProvider):
+    def make_request(self, method, params):
+        return {"jsonrpc": "2.0", "id": 1, "result": "0x10"}
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+def test_rpc_timing_middleware():
+    w3 = Web3(FakeProvider())
+    w3.middleware_onion.add(RPCTimingMiddleware, "rpc_timing")
+    instrumentation.reset()
+    try:
+        assert w3.eth.block_number == 16
+        assert len(instrumentation.durations["rpc_request"]) == 1
+    finally:
+        instrumentation.reset()
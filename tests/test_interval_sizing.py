@@ -0,0 +1,67 @@
+import polars as pl
+import pytest
+from tenacity import Future, RetryError
+
+from cow_amm_trade_envy.interval_sizing import AdaptiveSplitter, is_size_error
+
+
+def make_query(rows_per_block: int, max_rows: int, calls: list):
+    """Fake Dune query that times out when the result would exceed max_rows."""
+
+    def query(left: int, right: int) -> pl.DataFrame:
+        calls.append((left, right))
+        n_rows = (right - left + 1) * rows_per_block
+        if n_rows > max_rows:
+            raise TimeoutError("query timed out")
+        return pl.DataFrame({"block_number": list(range(n_rows))})
+
+    return query
+
+
+def test_adaptive_splitter_learns_density():
+    calls = []
+    splitter = AdaptiveSplitter("settle", default_length=100, target_rows=1_000)
+    dfs = splitter.fetch(0, 9_999, make_query(2, 10_000, calls))
+
+    assert sum(len(df) for df in dfs) == 20_000
+    # covers the range without gaps or overlaps
+    assert calls[0] == (0, 99)
+    assert all(calls[i][1] + 1 == calls[i + 1][0] for i in range(len(calls) - 1))
+    # the intervals grow towards target_rows / rows_per_block
+    assert calls[-2][1] - calls[-2][0] + 1 == 500
+    assert splitter.rows_per_block == 2
+
+
+def test_adaptive_splitter_splits_failed_intervals():
+    calls = []
+    splitter = AdaptiveSplitter(
+        "settle", default_length=1_000, target_rows=1_000, rows_per_block=0.1
+    )
+    dfs = splitter.fetch(0, 999, make_query(10, 2_000, calls))
+
+    assert sum(len(df) for df in dfs) == 10_000
+    # 1000 blocks fail, 500 and 250 blocks too, 125 blocks succeed
+    assert calls[:4] == [(0, 999), (0, 499), (0, 249), (0, 124)]
+    assert splitter.next_length() < 200
+
+    with pytest.raises(TimeoutError):
+        AdaptiveSplitter("settle", 10, 1_000).fetch(0, 9, make_query(10, 5, []))
+
+
+def test_only_size_errors_are_split():
+    calls = []
+
+    def query(left: int, right: int) -> pl.DataFrame:
+        calls.append((left, right))
+        raise ValueError("invalid parameter start_block")
+
+    with pytest.raises(ValueError):
+        AdaptiveSplitter("settle", 1_000, 1_000).fetch(0, 999, query)
+    assert calls == [(0, 999)]
+
+    # failed Dune execution, after the retries of execute_dune_query
+    attempt = Future(5)
+    attempt.set_exception(Exception("QUERY FAILED execution_id=01J"))
+    assert is_size_error(RetryError(attempt))
+    assert is_size_error(Exception("Result too large"))
+    assert not is_size_error(Exception("invalid API Key"))
@@ -0,0 +1,162 @@
+import datetime
+import os
+
+import polars as pl
+import psycopg2
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, EnvyCalculatorConfig
+from cow_amm_trade_envy.datasources import DatabaseManager, DataFetcher
+from cow_amm_trade_envy.db_utils import read_frame
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.parquet_io import (
+    ParquetExporter,
+    PartitionWriter,
+    import_table,
+    load_table,
+)
+
+WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+# more digits than float64 and Decimal128 hold
+ENVY = "123456789012345678901234567890.123456789012345678901"
+PRICE = "0.000000000000000000000123456789123456789"
+
+
+def test_partition_writer(tmp_path):
+    schema = {"call_tx_hash": pl.Utf8, "block_number": pl.Int64, "prices": pl.Utf8}
+    writer = PartitionWriter(str(tmp_path), "ethereum", "settle", "block_number", 100)
+    # chunks as fetched from the cursor, ordered by block
+    writer.write(
+        pl.DataFrame(
+            [("0x01", 150, "[18446744073709551616 1]"), ("0x02", 199, None)],
+            schema=schema,
+            orient="row",
+        )
+    )
+    writer.write(
+        pl.DataFrame(
+            [("0x03", 199, "[2]"), ("0x04", 250, "[3]")], schema=schema, orient="row"
+        )
+    )
+    writer.close()
+
+    assert sorted(os.listdir(tmp_path / "ethereum" / "settle")) == [
+        "000000100_000000199.parquet",
+        "000000200_000000299.parquet",
+    ]
+    df = load_table(str(tmp_path), "ethereum", "settle").collect()
+    assert df.schema == pl.Schema(schema)
+    assert df["call_tx_hash"].to_list() == ["0x01", "0x02", "0x03", "0x04"]
+    assert df["prices"][0] == "[18446744073709551616 1]"
+    assert df["prices"][1] is None
+
+
+def test_read_frame_types(pg_config):
+    with DatabaseManager(0, pg_config).connect() as conn:
+        df = read_frame(
+            conn,
+            f"""
+            SELECT 1::INTEGER AS i, 2::BIGINT AS b, 0.5::DOUBLE PRECISION AS f,
+            TRUE AS flag, '2024-09-27 14:36:35'::TIMESTAMP AS t,
+            '{ENVY}'::NUMERIC AS n, NULL::NUMERIC AS null_n, 'x' AS text
+            """,
+        )
+    assert df.schema == pl.Schema(
+        {
+            "i": pl.Int64,
+            "b": pl.Int64,
+            "f": pl.Float64,
+            "flag": pl.Boolean,
+            "t": pl.Datetime("us"),
+            "n": pl.Utf8,
+            "null_n": pl.Utf8,
+            "text": pl.Utf8,
+        }
+    )
+    assert df.row(0) == (
+        1,
+        2,
+        0.5,
+        True,
+        datetime.datetime(2024, 9, 27, 14, 36, 35),
+        ENVY,
+        None,
+        "x",
+    )
+
+
+def table_rows(pg_config, table_name: str, exclude: tuple = ()) -> list:
+    with DatabaseManager(0, pg_config).connect() as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM trade_envy.{table_name} ORDER BY 1, 2")
+        names = [column.name for column in cursor.description]
+        return [
+            tuple(value for name, value in zip(names, row) if name not in exclude)
+            for row in cursor.fetchall()
+        ]
+
+
+def test_export_import_round_trip(pg_config, tmp_path):
+    data_fetcher = DataFetcher(DataFetcherConfig("ethereum", 0, pg_config))
+    TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        data_fetcher.config,
+        data_fetcher=data_fetcher,
+    ).create_envy_table()
+    data_fetcher.create_price_table(WETH)
+    time = datetime.datetime(2024, 9, 27, 14, 36, 35)
+    with data_fetcher.db_manager.connect() as conn, conn.cursor() as cursor:
+        for tx_hash, block_number, trade_index, envy in [
+            ("0x01", 150, 0, ENVY),
+            ("0x01", 150, 1, "-1.5"),
+            ("0x02", 199, -1, None),
+            ("0x03", 250, 0, "0"),
+        ]:
+            cursor.execute(
+                """
+                INSERT INTO trade_envy.ethereum_envy (
+                    call_tx_hash, block_number, block_time, trade_index, pool_name,
+                    trade_envy, pool_used_already
+                ) VALUES (%s, %s, %s, %s, 'USDC-WETH', %s, NULL)
+                """,
+                (tx_hash, block_number, time, trade_index, envy),
+            )
+        cursor.execute(
+            f"INSERT INTO trade_envy.ethereum_{WETH}_price VALUES (150, %s), (250, 1)",
+            (PRICE,),
+        )
+        conn.commit()
+    envy_before = table_rows(pg_config, "ethereum_envy", exclude=("updated_at",))
+    price_before = table_rows(pg_config, f"ethereum_{WETH}_price")
+
+    exporter = ParquetExporter(
+        DatabaseManager(0, pg_config), "ethereum", str(tmp_path), 100
+    )
+    # starts within the first partition, which is still exported whole
+    assert exporter.export_table("envy", 160, 260) == 4
+    assert exporter.export_table("price", 0, 2**31 - 1) == 2
+    assert sorted(os.listdir(tmp_path / "ethereum" / "envy")) == [
+        "000000100_000000199.parquet",
+        "000000200_000000299.parquet",
+    ]
+    envy = load_table(str(tmp_path), "ethereum", "envy").collect()
+    assert envy.schema["trade_envy"] == pl.Utf8
+    assert envy["trade_envy"].to_list() == [ENVY, "-1.5", None, "0"]
+    price = load_table(str(tmp_path), "ethereum", "price").collect()
+    assert price.rows() == [(WETH, 150, PRICE), (WETH, 250, "1")]
+
+    conn = psycopg2.connect(pg_config.postgres_url)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("DROP SCHEMA trade_envy CASCADE")
+        cursor.execute("SELECT LOCALTIMESTAMP")
+        imported_at = cursor.fetchone()[0]
+    conn.close()
+    data_fetcher = DataFetcher(DataFetcherConfig("ethereum", 0, pg_config))
+    assert import_table(data_fetcher, str(tmp_path), "envy") == 4
+    assert import_table(data_fetcher, str(tmp_path), "price") == 2
+    assert (
+        table_rows(pg_config, "ethereum_envy", exclude=("updated_at",)) == envy_before
+    )
+    # the imported rows are new to the incremental Dune sync
+    with DatabaseManager(0, pg_config).connect() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT MIN(updated_at) FROM trade_envy.ethereum_envy")
+        assert cursor.fetchone()[0] >= imported_at
+    assert table_rows(pg_config, f"ethereum_{WETH}_price") == price_before
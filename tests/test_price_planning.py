@@ -0,0 +1,18 @@
+from cow_amm_trade_envy.datasources import DataFetcher
+
+
+def test_plan_price_windows():
+    blocks = [100, 150, 160, 400, 401, 1000]
+    assert DataFetcher.plan_price_windows(blocks, 100, 10_000) == [
+        (100, 160),
+        (400, 401),
+        (1000, 1000),
+    ]
+    # windows are capped at max_length blocks
+    assert DataFetcher.plan_price_windows(blocks, 1000, 100) == [
+        (100, 160),
+        (400, 401),
+        (1000, 1000),
+    ]
+    assert DataFetcher.plan_price_windows(blocks, 1000, 10_000) == [(100, 1000)]
+    assert DataFetcher.plan_price_windows([], 100, 10_000) == []
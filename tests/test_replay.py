@@ -0,0 +1,256 @@
+"""
+The replay engine works without node or DB, so these tests use a hand-built snapshot
+with a made-up helper response.
+"""
+
+import datetime
+import json
+
+import pandas as pd
+import polars as pl
+import pytest
+
+from cow_amm_trade_envy.configs import EnvyCalculatorConfig
+from cow_amm_trade_envy.datasources import BCoWHelper
+from cow_amm_trade_envy.envy_calculation import ENVY_COLUMNS, TradeEnvyCalculator
+from cow_amm_trade_envy.indexes import PriceIndex
+from cow_amm_trade_envy.models import pools_factory
+from cow_amm_trade_envy.replay import ReplayEngine, Snapshot, SnapshotHelper
+
+USDC = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+WETH = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+
+# settlement of test_calc_envy3_noduneprices (USDC -> WETH on USDC-WETH)
+SETTLEMENT = {
+    "call_tx_hash": "0xb63483e4eb331b1475a80c594d83524a316dc17fa0c1125c4505ce128a369a26",
+    "call_block_number": 20842479,
+    "gas_price": 24742315967,
+    "tokens": "[0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48 0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2 0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48 0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2]",
+    "clearing_prices": "[3735232874593773216 9964452107 3735232874593773216 10000000000]",
+    "trades": '[{"sellTokenIndex":2,"buyTokenIndex":3,"receiver":"0xa0b23e0f09b70828574eb5c0e9ab4d95d929df47","sellAmount":10000000000,"buyAmount":3734607607620223402,"validTo":1727448113,"appData":"0x49ef2624996389aa2969212e43f6700e25469d78c9af4e6d715fd717b4fa5e00","feeAmount":0,"flags":0,"executedAmount":10000000000,"signature":"0x"}]',
+}
+HELPER_SELL_AMOUNT = 3760000000000000000  # WETH the CoW AMM would sell
+HELPER_BUY_AMOUNT = 10000000000  # USDC the CoW AMM would buy
+
+
+def make_snapshot() -> Snapshot:
+    pool = pools_factory("ethereum").get_pools()[0]  # USDC-WETH
+    order = [WETH, USDC, "0x" + "0" * 40, HELPER_SELL_AMOUNT, HELPER_BUY_AMOUNT]
+    order += [0, "00", 0, "00", True, ""]
+    key = BCoWHelper.cache_key(
+        "ethereum",
+        "0x3FF0041A614A9E6Bf392cbB961C97DA214E9CB31",
+        "order",
+        pool,
+        {"prices": [3735232874593773216, 9964452107]},
+        SETTLEMENT["call_block_number"],
+    )
+    return Snapshot(
+        settle=pl.DataFrame([SETTLEMENT]),
+        order_cache=pl.DataFrame(
+            {"key": [key], "response": [json.dumps([order, [], [], ""])]}
+        ),
+        prices=pl.DataFrame(
+            {"token": [], "block_number": [], "price": []},
+            schema={"token": pl.Utf8, "block_number": pl.Int64, "price": pl.Float64},
+        ),
+    )
+
+
+def test_replay_matches_calculator():
+    snapshot = make_snapshot()
+    calculator = TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        helper=SnapshotHelper("ethereum", snapshot.order_cache),
+        data_fetcher=PriceIndex("ethereum", snapshot.prices),
+    )
+    expected = calculator.calc_envy_per_settlement(SETTLEMENT)
+
+    executed_buy_amount = 10000000000 * 3735232874593773216 / 9964452107
+    surplus = HELPER_SELL_AMOUNT - executed_buy_amount
+    assert expected == [
+        {
+            "trade_envy": (surplus - 24742315967 * 100_000) * 1e-18,
+            "pool": "0xf08d4dea369c456d26a3168ff0024b904f2d8b91",
+            "trade_index": 0,
+            "surplus_token1": surplus,
+            "conversion_rate": 1.0,
+            "gas_price": 24742315967,
+            "gas_cost_estimate": 100_000,
+        }
+    ]
+
+    engine = ReplayEngine(snapshot, "ethereum")
+    envy = engine.envy_matrix([0, 100_000])
+    assert envy.shape == (1, 2)
+    assert envy[0, 1] == expected[0]["trade_envy"]
+    assert envy[0, 0] == surplus * 1e-18
+
+    result = engine.sweep([0, 100_000, 10**9])
+    assert result["n_trades_with_envy"].to_list() == [1, 1, 0]
+
+
+def test_price_index():
+    prices = pl.DataFrame(
+        {
+            "token": [USDC.lower(), USDC.lower(), WETH.lower()],
+            "block_number": [10, 20, 5],
+            "price": [1.0, 2.0, 4.0],
+        }
+    )
+    index = PriceIndex("ethereum", prices)
+    assert index.get_token_to_native_rate(USDC.lower(), 9) is None
+    assert index.get_token_to_native_rate(USDC.lower(), 15) == 0.25
+    assert index.get_token_to_native_rate(USDC.lower(), 20) == 0.5
+
+
+def test_envy_restricted_to_pools():
+    snapshot = make_snapshot()
+    calculator = TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        helper=SnapshotHelper("ethereum", snapshot.order_cache),
+        data_fetcher=PriceIndex("ethereum", snapshot.prices),
+    )
+    other_pools = [
+        pool
+        for pool in calculator.network_pools.get_pools()
+        if pool.ADDRESS != "0xf08d4dea369c456d26a3168ff0024b904f2d8b91"
+    ]
+    assert calculator.calc_envy_per_settlement(SETTLEMENT, other_pools) == []
+    assert len(calculator.calc_envy_per_settlement(SETTLEMENT)) == 1
+
+
+def test_missing_price_is_skipped():
+    # WETH -> UNI on WETH-UNI, the surplus in UNI needs the UNI price
+    uni = "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984"
+    weth = WETH.lower()
+    settlement = {
+        **SETTLEMENT,
+        "call_tx_hash": "0x" + "11" * 32,
+        "call_block_number": 21200000,
+        "tokens": f"[{weth} {uni} {weth} {uni}]",
+        "clearing_prices": "[1000000000 3000000 1000000000 3000000]",
+        "trades": '[{"sellTokenIndex":2,"buyTokenIndex":3,"receiver":"0xa0b23e0f09b70828574eb5c0e9ab4d95d929df47","sellAmount":1000000000000000000,"buyAmount":330000000000000000000,"validTo":1727448113,"appData":"0x49ef2624996389aa2969212e43f6700e25469d78c9af4e6d715fd717b4fa5e00","feeAmount":0,"flags":0,"executedAmount":1000000000000000000,"signature":"0x"}]',
+    }
+    pool = [p for p in pools_factory("ethereum").get_pools() if p.NAME == "WETH-UNI"][0]
+    order = [uni, weth, "0x" + "0" * 40, 340 * 10**18, 10**18]
+    order += [0, "00", 0, "00", True, ""]
+    key = BCoWHelper.cache_key(
+        "ethereum",
+        "0x3FF0041A614A9E6Bf392cbB961C97DA214E9CB31",
+        "order",
+        pool,
+        {"prices": [1000000000, 3000000]},
+        settlement["call_block_number"],
+    )
+    snapshot = make_snapshot()
+    snapshot.settle = pl.DataFrame([SETTLEMENT, settlement])
+    snapshot.order_cache = pl.concat(
+        [
+            snapshot.order_cache,
+            pl.DataFrame({"key": [key], "response": [json.dumps([order, [], [], ""])]}),
+        ]
+    )
+
+    engine = ReplayEngine(snapshot, "ethereum")
+    surplus = engine.surplus_table()
+    assert surplus["call_tx_hash"].to_list() == [SETTLEMENT["call_tx_hash"]]
+    assert engine.skipped == {"helper_response": 0, "price": 1}
+
+    # with the prices of UNI and WETH, the settlement is replayed
+    snapshot.prices = pl.DataFrame(
+        {"token": [uni, weth], "block_number": [1, 1], "price": [10.0, 3000.0]}
+    )
+    engine = ReplayEngine(snapshot, "ethereum")
+    assert len(engine.surplus_table()) == 2
+    assert engine.skipped == {"helper_response": 0, "price": 0}
+
+
+def test_missing_helper_response_is_skipped_other_errors_fail():
+    snapshot = make_snapshot()
+    snapshot.order_cache = snapshot.order_cache.clear()
+    engine = ReplayEngine(snapshot, "ethereum")
+    assert len(engine.surplus_table()) == 0
+    assert engine.skipped == {"helper_response": 1, "price": 0}
+
+    # a broken snapshot fails the sweep instead of being counted as skipped
+    snapshot = make_snapshot()
+    snapshot.settle = snapshot.settle.drop("clearing_prices")
+    with pytest.raises(KeyError):
+        ReplayEngine(snapshot, "ethereum").surplus_table()
+
+
+USDC_WETH = "0xf08d4dea369c456d26a3168ff0024b904f2d8b91"
+BAL_WETH = "0xf8f5b88328dff3d19e5f4f11a9700293ac8f638f"
+
+
+class LogsHelper(SnapshotHelper):
+    """Settlement 0x01 emits a log with the USDC-WETH pool in a topic."""
+
+    def get_logs_batch(self, tx_hashes: list) -> list:
+        logs = {
+            "0x01": [{"topics": ["0x" + "0" * 24 + USDC_WETH[2:]]}, {"topics": ["0x"]}],
+            "0x03": [{"topics": ["0x"]}],
+        }
+        return [logs.get(tx_hash, []) for tx_hash in tx_hashes]
+
+
+def test_build_envy_data():
+    snapshot = make_snapshot()
+    calculator = TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        helper=LogsHelper("ethereum", snapshot.order_cache),
+        data_fetcher=PriceIndex("ethereum", snapshot.prices),
+    )
+    time = datetime.datetime(2024, 9, 27, 14, 0)
+    ucp_data = pl.DataFrame(
+        {
+            "call_tx_hash": ["0x01", "0x02", "0x03"],
+            "call_block_number": [30, 20, 10],
+            "call_block_time": [time] * 3,
+            "solver": ["0xaa", "0xbb", "0xcc"],
+        }
+    )
+
+    def envy(pool: str, trade_envy: float, trade_index: int) -> dict:
+        return {
+            "pool": pool,
+            "trade_envy": trade_envy,
+            "trade_index": trade_index,
+            "surplus_token1": 2e18,
+            "conversion_rate": 1.0,
+            "gas_price": 10,
+            "gas_cost_estimate": 100_000,
+        }
+
+    envy_data = calculator.build_envy_data(
+        ucp_data,
+        [
+            [envy(USDC_WETH, 0.5, 0), envy(BAL_WETH, -0.25, 2)],
+            [],  # no envy, dummy row
+            [envy(BAL_WETH, 1.5, 0)],
+        ],
+    )
+
+    # output of the pandas implementation before the polars pipeline
+    expected = pd.DataFrame(
+        {
+            "call_tx_hash": ["0x01", "0x01", "0x02", "0x03"],
+            "block_number": [30, 30, 20, 10],
+            "block_time": pd.Series([time] * 4, dtype="datetime64[us]"),
+            "trade_index": [0, 2, -1, 0],
+            "pool": [USDC_WETH, BAL_WETH, None, BAL_WETH],
+            "pool_name": ["USDC-WETH", "BAL-WETH", None, "BAL-WETH"],
+            "solver": ["0xaa", "0xaa", "0xbb", "0xcc"],
+            "trade_envy": [0.5, -0.25, None, 1.5],
+            "pool_used_already": pd.Series([True, False, None, False], dtype=object),
+            "surplus_token1": [2e18, 2e18, None, 2e18],
+            "conversion_rate": [1.0, 1.0, None, 1.0],
+            "gas_price": [10.0, 10.0, None, 10.0],
+            "gas_cost_estimate": [100_000.0, 100_000.0, None, 100_000.0],
+        }
+    )
+    assert list(envy_data.columns) == ENVY_COLUMNS
+    pd.testing.assert_frame_equal(envy_data, expected)
+    # null for the dummy row, False if the pool is not in the logs
+    assert envy_data["pool_used_already"].tolist() == [True, False, None, False]
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, EnvyCalculatorConfig
+from cow_amm_trade_envy.datasources import DataFetcher
+from cow_amm_trade_envy.envy_calculation import TradeEnvyCalculator
+from cow_amm_trade_envy.models import pools_factory, tokens_factory
+from cow_amm_trade_envy.repricing import EnvyRepricer
+
+POOLS = {pool.NAME: pool for pool in pools_factory("ethereum").get_pools()}
+WETH_UNI = POOLS["WETH-UNI"]
+USDC_WETH = POOLS["USDC-WETH"]
+TOKENS = tokens_factory("ethereum")
+
+
+def make_repricer(pg_config) -> EnvyRepricer:
+    data_fetcher = DataFetcher(DataFetcherConfig("ethereum", 0, pg_config))
+    TradeEnvyCalculator(
+        EnvyCalculatorConfig(network="ethereum"),
+        data_fetcher.config,
+        data_fetcher=data_fetcher,
+    ).create_envy_table()
+    db_manager = data_fetcher.db_manager
+    with db_manager.connect() as conn, conn.cursor() as cursor:
+        # (tx, block, pool, trade_envy, surplus_token1, conversion_rate, gas_price,
+        # gas_cost_estimate)
+        rows = [
+            # no price at or before the block, the rate is kept
+            ("0x01", 100, WETH_UNI.ADDRESS, 0, 10**18, 2, 0, 0),
+            ("0x02", 200, WETH_UNI.ADDRESS, 0, 10**21, 1, 10**9, 10**6),
+            # token1 is the native token
+            ("0x03", 200, USDC_WETH.ADDRESS, 1, 10**18, 1, 0, 0),
+            # calculated before the components were stored
+            ("0x04", 200, WETH_UNI.ADDRESS, 7, None, None, None, None),
+        ]
+        for row in rows:
+            cursor.execute(
+                """
+                INSERT INTO trade_envy.ethereum_envy (call_tx_hash, block_number,
+                    trade_index, pool, trade_envy, surplus_token1, conversion_rate,
+                    gas_price, gas_cost_estimate)
+                VALUES (%s, %s, 0, %s, %s, %s, %s, %s, %s)
+                """,
+                row,
+            )
+        for token, price in [(TOKENS.UNI, 3), (TOKENS.WETH, 6000)]:
+            data_fetcher.create_price_table(token.address)
+            cursor.execute(
+                f"INSERT INTO trade_envy.ethereum_{token.address}_price VALUES (150, %s)",
+                (price,),
+            )
+        conn.commit()
+    return EnvyRepricer(db_manager, "ethereum")
+
+
+def envy_by_tx(repricer: EnvyRepricer) -> dict:
+    with repricer.db_manager.connect() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT call_tx_hash, trade_envy, conversion_rate, gas_cost_estimate
+            FROM trade_envy.ethereum_envy
+            """
+        )
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def test_refresh_rates_keeps_rates_without_prices(pg_config, caplog):
+    repricer = make_repricer(pg_config)
+    assert repricer.reprice(refresh_rates=True) == 2
+    assert "Kept the conversion rate of 1 ethereum envy rows" in caplog.text
+
+    envy = envy_by_tx(repricer)
+    assert envy["0x01"] == (Decimal(2), Decimal(2), 0)
+    # 10**21 * 3 / 6000 - 10**9 * 10**6 atoms
+    assert envy["0x02"] == (Decimal("0.499"), Decimal("0.0005"), 10**6)
+    assert envy["0x03"] == (Decimal(1), Decimal(1), 0)
+    assert envy["0x04"] == (Decimal(7), None, None)
+
+
+def test_reprice_with_gas_cost_estimate(pg_config):
+    repricer = make_repricer(pg_config)
+    repricer.reprice()
+    assert repricer.reprice(gas_cost_estimate=0) == 1
+    assert repricer.reprice(gas_cost_estimate=0) == 0
+    envy = envy_by_tx(repricer)
+    assert envy["0x02"] == (Decimal(1000), Decimal(1), 0)
+    assert envy["0x01"] == (Decimal(2), Decimal(2), 0)
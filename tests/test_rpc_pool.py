@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cow_amm_trade_envy import rpc
+from cow_amm_trade_envy.instrumentation import instrumentation
+from cow_amm_trade_envy.rpc import (
+    PooledHTTPProvider,
+    RateController,
+    Web3Helper,
+    get_endpoint,
+)
+
+
+class LocalNode:
+    """JSON-RPC endpoint on localhost that answers every request with 0x01 (also in
+    batches), after `delay` seconds or with HTTP `status`. The first `throttle`
+    requests are answered with 429 and `Retry-After: 0`."""
+
+    def __init__(self, delay: float = 0.0, status: int = 200, throttle: int = 0):
+        self.delay = delay
+        self.status = status
+        self.throttle = throttle
+        self.requests = 0
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                node.requests += 1
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                time.sleep(node.delay)
+                if node.requests <= node.throttle:
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if node.status != 200:
+                    self.send_error(node.status)
+                    return
+
+                def answer(request):
+                    return {"jsonrpc": "2.0", "id": request["id"], "result": "0x01"}
+
+                if isinstance(request, list):
+                    body = [answer(r) for r in request]
+                else:
+                    body = answer(request)
+                body = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v2/secret"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(**kwargs) -> LocalNode:
+        started.append(LocalNode(**kwargs))
+        return started[-1]
+
+    yield start
+    for node in started:
+        node.close()
+    instrumentation.reset()
+
+
+def test_failover(nodes):
+    broken, healthy = nodes(status=503), nodes()
+    provider = PooledHTTPProvider([broken.url, healthy.url])
+
+    # untried endpoints are tried in order, the broken one fails over
+    assert provider.make_request("eth_call", [{}, "0x1"])["result"] == "0x01"
+    assert (broken.requests, healthy.requests) == (1, 1)
+    assert instrumentation.counters["rpc_failover"] == 1
+
+    # the broken endpoint is skipped during its cooldown
+    assert provider.make_request("eth_blockNumber", [])["result"] == "0x01"
+    assert (broken.requests, healthy.requests) == (1, 2)
+
+
+def test_prefers_fast_endpoint(nodes):
+    slow, fast = nodes(delay=0.05), nodes()
+    provider = PooledHTTPProvider([slow.url, fast.url])
+    for _ in range(20):
+        provider.make_request("eth_call", [{}, "0x1"])
+    assert slow.requests == 1
+    assert fast.requests == 19
+    # the observations are shared with other clients of the endpoint
+    assert get_endpoint(slow.url).latency >= 0.05
+    assert get_endpoint(slow.url).name == "127.0.0.1"
+
+
+def test_hedged_eth_call(nodes):
+    slow, fast = nodes(delay=2), nodes()
+    provider = PooledHTTPProvider([slow.url, fast.url], hedge_after=0.05)
+
+    start = time.perf_counter()
+    assert provider.make_request("eth_call", [{}, "0x1"])["result"] == "0x01"
+    assert time.perf_counter() - start < 1
+    assert instrumentation.counters["rpc_hedged"] == 1
+    assert instrumentation.counters["rpc_hedge_won"] == 1
+
+
+def test_web3_helper_with_several_urls(nodes):
+    broken, healthy = nodes(status=429), nodes()
+    w3_helper = Web3Helper(f"{broken.url}, {healthy.url}")
+    assert w3_helper.get_block_number() == 1
+    # batched eth_calls
+    calls = [("0x" + "22" * 20, "0x" + "11" * 20, block) for block in range(3)]
+    assert w3_helper.balance_of_batch(calls) == [1, 1, 1]
+    assert broken.requests == 1
+
+
+def test_throttled_requests_are_retried(nodes):
+    node = nodes(throttle=3)
+    provider = PooledHTTPProvider([node.url])
+    assert provider.make_request("eth_call", [{}, "0x1"])["result"] == "0x01"
+    assert node.requests == 4
+    assert instrumentation.counters["rpc_throttled"] == 3
+
+    # halved once, the 429s in a row came within the decrease interval, then the
+    # successful retry adds 1/rate
+    controller = get_endpoint(node.url).controller
+    assert controller.rate == 25 + 1 / 25
+    assert controller.concurrency == 4
+    assert not controller.slow_start
+    assert instrumentation.gauges["rpc_rate_limit[127.0.0.1]"] == controller.rate
+
+
+def test_slot_is_released_on_other_errors(nodes, monkeypatch):
+    node = nodes()
+    provider = PooledHTTPProvider([node.url])
+    (endpoint,) = provider.endpoints
+
+    class InterruptedSession:
+        def post(self, *args, **kwargs):
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(rpc, "shared_session", InterruptedSession)
+    with pytest.raises(KeyboardInterrupt):
+        provider.post(endpoint, b"{}")
+    assert endpoint.controller.in_flight == 0
+    # no decrease, it was not the endpoint
+    assert endpoint.controller.rate == 50
+
+
+def test_rate_controller():
+    controller = RateController("node", rate=2, concurrency=2, decrease_interval=0)
+
+    # slow start: the limits grow while they are reached
+    controller.acquire()
+    controller.acquire()
+    controller.release("success")
+    assert (controller.rate, controller.concurrency) == (3, 3)
+    controller.release("success")
+    assert (controller.rate, controller.concurrency) == (4, 3)
+
+    # the token bucket is empty, waits for a token
+    start = time.perf_counter()
+    controller.acquire()
+    assert time.perf_counter() - start > 0.2
+    controller.release("throttled")
+    assert (controller.rate, controller.concurrency) == (2, 1.5)
+
+    # congestion avoidance
+    controller.acquire()
+    controller.release("success")
+    assert controller.rate == 2.5
+    assert controller.concurrency == 1.5 + 1 / 1.5
+    controller.acquire()
+    controller.release("failed")
+    assert controller.rate == 2.5
+    assert controller.in_flight == 0
+    assert instrumentation.gauges["rpc_concurrency_limit[node]"] == 2
+    instrumentation.reset()
+
+
+def test_concurrency_limit():
+    controller = RateController("node", rate=100, concurrency=1)
+    controller.acquire()
+    blocked = threading.Thread(target=controller.acquire)
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    controller.release("success")
+    blocked.join(1)
+    assert not blocked.is_alive()
+    assert controller.in_flight == 1
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pandas as pd
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+from cow_amm_trade_envy.settlement_source import NodeSettlementSource
+
+TESTS_DIR = os.path.dirname(__file__)
+# recorded responses for the first settlement of data/cow_amm_ucp.csv and a settle call
+# through another contract
+FIXTURE = os.path.join(TESTS_DIR, "fixtures", "node_settlements.json")
+
+
+class RecordedProvider(JSONBaseProvider):
+    """Answers requests from recorded node responses, keyed by the first parameter."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path) as f:
+            self.responses = json.load(f)
+        self.methods = []
+
+    def make_request(self, method, params):
+        self.methods.append(method)
+        result = self.responses[method]
+        if isinstance(result, dict):
+            result = result[params[0]]
+        return {"jsonrpc": "2.0", "id": 1, "result": result}
+
+    def make_batch_request(self, requests):
+        return [self.make_request(method, params) for method, params in requests]
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+class RecordedWeb3Helper:
+    def __init__(self, provider: RecordedProvider):
+        self.w3 = Web3(provider)
+
+    def to_checksum_address(self, address: str) -> str:
+        return self.w3.to_checksum_address(address)
+
+
+def test_node_settlement_source():
+    provider = RecordedProvider(FIXTURE)
+    source = NodeSettlementSource(RecordedWeb3Helper(provider), interval_length=10)
+    block_num = 20842716
+    df = source.fetch(block_num - 15, block_num + 4)
+
+    # one getLogs per interval, the second settlement is not a direct settle call
+    assert provider.methods.count("eth_getLogs") == 2
+    assert len(df) == 1
+    assert len(source.skipped_tx_hashes) == 1
+    assert source.skipped_tx_hashes[0] != df["call_tx_hash"][0]
+
+    # same format as the Dune results
+    expected = pd.read_csv(
+        os.path.join(TESTS_DIR, "..", "data", "cow_amm_ucp.csv"), nrows=1, dtype=str
+    ).iloc[0]
+    row = df.row(0, named=True)
+    for column in ["call_tx_hash", "tokens", "clearing_prices", "trades"]:
+        assert row[column] == expected[column]
+    assert row["call_block_number"] == block_num
+    assert row["gas_price"] == int(expected["gas_price"])
+    assert row["solver"] == "0x95480d3f27658e73b2785d30beb0c847d78294c7"
+    assert str(row["call_block_time"]) == "2024-09-27 14:36:35"
+    assert row["interactions"].startswith(
+        '[[] [{"target":"0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48","value":0,'
+    )
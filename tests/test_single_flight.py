@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cow_amm_trade_envy.configs import DataFetcherConfig, PGConfig
+from cow_amm_trade_envy.datasources import BCoWHelper
+
+N_CALLERS = 16
+
+
+def make_helper() -> BCoWHelper:
+    return BCoWHelper(
+        DataFetcherConfig("ethereum", 0, PGConfig("postgresql://u:p@localhost:1/db"))
+    )
+
+
+def call_concurrently(helper: BCoWHelper, fn) -> list:
+    """Calls single_flight with the same key from N_CALLERS threads; fn only returns
+    once all of them are waiting."""
+    release = threading.Event()
+    calls = []
+
+    def blocking_fn():
+        calls.append(threading.get_ident())
+        assert release.wait(5)
+        return fn()
+
+    with ThreadPoolExecutor(N_CALLERS) as executor:
+        futures = [
+            executor.submit(helper.single_flight, "key", blocking_fn)
+            for _ in range(N_CALLERS)
+        ]
+        deadline = time.monotonic() + 5
+        while helper.n_requests < N_CALLERS and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+    assert len(calls) == 1
+    return outcomes
+
+
+def test_identical_keys_share_one_call():
+    helper = make_helper()
+    results = call_concurrently(helper, lambda: ["order"])
+    assert all(result is results[0] for result in results)
+    assert results[0] == ["order"]
+    assert (helper.n_requests, helper.n_unique) == (N_CALLERS, 1)
+    assert helper.dedup_ratio == 1 - 1 / N_CALLERS
+
+    # later callers get the stored result
+    assert helper.single_flight("key", lambda: ["other"]) is results[0]
+
+
+def test_exception_reaches_every_waiter():
+    helper = make_helper()
+    error = ValueError("execution reverted")
+
+    def fail():
+        raise error
+
+    outcomes = call_concurrently(helper, fail)
+    assert all(outcome is error for outcome in outcomes)
+
+    # failures are not kept, the next call runs again
+    assert helper.single_flight("key", lambda: ["order"]) == ["order"]
+    with pytest.raises(ValueError):
+        helper.single_flight("other", fail)
+
+
+def test_dedup_ratio():
+    helper = make_helper()
+    helper.single_flight("order_key", lambda: ["order"])
+    helper.single_flight("order_key", lambda: ["order"])
+    assert (helper.n_requests, helper.n_unique) == (2, 1)
+    assert helper.dedup_ratio == 0.5
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+import psycopg2
+import pytest
+
+from cow_amm_trade_envy.configs import PGConfig
+from cow_amm_trade_envy.datasources import DatabaseManager
+
+
+def imported_modules(code: str) -> set:
+    # fresh interpreter, the test process has everything imported already
+    output = subprocess.run(
+        [sys.executable, "-c", code + "; import sys; print(' '.join(sys.modules))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return set(output.split())
+
+
+def test_import_does_not_load_web3():
+    modules = imported_modules("import cow_amm_trade_envy.main")
+    assert "web3" not in modules
+    assert "eth_utils" not in modules
+
+
+def test_construction_without_node_or_db():
+    modules = imported_modules(
+        "from cow_amm_trade_envy.configs import DataFetcherConfig, PGConfig;"
+        "from cow_amm_trade_envy.datasources import BCoWHelper, DataFetcher;"
+        "config = DataFetcherConfig('ethereum', 0, PGConfig('postgresql://u:p@localhost:1/db'));"
+        "DataFetcher(config); BCoWHelper(config)"
+    )
+    assert "web3" not in modules
+
+
+def test_failed_table_initialization_is_retried(monkeypatch):
+    db = DatabaseManager(0, PGConfig("postgresql://u:p@localhost:1/db"))
+    with pytest.raises(psycopg2.OperationalError):
+        db.connect()
+    assert not db.tables_initialized
+
+    calls = []
+    monkeypatch.setattr(db, "initialize_tables", lambda: calls.append(1))
+    monkeypatch.setattr(db, "open_connection", lambda: "conn")
+    assert db.connect() == "conn"
+    assert db.connect() == "conn"
+    assert calls == [1] and db.tables_initialized